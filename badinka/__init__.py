@@ -19,26 +19,85 @@ __version__ = '0.1'
 
 from ._conductor import Conductor
 from ._config import Config
-from ._documents import Document, DocumentStore, Query, DocumentList
+from ._documents import Document, DocumentStore, Query, DocumentList, \
+    ParentDocument, SyncReport
+from ._embeddings import EmbeddingCache
+from ._buffering import WriteBehindBuffer, WriteFailure
+from ._chunking import Chunker, SentenceChunker, ParagraphChunker, \
+    TokenChunker, ParentChunker
+from ._filters import Filter, Eq, Ne, Gt, Gte, Lt, Lte, In, NotIn, Range, \
+    Contains, NotContains, And, Or
+from ._lexical import LexicalIndex
+from ._dedup import MinHashIndex, DedupStats
+from ._backends import IndexSettings
+from ._tuning import IndexReport, evaluate_index_settings, \
+    index_settings_grid, recommend_index_settings
+from ._quantization import Codec, Float16Codec, Int8Codec, CodecReport, \
+    evaluate_codecs
+from ._ingestion import Pipeline, IngestReport, Loader, TextLoader, \
+    MarkdownLoader, JsonlLoader
 from ._generation import Generator, Prompt, Reply, Instruction, \
     Options, Injection, Chain
 from ._tools import Tool
 
 
 __all__ = [
+    'And',
     'Chain',
+    'Chunker',
+    'Codec',
+    'CodecReport',
     'Conductor',
     'Config',
+    'Contains',
+    'DedupStats',
     'Document',
     'DocumentStore',
+    'EmbeddingCache',
+    'Eq',
+    'Filter',
+    'Float16Codec',
     'Generator',
+    'Gt',
+    'Gte',
+    'In',
+    'IndexReport',
+    'IndexSettings',
+    'IngestReport',
     'Injection',
     'Instruction',
+    'Int8Codec',
+    'JsonlLoader',
+    'Loader',
+    'LexicalIndex',
     'LogConfig',
+    'Lt',
+    'Lte',
+    'MarkdownLoader',
+    'MinHashIndex',
+    'Ne',
+    'NotContains',
+    'NotIn',
+    'Or',
+    'ParagraphChunker',
+    'ParentChunker',
+    'ParentDocument',
+    'Pipeline',
     'Prompt',
     'Query',
+    'Range',
     'Reply',
+    'SentenceChunker',
+    'SyncReport',
+    'TextLoader',
+    'TokenChunker',
     'Tool',
+    'WriteBehindBuffer',
+    'WriteFailure',
+    'evaluate_codecs',
+    'evaluate_index_settings',
+    'index_settings_grid',
+    'recommend_index_settings',
 
 ]
 
@@ -0,0 +1,761 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Vector store backends.
+
+A backend holds named collections. Collections have the interface of Chroma
+collections (`add`, `upsert`, `get`, `query`, `delete`, `count` and `peek`, with
+the same arguments and responses), so `DocumentStore` works the same way with
+every backend.
+
+The backend is chosen by the scheme of `Config.vector_store_path`:
+
+* `numpy://<path>` keeps collections in NumPy matrices, see `NumpyBackend`.
+  `numpy://:memory:` is not persisted.
+* `chroma://<path>`, or a path with no scheme, keeps collections in Chroma.
+
+The backend is not switched by the size of collections, since that would mean
+moving collections between stores as they grow. The NumPy backend switches
+from exact to indexed search at `Config.vector_index_threshold` vectors
+instead.
+"""
+
+import os
+import abc
+import json
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+from chromadb import EphemeralClient, PersistentClient
+
+from ._config import Config
+from ._filters import match_where, match_document
+from ._quantization import Codec, codec_for
+
+
+@dataclass
+class IndexSettings:
+  """The distance space and HNSW parameters of a collection.
+
+  The NumPy backend only uses the space, since it searches exactly or with an
+  `IvfIndex` instead of a graph.
+  """
+
+  #: The distance space, `l2`, `ip` or `cosine`.
+  space: str = 'l2'
+
+  #: The number of neighbours of each vector in the graph (`M`).
+  m: int = 16
+
+  #: The number of candidates considered while inserting.
+  ef_construction: int = 100
+
+  #: The number of candidates considered while searching.
+  ef_search: int = 100
+
+  @classmethod
+  def from_config(cls, config: Config) -> 'IndexSettings':
+    """The settings of new collections in a configuration."""
+    return cls(space=config.vector_space, m=config.hnsw_m,
+        ef_construction=config.hnsw_ef_construction,
+        ef_search=config.hnsw_ef_search)
+
+  def metadata(self) -> dict[str, any]:
+    """The Chroma collection metadata of the settings."""
+    return {
+        'hnsw:space': self.space,
+        'hnsw:M': self.m,
+        'hnsw:construction_ef': self.ef_construction,
+        'hnsw:search_ef': self.ef_search,
+    }
+
+
+class Backend(abc.ABC):
+  """A vector store holding named collections."""
+
+  @abc.abstractmethod
+  def collection(self, name: str, embedding_function,
+      metadata: dict[str, any] = None):
+    """Get or create a collection.
+
+    The metadata, which holds the index settings, is only used when the
+    collection is created.
+    """
+
+  @abc.abstractmethod
+  def names(self) -> list[str]:
+    """The names of the stored collections."""
+
+  def set_ef_search(self, name: str, ef_search: int) -> None:
+    """Change the search candidates of a stored collection.
+
+    This does nothing by default, for backends which don't search a graph.
+    """
+
+  def client(self):
+    """The Chroma client of a backend keeping its collections in Chroma."""
+    raise ValueError(f'{type(self).__name__} has no Chroma client')
+
+
+class ChromaBackend(Backend):
+  """Collections kept in Chroma."""
+
+  def __init__(self, path: str = ':memory:'):
+    #: The persistence path. When using `:memory:` nothing is persisted.
+    self.path = path
+
+  def client(self):
+    """Create a chromadb client."""
+    if self.path == ':memory:':
+      return EphemeralClient()
+    else:
+      return PersistentClient(self.path)
+
+  def collection(self, name, embedding_function, metadata=None):
+    return self.client().get_or_create_collection(
+        name,
+        embedding_function=embedding_function,
+        metadata=metadata,
+    )
+
+  def names(self):
+    return [c.name for c in self.client().list_collections()]
+
+  def set_ef_search(self, name, ef_search):
+    self.client().get_collection(name).modify(
+        configuration={'hnsw': {'ef_search': ef_search}})
+
+
+class NumpyBackend(Backend):
+  """Collections kept in NumPy matrices in process.
+
+  This avoids Chroma's start up time and per call overhead, which dominate the
+  latency of small and medium collections. Each collection keeps its vectors in
+  a float32 matrix, memory-mapped from `<path>/<name>/vectors.f32` when
+  persisted, and its IDs, documents and metadata in memory, persisted as an
+  append-only log in `<path>/<name>/records.jsonl`.
+
+  Searches compare a batch of queries with every vector in a few matrix
+  products. Once a collection holds `index_threshold` vectors, an `IvfIndex`
+  narrows each search to the vectors nearest the query instead.
+
+  Vectors can be kept in a compact form by a `Codec`, and searched in that form.
+  When `rerank` is set, the full vectors are also kept, on disk when persisted,
+  and the best candidates of each search are reranked with them.
+  """
+
+  def __init__(self, path: str = ':memory:', index_threshold: int = 50_000,
+      codec: Codec = None, rerank: int = 0):
+    #: The persistence path. When using `:memory:` nothing is persisted.
+    self.path = path
+    #: The collection size from which searches are approximate.
+    self.index_threshold = index_threshold
+    #: The codec of the searched vectors.
+    self.codec = codec
+    #: The number of candidates reranked for each result, or 0 for none.
+    self.rerank = rerank
+    self.collections: dict[str, NumpyCollection] = {}
+    self.lock = threading.Lock()
+
+  def collection(self, name, embedding_function, metadata=None):
+    with self.lock:
+      c = self.collections.get(name)
+      if c is None:
+        path = None
+        if self.path != ':memory:':
+          path = os.path.join(self.path, name)
+        c = NumpyCollection(name, path=path, metadata=metadata,
+            index_threshold=self.index_threshold, codec=self.codec,
+            rerank=self.rerank)
+        self.collections[name] = c
+    c.embedding_function = embedding_function
+    return c
+
+  def names(self):
+    names = set(self.collections)
+    if self.path != ':memory:' and os.path.isdir(self.path):
+      names.update(name for name in os.listdir(self.path) if os.path.exists(
+          os.path.join(self.path, name, 'collection.json')))
+    return sorted(names)
+
+
+def open_backend(config: Config) -> Backend:
+  """The backend for the configured vector store path."""
+  scheme, sep, path = config.vector_store_path.partition('://')
+  if not sep:
+    return ChromaBackend(config.vector_store_path)
+  match scheme:
+    case 'chroma':
+      return ChromaBackend(path)
+    case 'numpy':
+      return NumpyBackend(path,
+          index_threshold=config.vector_index_threshold,
+          codec=codec_for(config.vector_codec, config.vector_dimensions),
+          rerank=config.vector_rerank)
+  raise ValueError(f'unknown vector store scheme {scheme}')
+
+
+class NumpyCollection:
+  """A collection of documents and their vectors in NumPy matrices.
+
+  Documents are stored in rows, which are only ever appended. Replacing or
+  deleting a document leaves a dead row behind, and the rows are compacted once
+  most of them are dead.
+
+  A persisted collection keeps the codec it was created with.
+  """
+
+  #: The number of vectors compared with the queries at once.
+  block_size = 8192
+
+  #: The fraction of the index lists searched for each query.
+  probe_fraction = 0.1
+
+  def __init__(self, name: str, path: str = None,
+      metadata: dict[str, any] = None, index_threshold: int = 50_000,
+      codec: Codec = None, rerank: int = 0):
+    info = {}
+    if path and os.path.exists(os.path.join(path, 'collection.json')):
+      with open(os.path.join(path, 'collection.json')) as f:
+        info = json.load(f)
+      metadata = info['metadata']
+      codec = codec_for(info.get('codec', 'float32'), info.get('codec_dims'))
+      rerank = rerank if info.get('full') else 0
+    #: The collection name.
+    self.name = name
+    #: The persistence directory, or `None` for no persistence.
+    self.path = path
+    #: The collection metadata.
+    self.metadata = metadata
+    #: The collection size from which searches are approximate.
+    self.index_threshold = index_threshold
+    #: The codec of the searched vectors.
+    self.codec = codec or Codec()
+    #: The number of candidates reranked for each result, or 0 for none.
+    self.rerank = rerank
+    #: The dimensions of the vectors, once there are any.
+    self.dimensions: int = None
+    self.embedding_function = None
+    self.ids: list[str | None] = []
+    self.documents: list[str | None] = []
+    self.metadatas: list[dict[str, any] | None] = []
+    self.rows: dict[str, int] = {}
+    self.live = _Growable(np.bool_)
+    self.norms = _Growable(np.float32)
+    self.lists = _Growable(np.int32)
+    lossless = self.codec.lossless()
+    self.vectors = _Vectors(_join(path, 'vectors.f32' if lossless
+        else f'vectors.{self.codec.name}'), self.codec.dtype)
+    self.full: _Vectors = None
+    if rerank and not lossless:
+      self.full = _Vectors(_join(path, 'vectors.f32'), np.float32)
+    self.index: IvfIndex = None
+    self.lock = threading.RLock()
+    if info:
+      self._load(info)
+
+  @property
+  def space(self) -> str:
+    """The distance function, `l2` (squared), `ip` or `cosine`."""
+    return (self.metadata or {}).get('hnsw:space', 'l2')
+
+  def count(self) -> int:
+    return len(self.rows)
+
+  def add(self, ids, documents=None, metadatas=None, embeddings=None):
+    """Add documents, ignoring any whose IDs are already stored."""
+    _check_unique(ids)
+    with self.lock:
+      keep = [i for i, id in enumerate(ids) if id not in self.rows]
+      if len(keep) < len(ids):
+        ids, documents, metadatas, embeddings = (
+            _pick(c, keep) for c in (ids, documents, metadatas, embeddings))
+      self._put(ids, documents, metadatas, embeddings)
+
+  def upsert(self, ids, documents=None, metadatas=None, embeddings=None):
+    """Add documents, replacing any already stored with the same IDs."""
+    _check_unique(ids)
+    with self.lock:
+      self._put(ids, documents, metadatas, embeddings)
+
+  def delete(self, ids=None, where=None, where_document=None):
+    with self.lock:
+      rows = self._select(ids, where, where_document)
+      deleted = [self.ids[r] for r in rows]
+      for id in deleted:
+        self._drop(id)
+      if deleted:
+        self._log([{'delete': deleted}])
+        self._compact()
+
+  def get(self, ids=None, where=None, where_document=None, limit=None,
+      offset=None, include=('documents', 'metadatas')):
+    with self.lock:
+      rows = self._select(ids, where, where_document)
+      start = offset or 0
+      rows = rows[start:None if limit is None else start + limit]
+      return self._response(rows, include)
+
+  def peek(self, limit: int = 10):
+    return self.get(limit=limit, include=['documents', 'metadatas',
+        'embeddings'])
+
+  def query(self, query_embeddings=None, query_texts=None, n_results=10,
+      where=None, where_document=None,
+      include=('documents', 'metadatas', 'distances')):
+    if query_embeddings is None:
+      query_embeddings = self.embedding_function(query_texts)
+    queries = np.asarray(query_embeddings, dtype=np.float32)
+    fetch = n_results * self.rerank if self.full is not None else n_results
+    response = {k: [] for k in ('ids', 'documents', 'metadatas', 'embeddings',
+        'distances')}
+    with self.lock:
+      candidates = None
+      if where or where_document:
+        candidates = np.array(self._select(None, where, where_document),
+            dtype=np.int64)
+      results = self._search(self.codec.truncate(queries), candidates, fetch)
+      if fetch > n_results:
+        results = self._rerank(queries, results, n_results)
+      for rows, distances in results:
+        found = self._response(rows.tolist(), include)
+        found['distances'] = distances.tolist()
+        for k in response:
+          response[k].append(found[k])
+    response = {k: v if k in include or k == 'ids' else None
+                for k, v in response.items()}
+    response['included'] = list(include)
+    return response
+
+  def _search(self, queries, candidates, k):
+    """The nearest `(rows, distances)` to each query, nearest first."""
+    if self.dimensions is None or not self.rows:
+      return [(np.zeros(0, np.int64), np.zeros(0, np.float32))] * len(queries)
+    if candidates is None:
+      candidates = np.flatnonzero(self.live.view())
+    if len(self.rows) < self.index_threshold or len(candidates) <= k:
+      return list(zip(*self._exact(queries, candidates, k)))
+    self._train()
+    probes = max(1, round(self.probe_fraction * len(self.index.centroids)))
+    probed = self.index.probe(self._normalized(queries), probes)
+    lists = self.lists.view()[candidates]
+    # The queries are compared with the union of the vectors in their probed
+    # lists, so the vectors are only gathered once, and each query only ranks
+    # those in its own lists.
+    near = np.isin(lists, probed)
+    allowed = np.stack([np.isin(lists[near], p) for p in probed])
+    if allowed.sum(axis=1).min() < k:
+      return list(zip(*self._exact(queries, candidates, k)))
+    return list(zip(*self._exact(queries, candidates[near], k, allowed)))
+
+  def _exact(self, queries, candidates, k, allowed=None):
+    """Compare the queries with every candidate, a block at a time.
+
+    Candidates which aren't `allowed` for a query are never found by it.
+    """
+    m = len(queries)
+    best = np.zeros((m, 0), np.float32)
+    best_rows = np.zeros((m, 0), np.int64)
+    for start in range(0, len(candidates), self.block_size):
+      rows = candidates[start:start + self.block_size]
+      distances = self._distances(queries, rows)
+      if allowed is not None:
+        distances[~allowed[:, start:start + self.block_size]] = np.inf
+      best = np.concatenate([best, distances], axis=1)
+      best_rows = np.concatenate(
+          [best_rows, np.broadcast_to(rows, (m, len(rows)))], axis=1)
+      if best.shape[1] > k:
+        top = np.argpartition(best, k - 1, axis=1)[:, :k]
+        best = np.take_along_axis(best, top, axis=1)
+        best_rows = np.take_along_axis(best_rows, top, axis=1)
+    order = np.argsort(best, axis=1, kind='stable')
+    return (np.take_along_axis(best_rows, order, axis=1),
+        np.take_along_axis(best, order, axis=1))
+
+  def _rerank(self, queries, results, k):
+    """Reorder each query's candidates by their distance to the full vectors."""
+    reranked = []
+    for query, (rows, distances) in zip(queries, results):
+      if len(rows):
+        rows = np.sort(rows)
+        distances = self._distances(query[None], rows, full=True)[0]
+        top = np.argsort(distances, kind='stable')[:k]
+        rows, distances = rows[top], distances[top]
+      reranked.append((rows, distances))
+    return reranked
+
+  def _distances(self, queries, rows, full=False):
+    if rows[-1] - rows[0] + 1 == len(rows):
+      # Consecutive rows are read in place rather than copied.
+      rows = slice(rows[0], rows[-1] + 1)
+    if full:
+      vectors = self.full.view()[rows]
+      norms = np.einsum('ij,ij->i', vectors, vectors)
+    else:
+      vectors = self._decoded(rows)
+      norms = self.norms.view()[rows]
+    dots = queries @ vectors.T
+    match self.space:
+      case 'l2':
+        squares = np.einsum('ij,ij->i', queries, queries)
+        return np.maximum(norms + squares[:, None] - 2 * dots, 0)
+      case 'ip':
+        return 1 - dots
+      case 'cosine':
+        lengths = np.linalg.norm(queries, axis=1)[:, None]
+        return 1 - dots / np.maximum(lengths * np.sqrt(norms), 1e-12)
+    raise ValueError(f'unknown distance function {self.space}')
+
+  def _normalized(self, vectors):
+    """Vectors as they are clustered by the index."""
+    if self.space != 'cosine':
+      return vectors
+    return vectors / np.maximum(
+        np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+  def _decoded(self, rows):
+    """The searched vectors of some rows."""
+    return self.codec.decode(self.vectors.view()[rows])
+
+  def _train(self):
+    """Train the index, and again each time the collection doubles."""
+    if self.index is not None and len(self.rows) <= 2 * self.index.trained:
+      return
+    live = np.flatnonzero(self.live.view())
+    rng = np.random.default_rng(0)
+    lists = int(np.sqrt(len(live)))
+    sample = np.sort(rng.choice(live, min(len(live), 64 * lists),
+        replace=False))
+    self.index = IvfIndex(lists)
+    self.index.train(self._normalized(self._decoded(sample)))
+    self.index.trained = len(live)
+    self.lists.size = 0
+    self.lists.extend(self._assign(0, self.vectors.rows))
+
+  def _assign(self, start, end):
+    """The index lists of a range of rows."""
+    if self.index is None:
+      return np.full(end - start, -1, np.int32)
+    lists = [np.zeros(0, np.int32)]
+    for s in range(start, end, self.block_size):
+      vectors = self._decoded(slice(s, min(s + self.block_size, end)))
+      lists.append(self.index.assign(self._normalized(vectors)))
+    return np.concatenate(lists)
+
+  def _select(self, ids, where, where_document) -> list[int]:
+    """The rows of the documents matching the IDs and filters."""
+    if ids is None:
+      rows = list(self.rows.values())
+    else:
+      rows = [self.rows[id] for id in dict.fromkeys(ids) if id in self.rows]
+    if where:
+      rows = [r for r in rows if match_where(where, self.metadatas[r])]
+    if where_document:
+      rows = [r for r in rows if match_document(where_document,
+          self.documents[r])]
+    return rows
+
+  def _response(self, rows, include):
+    return {
+        'ids': [self.ids[r] for r in rows],
+        'documents': [self.documents[r] for r in rows]
+            if 'documents' in include else None,
+        'metadatas': [self.metadatas[r] for r in rows]
+            if 'metadatas' in include else None,
+        'embeddings': self._embeddings(rows)
+            if 'embeddings' in include and self.dimensions else None,
+        'included': list(include),
+    }
+
+  def _embeddings(self, rows):
+    """The vectors of some rows, in full when they are kept."""
+    if self.full is not None:
+      return np.array(self.full.view()[rows])
+    return np.array(self._decoded(rows))
+
+  def _put(self, ids, documents, metadatas, embeddings):
+    if not ids:
+      return
+    documents = documents or [None] * len(ids)
+    metadatas = metadatas or [None] * len(ids)
+    if embeddings is None:
+      embeddings = self.embedding_function(documents)
+    vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+    codes = self.codec.encode(vectors)
+    if self.dimensions is None:
+      self.dimensions = vectors.shape[1]
+      self.vectors.open(codes.shape[1])
+      if self.full is not None:
+        self.full.open(self.dimensions)
+      self._save_info()
+    elif vectors.shape[1] != self.dimensions:
+      raise ValueError(f'expected embeddings with {self.dimensions} '
+          f'dimensions, got {vectors.shape[1]}')
+    first = self.vectors.append(codes)
+    if self.full is not None:
+      self.full.append(vectors)
+    decoded = self.codec.decode(codes)
+    self.norms.extend(np.einsum('ij,ij->i', decoded, decoded))
+    self.lists.extend(self._assign(first, first + len(ids)))
+    records = []
+    for row, (id, document, meta) in enumerate(
+        zip(ids, documents, metadatas), start=first):
+      self._place(id, row, document, meta)
+      records.append({'id': id, 'row': row, 'document': document,
+          'metadata': meta})
+    self._log(records)
+    self._compact()
+
+  def _place(self, id, row, document, meta):
+    self._drop(id)
+    self.ids.append(id)
+    self.documents.append(document)
+    self.metadatas.append(meta)
+    self.live.extend([True])
+    self.rows[id] = row
+
+  def _drop(self, id):
+    row = self.rows.pop(id, None)
+    if row is not None:
+      self.ids[row] = self.documents[row] = self.metadatas[row] = None
+      self.live.view()[row] = False
+
+  def _compact(self):
+    """Rewrite the rows without dead ones, once most of them are dead."""
+    dead = len(self.ids) - len(self.rows)
+    if dead < max(1024, len(self.rows)):
+      return
+    keep = np.flatnonzero(self.live.view())
+    self.vectors.rewrite(keep)
+    if self.full is not None:
+      self.full.rewrite(keep)
+    ids = [self.ids[r] for r in keep]
+    documents = [self.documents[r] for r in keep]
+    metadatas = [self.metadatas[r] for r in keep]
+    norms = self.norms.view()[keep]
+    self.ids, self.documents, self.metadatas = ids, documents, metadatas
+    self.rows = {id: row for row, id in enumerate(ids)}
+    for column, values in ((self.norms, norms),
+        (self.live, np.ones(len(ids), np.bool_))):
+      column.size = 0
+      column.extend(values)
+    self.index = None
+    self.lists.size = 0
+    self.lists.extend(self._assign(0, len(ids)))
+    if self.path:
+      records = os.path.join(self.path, 'records.jsonl')
+      with open(records + '.tmp', 'w') as f:
+        for row, id in enumerate(ids):
+          f.write(json.dumps({'id': id, 'row': row, 'document': documents[row],
+              'metadata': metadatas[row]}) + '\n')
+      os.replace(records + '.tmp', records)
+
+  def _log(self, records):
+    if not self.path:
+      return
+    with open(os.path.join(self.path, 'records.jsonl'), 'a') as f:
+      f.writelines(json.dumps(r) + '\n' for r in records)
+
+  def _save_info(self):
+    if not self.path:
+      return
+    os.makedirs(self.path, exist_ok=True)
+    with open(os.path.join(self.path, 'collection.json'), 'w') as f:
+      json.dump({
+          'dimensions': self.dimensions,
+          'metadata': self.metadata,
+          'codec': self.codec.name,
+          'codec_dims': self.codec.dims,
+          'width': self.vectors.width,
+          'full': self.full is not None,
+      }, f)
+
+  def _load(self, info):
+    self.dimensions = info['dimensions']
+    self.vectors.open(info.get('width', self.dimensions))
+    if self.full is not None:
+      self.full.open(self.dimensions)
+    records = os.path.join(self.path, 'records.jsonl')
+    if os.path.exists(records):
+      with open(records) as f:
+        for line in f:
+          r = json.loads(line)
+          if 'delete' in r:
+            for id in r['delete']:
+              self._drop(id)
+            continue
+          # Rows written without a record before a crash are left dead.
+          while len(self.ids) < r['row']:
+            self.ids.append(None)
+            self.documents.append(None)
+            self.metadatas.append(None)
+            self.live.extend([False])
+          self._place(r['id'], r['row'], r['document'], r['metadata'])
+    self.vectors.rows = len(self.ids)
+    if self.full is not None:
+      self.full.rows = len(self.ids)
+    for start in range(0, self.vectors.rows, self.block_size):
+      v = self._decoded(slice(start, start + self.block_size))
+      self.norms.extend(np.einsum('ij,ij->i', v, v))
+    self.lists.extend(self._assign(0, self.vectors.rows))
+
+
+class IvfIndex:
+  """An inverted file index for approximate nearest neighbour search.
+
+  Vectors are clustered around centroids found by k-means, and a search only
+  compares a query with the vectors in the few clusters nearest to it.
+  """
+
+  def __init__(self, lists: int):
+    #: The number of clusters.
+    self.lists = max(1, lists)
+    #: The cluster centroids.
+    self.centroids: np.ndarray = None
+    #: The collection size when the index was trained.
+    self.trained = 0
+
+  def train(self, vectors: np.ndarray, iterations: int = 10) -> None:
+    """Find the centroids of a sample of vectors."""
+    rng = np.random.default_rng(0)
+    lists = min(self.lists, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), lists, replace=False)].copy()
+    for _ in range(iterations):
+      labels = _nearest(vectors, centroids, 1)[:, 0]
+      sums = np.zeros_like(centroids)
+      np.add.at(sums, labels, vectors)
+      counts = np.bincount(labels, minlength=lists)
+      filled = counts > 0
+      centroids[filled] = sums[filled] / counts[filled, None]
+    self.centroids = centroids
+
+  def assign(self, vectors: np.ndarray) -> np.ndarray:
+    """The cluster of each vector."""
+    return _nearest(vectors, self.centroids, 1)[:, 0].astype(np.int32)
+
+  def probe(self, queries: np.ndarray, probes: int) -> np.ndarray:
+    """The `probes` clusters nearest each query."""
+    return _nearest(queries, self.centroids, min(probes, len(self.centroids)))
+
+
+def _nearest(vectors, centroids, k):
+  """The `k` centroids nearest each vector, in no particular order."""
+  d = (np.einsum('ij,ij->i', centroids, centroids)[None]
+      - 2 * vectors @ centroids.T)
+  if k >= d.shape[1]:
+    return np.broadcast_to(np.arange(d.shape[1]), d.shape)
+  if k == 1:
+    return np.argmin(d, axis=1)[:, None]
+  return np.argpartition(d, k - 1, axis=1)[:, :k]
+
+
+class _Growable:
+  """A NumPy array which grows by doubling its capacity."""
+
+  def __init__(self, dtype, width: int = None):
+    self.shape = () if width is None else (width,)
+    self.data = np.zeros((16,) + self.shape, dtype)
+    self.size = 0
+
+  def extend(self, values) -> None:
+    values = np.asarray(values, self.data.dtype)
+    end = self.size + len(values)
+    if end > len(self.data):
+      data = np.zeros((max(end, 2 * len(self.data)),) + self.shape,
+          self.data.dtype)
+      data[:self.size] = self.data[:self.size]
+      self.data = data
+    self.data[self.size:end] = values
+    self.size = end
+
+  def view(self) -> np.ndarray:
+    return self.data[:self.size]
+
+
+class _Vectors:
+  """A matrix of vector rows, memory-mapped from a file when one is given."""
+
+  def __init__(self, path: str = None, dtype=np.float32):
+    self.path = path
+    self.dtype = np.dtype(dtype)
+    self.width: int = None
+    self.rows = 0
+    self.memory: _Growable = None
+    self.mapped: np.ndarray = None
+
+  @property
+  def row_bytes(self) -> int:
+    return self.dtype.itemsize * self.width
+
+  def open(self, width: int) -> None:
+    self.width = width
+    if self.path is None:
+      self.memory = _Growable(self.dtype, width)
+    elif os.path.exists(self.path):
+      self.rows = os.path.getsize(self.path) // self.row_bytes
+
+  def append(self, vectors: np.ndarray) -> int:
+    """Append rows, returning the index of the first."""
+    first = self.rows
+    if self.memory is not None:
+      self.memory.extend(vectors)
+    else:
+      with open(self.path, 'ab') as f:
+        f.truncate(self.row_bytes * first)
+        f.write(np.ascontiguousarray(vectors, self.dtype).tobytes())
+      self.mapped = None
+    self.rows += len(vectors)
+    return first
+
+  def view(self) -> np.ndarray:
+    if self.memory is not None:
+      return self.memory.view()
+    if self.mapped is None or len(self.mapped) != self.rows:
+      self.mapped = np.zeros((0, self.width), self.dtype)
+      if self.rows:
+        self.mapped = np.memmap(self.path, dtype=self.dtype, mode='r',
+            shape=(self.rows, self.width))
+    return self.mapped
+
+  def rewrite(self, keep: np.ndarray) -> None:
+    """Keep only some rows, in order."""
+    if self.memory is not None:
+      kept = self.memory.view()[keep]
+      self.memory.size = 0
+      self.memory.extend(kept)
+    else:
+      with open(self.path + '.tmp', 'wb') as f:
+        for start in range(0, len(keep), 8192):
+          f.write(np.ascontiguousarray(
+              self.view()[keep[start:start + 8192]]).tobytes())
+      self.mapped = None
+      os.replace(self.path + '.tmp', self.path)
+    self.rows = len(keep)
+
+
+def _join(path, name):
+  return path and os.path.join(path, name)
+
+
+def _check_unique(ids):
+  if len(set(ids)) != len(ids):
+    raise ValueError('expected unique IDs in a single write')
+
+
+def _pick(column, positions):
+  return None if column is None else [column[i] for i in positions]
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
@@ -0,0 +1,172 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Write-behind buffering of document writes.
+
+Callers queue documents and return at once. A worker thread gathers queued
+documents into batches, and writes a batch once it holds `batch_size` documents
+or its oldest document has waited `interval` seconds. The queue is bounded, so
+callers block when the worker falls behind rather than using unbounded memory.
+"""
+
+import time
+import queue
+import threading
+from collections import abc
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+
+
+#: Stops the worker.
+_stop = object()
+
+#: How often, in seconds, waits for the worker check that it is still running.
+_poll = 1.0
+
+
+@dataclass
+class WriteFailure:
+  """A batch of buffered documents which could not be written."""
+
+  #: The collection written to.
+  collection_name: str
+
+  #: The documents which were not written.
+  docs: list
+
+  #: The error raised by the write.
+  error: Exception
+
+
+class WriteBehindBuffer:
+  """Buffers documents and writes them in batches on a worker thread.
+
+  Failed writes don't stop the worker. They are passed to `on_error`, and kept
+  until the next `flush`, which raises the first of their errors.
+  """
+
+  def __init__(self, write: abc.Callable[[list, str], None],
+      batch_size: int = 64, interval: float = 1.0, max_pending: int = 1024,
+      on_error: abc.Callable[[WriteFailure], None] = None):
+    #: Writes a batch of documents to a collection.
+    self.write = write
+    #: The number of documents written at once.
+    self.batch_size = batch_size
+    #: The longest time in seconds a document waits before it is written.
+    self.interval = interval
+    self.on_error = on_error
+    #: The failed writes since the last flush.
+    self.failures: list[WriteFailure] = []
+    #: The number of batches written.
+    self.batches = 0
+    self.requests = queue.Queue(max_pending)
+    self.closed = False
+    self._lock = threading.Lock()
+    self._worker = threading.Thread(target=self._run, daemon=True,
+        name='badinka-write-behind')
+    self._worker.start()
+
+  def put(self, docs: abc.Iterable, collection_name='default'):
+    """Queue documents to be written, blocking while the queue is full."""
+    if self.closed:
+      raise ValueError('write-behind buffer is closed')
+    for d in docs:
+      self.requests.put((collection_name, d))
+
+  def flush(self) -> None:
+    """Wait until the documents queued so far are written.
+
+    The first error of the writes which failed since the last flush is raised.
+    Writes made by the worker itself don't wait, since they are already in
+    order. A `RuntimeError` is raised if the worker has stopped.
+    """
+    if not self.closed and threading.current_thread() is not self._worker:
+      done = Future()
+      while True:
+        self._check_worker()
+        try:
+          self.requests.put(done, timeout=_poll)
+          break
+        except queue.Full:
+          pass
+      while True:
+        try:
+          done.result(_poll)
+          break
+        except FutureTimeoutError:
+          self._check_worker()
+    with self._lock:
+      failures, self.failures = self.failures, []
+    if failures:
+      raise failures[0].error
+
+  def close(self) -> None:
+    """Write the queued documents and stop the worker."""
+    if self.closed:
+      return
+    try:
+      self.flush()
+    finally:
+      self.closed = True
+      if self._worker.is_alive():
+        self.requests.put(_stop)
+        self._worker.join()
+
+  def _check_worker(self):
+    if not self._worker.is_alive():
+      raise RuntimeError('the write-behind worker has stopped')
+
+  def _run(self):
+    pending = []
+    deadline = None
+    while True:
+      try:
+        if deadline is None:
+          request = self.requests.get()
+        else:
+          request = self.requests.get(
+              timeout=max(deadline - time.monotonic(), 0))
+      except queue.Empty:
+        request = None
+      if isinstance(request, tuple):
+        pending.append(request)
+        if deadline is None:
+          deadline = time.monotonic() + self.interval
+        if len(pending) < self.batch_size:
+          continue
+      self._write(pending)
+      pending = []
+      deadline = None
+      if isinstance(request, Future):
+        request.set_result(None)
+      elif request is _stop:
+        return
+
+  def _write(self, pending):
+    groups = {}
+    for collection_name, d in pending:
+      groups.setdefault(collection_name, []).append(d)
+    for collection_name, docs in groups.items():
+      try:
+        self.write(docs, collection_name)
+        self.batches += 1
+      except Exception as e:
+        failure = WriteFailure(collection_name, docs, e)
+        with self._lock:
+          self.failures.append(failure)
+        if self.on_error is not None:
+          self.on_error(failure)
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
@@ -0,0 +1,193 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Splitting text into documents.
+
+Chunkers find the boundaries of units (sentences, paragraphs or tokens) in a
+single pass over the text, and then cut windows of `size` units which share
+`overlap` units with the previous window. Window offsets are computed with array
+arithmetic over the boundaries, so the text itself is only sliced once per
+window, which keeps chunking fast on very large texts.
+"""
+
+import re
+from collections.abc import Iterator
+
+import numpy as np
+
+from ._documents import Document, ParentDocument, stable_id
+
+
+class Chunker:
+  """Splits text into overlapping windows of units."""
+
+  #: The pattern matching the gap between two units.
+  separator: re.Pattern = None
+
+  def __init__(self, size: int = 4, overlap: int = 1):
+    if not 0 <= overlap < size:
+      raise ValueError(f'overlap must be less than size, got {overlap}')
+    #: The number of units in each window.
+    self.size = size
+    #: The number of units shared with the previous window.
+    self.overlap = overlap
+
+  def boundaries(self, text: str) -> np.ndarray:
+    """The start offset of each unit, followed by the length of the text."""
+    starts = np.fromiter(map(re.Match.end, self.separator.finditer(text)),
+        dtype=np.int64)
+    return np.concatenate(([0], starts, [len(text)]))
+
+  def spans(self, text: str) -> Iterator[tuple[int, int]]:
+    """The `(start, end)` offsets of each window."""
+    b = self.boundaries(text)
+    units = len(b) - 1
+    first = np.arange(0, max(units - self.overlap, 1), self.size - self.overlap)
+    last = np.minimum(first + self.size, units)
+    return zip(b[first].tolist(), b[last].tolist())
+
+  def chunk(self, text: str, source: str = None, offset: int = 0,
+      meta: dict[str, any] = None, byte_offset: int = None) -> list[Document]:
+    """Split the text into documents.
+
+    Each document records its source and its `start` and `end` character
+    offsets in the source. When the byte offset of the text in a UTF-8 source
+    file is given, documents also record their `byte_start` and `byte_end` in
+    the file. When a source is given, documents have stable IDs derived from the
+    source, their start offset and their content, so that repeated text in a
+    source gives distinct documents.
+    """
+    docs = []
+    bytes_before = None if byte_offset is None else _utf8_offsets(text)
+    for start, end in self.spans(text):
+      raw = text[start:end]
+      content = raw.strip()
+      if not content:
+        continue
+      start += len(raw) - len(raw.lstrip())
+      doc_meta = dict(meta or {},
+          start=offset + start,
+          end=offset + start + len(content),
+      )
+      if bytes_before is not None:
+        doc_meta['byte_start'] = byte_offset + int(bytes_before[start])
+        doc_meta['byte_end'] = byte_offset + int(
+            bytes_before[start + len(content)])
+      if source is None:
+        docs.append(Document(content=content, meta=doc_meta))
+      else:
+        doc_meta['source'] = source
+        docs.append(Document(content=content, meta=doc_meta,
+            id=stable_id(source, f'{offset + start}:{content}')))
+    return docs
+
+  def __call__(self, segment) -> list[Document]:
+    """Split an ingestion segment into documents."""
+    return self.chunk(segment.text, source=segment.source,
+        offset=segment.offset, meta=segment.meta,
+        byte_offset=segment.byte_offset)
+
+
+class SentenceChunker(Chunker):
+  """Chunks text into windows of sentences."""
+
+  separator = re.compile(r'(?<=[.!?])\s+')
+
+
+class ParagraphChunker(Chunker):
+  """Chunks text into windows of paragraphs separated by blank lines."""
+
+  separator = re.compile(r'\n\s*\n')
+
+  def __init__(self, size: int = 1, overlap: int = 0):
+    super().__init__(size, overlap)
+
+
+class TokenChunker(Chunker):
+  """Chunks text into windows of tokens.
+
+  Tokens are approximated as runs of word characters and individual punctuation
+  characters, which is close to the number of tokens a model sees for most
+  English text. Token starts are found with array operations over the code
+  points of the text, treating all non-ASCII characters as word characters.
+  """
+
+  def __init__(self, size: int = 256, overlap: int = 32):
+    super().__init__(size, overlap)
+
+  def boundaries(self, text):
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    codes = np.minimum(codes, 128)
+    word = _word[codes]
+    punctuation = ~word & ~_space[codes]
+    follows_word = np.concatenate(([False], word[:-1]))
+    starts = np.flatnonzero((word & ~follows_word) | punctuation)
+    if not len(starts):
+      return np.array([0, len(text)])
+    starts[0] = 0
+    return np.concatenate((starts, [len(text)]))
+
+
+class ParentChunker:
+  """Splits text into parents, and each parent into small children.
+
+  Children are embedded and matched precisely, and point to their parent with a
+  `parent_id` in their metadata. Parents are stored once without embeddings and
+  give matched children their context, see `DocumentStore.expand`. This needs
+  less embedding and a smaller index than overlapping windows of the same size
+  as the parents. Parents should not overlap, so that each child has only one.
+  """
+
+  def __init__(self, parent: Chunker = None, child: Chunker = None):
+    #: The chunker splitting text into parents, by default into paragraphs.
+    self.parent = parent or ParagraphChunker()
+    #: The chunker splitting parents into children, by default into sentences.
+    self.child = child or SentenceChunker(size=1, overlap=0)
+
+  def chunk(self, text: str, source: str = None, offset: int = 0,
+      meta: dict[str, any] = None, byte_offset: int = None) -> list[Document]:
+    """Split the text into parent documents, each followed by its children."""
+    docs = []
+    for p in self.parent.chunk(text, source=source, offset=offset, meta=meta,
+        byte_offset=byte_offset):
+      docs.append(ParentDocument(content=p.content, id=p.id, meta=p.meta))
+      for child in self.child.chunk(p.content, source=source,
+          offset=p.meta['start'], meta=meta,
+          byte_offset=p.meta.get('byte_start')):
+        child.meta['parent_id'] = p.id
+        docs.append(child)
+    return docs
+
+  def __call__(self, segment) -> list[Document]:
+    """Split an ingestion segment into documents."""
+    return self.chunk(segment.text, source=segment.source,
+        offset=segment.offset, meta=segment.meta,
+        byte_offset=segment.byte_offset)
+
+
+def _utf8_offsets(text: str) -> np.ndarray:
+  """The UTF-8 byte offset of each character of the text, and of its end."""
+  codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+  widths = 1 + (codes >= 0x80) + (codes >= 0x800) + (codes >= 0x10000)
+  return np.concatenate(([0], np.cumsum(widths, dtype=np.int64)))
+
+
+#: Lookup tables of ASCII word and space characters. Index 128 stands for all
+#: non-ASCII characters.
+_word = np.array([chr(i).isalnum() or chr(i) == '_' for i in range(128)] +
+    [True])
+_space = np.array([chr(i).isspace() for i in range(128)] + [False])
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
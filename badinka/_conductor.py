@@ -13,12 +13,14 @@
 # limitations under the License.
 
 
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 
 from ._base import Configurable
 from ._config import Config
-from ._documents import Document, DocumentStore, Query
-from ._generation import Generator, Prompt, Reply, Instruction, Options, Chain
+from ._documents import Document, DocumentStore, DocumentList
+from ._generation import Generator, Prompt, Reply, Instruction, Injection, \
+    Options, Chain
   
 
 class Conductor(Configurable):
@@ -27,6 +29,7 @@ class Conductor(Configurable):
   def configure(self):
     self.docs: DocumentStore = DocumentStore(self.config)
     self.generator: Generator = Generator(self.config)
+    self.executor = None
 
   def generate(self,
       generator_input: str | Prompt | Instruction,
@@ -44,14 +47,7 @@ class Conductor(Configurable):
             options=options, **prompt_params)
       case Instruction():
         if generator_input.inject:
-          q = generator_input.render_query(**prompt_params)
-          docs = self.docs.query(
-              Query(
-                  text=q,
-                  n_results=generator_input.inject.n_results,
-              ),
-          )
-          generator_input.context = '\n'.join(d.content for d in docs)
+          self.inject(generator_input, options, **prompt_params)
         return self.generator.generate_from_instruction(
             generator_input,
             options=options, **prompt_params)
@@ -59,5 +55,51 @@ class Conductor(Configurable):
         return self.generator.generate_from_chain(generator_input,
             options=options, **prompt_params)
 
+  def inject(self, instruction: Instruction, options: Options = None,
+      **prompt_params: dict[str, any]):
+    """Populate the instruction context from the document store.
+
+    In pipelined mode, retrieval and loading the generation model are started
+    together, and the rest of the instruction is rendered while they are in
+    flight, see `Instruction.prepare`.
+    """
+    q = instruction.render_query(**prompt_params)
+    inject = instruction.inject
+    if self.config.generation_pipelined:
+      if self.executor is None:
+        self.executor = ThreadPoolExecutor(max_workers=2,
+            thread_name_prefix='badinka-conductor')
+      retrieval = self.executor.submit(self.retrieve, inject, q)
+      loading = self.executor.submit(self.generator.load, options)
+      instruction.prepare(**prompt_params)
+      docs = retrieval.result()
+      loading.result()
+    else:
+      docs = self.retrieve(inject, q)
+    # Without relevant documents, the prompt is rendered without context.
+    instruction.context = '\n'.join(d.content for d in docs) or None
+
+  def close(self):
+    """Stop the pipelining threads, and close the document store."""
+    try:
+      if self.executor is not None:
+        self.executor.shutdown()
+        self.executor = None
+    finally:
+      self.docs.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+  def retrieve(self, inject: Injection, q: str) -> DocumentList:
+    """The documents to inject for a rendered query."""
+    docs = self.docs.query(inject.as_query(q))
+    if inject.expand:
+      docs = self.docs.expand(docs)
+    return inject.select(docs)
+
 
 # vim: ft=python sw=2 ts=2 sts=2 tw=80
@@ -43,17 +43,131 @@ class Config:
   #: The Ollama URL used for generation.
   generation_url: str = 'http://localhost:11434/api/generate'
 
+  #: Whether instructions with injection are generated in pipelined mode. The
+  #: context is retrieved while the generation model is loaded and the rest of
+  #: the instruction is rendered, so that a cold start takes as long as the
+  #: slowest of these rather than all of them.
+  generation_pipelined: bool = False
+
   #: The default Ollama model used for generating embeddings.
   embeddings_model: str = 'mxbai-embed-large'
 
   #: The Ollama URL used for embeddings.
   embeddings_url: str = 'http://localhost:11434/api/embeddings'
 
+  #: The maximum number of texts embedded in one call. Texts from concurrent
+  #: callers are gathered into batches of up to this size.
+  embeddings_batch_size: int = 64
+
+  #: How long, in seconds, to wait for more texts to fill a batch before
+  #: embedding it. With no wait, batches only gather texts which arrive while
+  #: the previous batch is being embedded.
+  embeddings_batch_window: float = 0.0
+
+  #: The embedding cache path. Embeddings are cached by model and content so
+  #: that the same text is never embedded twice. When using `:memory:` the cache
+  #: is not persisted.
+  embeddings_cache_path: str = ':memory:'
+
+  #: The maximum number of embeddings kept in the cache.
+  embeddings_cache_size: int = 100_000
+
+  #: The codec of cached embeddings, `float32`, `float16` or `int8`, see
+  #: `Codec`. Compact codecs fit more embeddings in the same memory, but the
+  #: cached embeddings are no longer exactly those of the model.
+  embeddings_cache_codec: str = 'float32'
+
+  #: What `DocumentStore.extend` does with near duplicates of stored
+  #: documents: `None` to add them, `skip` to drop them, or `merge` to drop them
+  #: and count them in the metadata of the stored document.
+  dedup: str = None
+
+  #: The similarity, of their sets of five word shingles, from which documents
+  #: are near duplicates.
+  dedup_threshold: float = 0.9
+
+  #: Whether documents chunked from source files are stored as references to
+  #: the bytes of their content in the file, which is read from a memory map
+  #: when it is accessed. This keeps the corpus text out of the store and out
+  #: of memory, but the source files must not change, and content filters don't
+  #: match referenced content.
+  content_references: bool = False
+
+  #: The query embedding cache path. Query texts are embedded through a small
+  #: cache of their own, so that hot queries are not evicted by ingestion.
+  #: When using `:memory:` the cache is not persisted.
+  query_cache_path: str = ':memory:'
+
+  #: The maximum number of query embeddings kept in the cache.
+  query_cache_size: int = 1024
+
   #: The default vector store path. When using `:memory:` an in-memory-only
   #: store is used with no persistence. When a path is given, that path is used
-  #: as a persistent store.
+  #: as a persistent store. The path may be prefixed with the backend, either
+  #: `chroma://` (the default) or `numpy://` for the embedded NumPy store, e.g.
+  #: `numpy://:memory:`. The backend is chosen by this prefix alone, not by the
+  #: size of collections; see `vector_index_threshold` for how the NumPy store
+  #: scales to large collections.
   vector_store_path: str = ':memory:'
 
+  #: The number of shards each collection is split into. Documents are routed
+  #: to a shard by a hash of their ID, and queries search every shard in
+  #: parallel. After changing the number of shards of stored collections,
+  #: `DocumentStore.reshard` moves their documents to their new shards.
+  vector_store_shards: int = 1
+
+  #: The number of processes searching the shards of persisted NumPy store
+  #: collections, or 0 to search them with threads.
+  vector_store_processes: int = 0
+
+  #: Whether `DocumentStore.append` and `extend` queue documents and return at
+  #: once, with the documents written in batches on a worker thread, see
+  #: `DocumentStore.flush`.
+  write_behind: bool = False
+
+  #: The number of queued documents written at once.
+  write_behind_batch_size: int = 64
+
+  #: The longest time in seconds a queued document waits before it is written.
+  write_behind_interval: float = 1.0
+
+  #: The number of documents which can be queued, after which appending
+  #: blocks until the worker catches up.
+  write_behind_queue_size: int = 1024
+
+  #: The collection size from which the NumPy store searches approximately,
+  #: with an index, rather than comparing the query with every vector.
+  vector_index_threshold: int = 50_000
+
+  #: The distance space of new collections, `l2`, `ip` or `cosine`.
+  vector_space: str = 'l2'
+
+  #: The number of neighbours of each vector in the HNSW graph of new Chroma
+  #: collections (`M`). More neighbours give better recall for more memory and
+  #: slower inserts.
+  hnsw_m: int = 16
+
+  #: The number of candidates considered while inserting into the HNSW graph of
+  #: new Chroma collections. More candidates build a better graph, slower.
+  hnsw_ef_construction: int = 100
+
+  #: The number of candidates considered while searching the HNSW graph of
+  #: Chroma collections. More candidates give better recall, slower.
+  hnsw_ef_search: int = 100
+
+  #: The codec of vectors kept by the NumPy store, `float32`, `float16` or
+  #: `int8`, see `Codec`. Vectors are searched in this compact form.
+  vector_codec: str = 'float32'
+
+  #: The number of leading dimensions of vectors kept by the NumPy store, or
+  #: `None` for all of them.
+  vector_dimensions: int = None
+
+  #: When vectors are kept in a compact form, the number of candidates for each
+  #: result which are reranked with the full vectors, or 0 for no reranking.
+  #: The full vectors are also kept, on disk when persisted.
+  vector_rerank: int = 0
+
   #: Whether logging calls should be immediately dumped to stdout
   log_immediate: bool = False
 
@@ -0,0 +1,145 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Near-duplicate detection with MinHash signatures."""
+
+import zlib
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+from ._lexical import tokenize
+
+
+#: The prime modulus of the MinHash permutations, the largest below 2**32.
+_PRIME = 4294967291
+
+
+@dataclass
+class DedupStats:
+  """The near-duplicate documents dropped from writes, and what that saved."""
+
+  #: The number of near duplicates dropped.
+  skipped: int = 0
+
+  #: The number of near duplicates merged into the stored document.
+  merged: int = 0
+
+  #: The number of texts which were not embedded.
+  embeddings_avoided: int = 0
+
+  #: The number of content and embedding bytes which were not stored.
+  bytes_avoided: int = 0
+
+
+class MinHashIndex:
+  """Index of MinHash signatures for finding near-duplicate texts.
+
+  Texts are compared by the Jaccard similarity of their sets of word shingles,
+  which is estimated by the fraction of equal values in their signatures. The
+  signatures are split into bands which are hashed into buckets, so that only
+  texts sharing a bucket, which are likely to be similar, are compared.
+
+  The index can be matched against while another thread updates it.
+  """
+
+  def __init__(self, threshold: float = 0.9, num_perm: int = 128,
+      shingle_size: int = 5):
+    #: The similarity from which texts are near duplicates.
+    self.threshold = threshold
+    #: The number of words in each shingle.
+    self.shingle_size = shingle_size
+    rng = np.random.default_rng(1)
+    self.a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)[:, None]
+    self.b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)[:, None]
+    self.rows = _band_rows(threshold, num_perm)
+    self.buckets: list[dict[bytes, set[str]]] = [
+        {} for _ in range(num_perm // self.rows)]
+    self.signatures: dict[str, np.ndarray] = {}
+    self.lock = threading.RLock()
+
+  def signature(self, text: str) -> np.ndarray:
+    """The MinHash signature of a text."""
+    words = tokenize(text)
+    n = self.shingle_size
+    shingles = [' '.join(words[i:i + n])
+                for i in range(max(len(words) - n + 1, 1))]
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles),
+        dtype=np.uint64, count=len(shingles))
+    return ((self.a * hashes + self.b) % _PRIME).min(axis=1).astype(np.uint32)
+
+  def match(self, signature: np.ndarray) -> tuple[str, float] | None:
+    """The most similar indexed `(id, similarity)`, if it is a near duplicate."""
+    with self.lock:
+      candidates = set()
+      for band, key in zip(self.buckets, self._keys(signature)):
+        candidates.update(band.get(key, ()))
+      candidates = [(id, self.signatures[id]) for id in candidates]
+    best = None
+    for id, other in candidates:
+      similarity = float(np.mean(other == signature))
+      if similarity >= self.threshold and (best is None or
+          similarity > best[1]):
+        best = (id, similarity)
+    return best
+
+  def add(self, id: str, signature: np.ndarray) -> None:
+    """Index a signature, replacing any indexed with the same ID."""
+    with self.lock:
+      self.remove([id])
+      self.signatures[id] = signature
+      for band, key in zip(self.buckets, self._keys(signature)):
+        band.setdefault(key, set()).add(id)
+
+  def remove(self, ids: list[str]) -> None:
+    """Remove signatures from the index."""
+    with self.lock:
+      for id in ids:
+        signature = self.signatures.pop(id, None)
+        if signature is None:
+          continue
+        for band, key in zip(self.buckets, self._keys(signature)):
+          bucket = band[key]
+          bucket.discard(id)
+          if not bucket:
+            del band[key]
+
+  def _keys(self, signature):
+    return [signature[i:i + self.rows].tobytes()
+            for i in range(0, len(signature), self.rows)]
+
+  def __contains__(self, id: str) -> bool:
+    return id in self.signatures
+
+  def __len__(self) -> int:
+    return len(self.signatures)
+
+
+def _band_rows(threshold: float, num_perm: int) -> int:
+  """The rows in each band, so that texts just below the threshold share one.
+
+  Texts with similarity `s` share a bucket with probability
+  `1 - (1 - s**rows)**bands`, which rises steeply around `(1 / bands)**(1 /
+  rows)`. The rows are chosen to put that rise as close below the threshold as
+  possible, so few near duplicates are missed.
+  """
+  best = 1
+  for rows in range(1, num_perm + 1):
+    if not num_perm % rows and (rows / num_perm) ** (1 / rows) <= threshold:
+      best = rows
+  return best
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
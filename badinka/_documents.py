@@ -16,17 +16,33 @@
 
 from loguru import logger as log
 
+import hashlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from dataclasses import dataclass, field
 from collections import abc
 from uuid import uuid4
 
+import numpy as np
 from chromadb import Collection
-from chromadb import EphemeralClient, PersistentClient
 from chromadb.utils.embedding_functions import OllamaEmbeddingFunction
 
 
 from ._config import Config
 from ._base import Configurable
+from ._backends import IndexSettings, open_backend
+from ._embeddings import EmbeddingCache, CachedEmbeddingFunction, \
+    BatchingEmbeddingFunction
+from ._filters import Filter, compile_filters
+from ._lexical import LexicalIndex
+from ._dedup import MinHashIndex, DedupStats
+from ._quantization import codec_for
+from ._references import reference, is_reference, source_files
+from ._tuning import IndexReport, evaluate_index_settings
+from ._buffering import WriteBehindBuffer
+from ._snapshots import write_snapshot, read_snapshot
+from ._sharding import ShardedCollection, shard_of, shard_name
+from ._ranking import reciprocal_rank_fusion
 
 
 
@@ -52,63 +68,302 @@ class Document:
   #: 2. adding parameters for querying against
   meta: dict[str, any] = None
 
-  #: The generated embeddings for the document. These are currently only for
-  #: reading as they are generated on document storage, but could be used to
-  #: store if they are provided.
-  embeddings: list[float] = field(default=None, repr=False)
+  #: The generated embeddings for the document. These are generated on
+  #: document storage, or stored as they are if they are provided. Documents
+  #: read from the store have a view of a row of the result's embeddings.
+  embeddings: list[float] = field(default=None, repr=False, compare=False)
+
+  #: The distance of the document from the query, for query results.
+  distance: float = field(default=None, compare=False)
+
+
+@dataclass
+class ParentDocument(Document):
+  """A document stored once for the context of its children, and not embedded.
+
+  Children are small documents which point to their parent with a `parent_id`
+  in their metadata. They are embedded and matched precisely, and then expanded
+  into their parents, see `DocumentStore.expand`.
+  """
+
+
+def content_hash(content: str) -> str:
+  """A stable hash of document content."""
+  return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def stable_id(source: str, content: str) -> str:
+  """A stable document ID derived from its source and content."""
+  return content_hash(f'{source}\0{content}')
+
+
+@dataclass
+class SyncReport:
+  """The changes made by syncing a source into the document store."""
+
+  #: Documents that were not in the store.
+  added: int = 0
+
+  #: Documents whose metadata changed.
+  updated: int = 0
+
+  #: Documents no longer present in the source.
+  deleted: int = 0
+
+  #: Documents that were already up to date.
+  unchanged: int = 0
 
 
 class DocumentList(abc.Sequence):
-  """List of documents from querying the document store."""
+  """List of documents from querying the document store.
+
+  The documents are held as parallel columns rather than as one object per
+  document, and a `Document` is only built when it is accessed. Columns which
+  were not fetched from the store hold `None` for every document. Content
+  stored as references into source files is only read when it is accessed.
+  """
 
-  def __init__(self):
-    self.documents: list[Document] = []
+  __slots__ = ('ids', '_contents', '_resolved', 'metas', 'distances',
+      '_embeddings', '_appended')
+
+  def __init__(self,
+      ids: list[str] = None,
+      contents: list[str] = None,
+      metas: list[dict[str, any]] = None,
+      distances: list[float] = None,
+      embeddings: np.ndarray = None):
+    n = len(ids) if ids is not None else 0
+
+    #: The document IDs.
+    self.ids: list[str] = list(ids) if ids is not None else []
+
+    self._contents = _column(contents, n)
+    self._resolved = not any(map(is_reference, self._contents))
+
+    #: The document metadata.
+    self.metas: list[dict[str, any]] = _column(metas, n)
+
+    #: The distance of each document from the query.
+    self.distances: list[float] = _column(distances, n)
+
+    self.embeddings = embeddings
+
+  @property
+  def embeddings(self) -> np.ndarray:
+    """The embeddings of the documents as a matrix, when they were requested.
+
+    Each document's embeddings are a view of its row.
+    """
+    if self._appended:
+      rows = np.stack(self._appended)
+      self._embeddings = rows if self._embeddings is None else \
+          np.concatenate((self._embeddings, rows))
+      self._appended = []
+    return self._embeddings
+
+  @embeddings.setter
+  def embeddings(self, embeddings: np.ndarray):
+    self._embeddings = None if embeddings is None else \
+        np.asarray(embeddings, dtype=np.float32)
+    self._appended = []
+
+  @property
+  def contents(self) -> list[str]:
+    """The document contents."""
+    if not self._resolved:
+      self._contents = [source_files.resolve(c) for c in self._contents]
+      self._resolved = True
+    return self._contents
 
   def __getitem__(self, index) -> Document:
-    return self.documents[index]
+    if isinstance(index, slice):
+      return DocumentList(
+          ids = self.ids[index],
+          contents = self._contents[index],
+          metas = self.metas[index],
+          distances = self.distances[index],
+          embeddings = None if self.embeddings is None else
+              self.embeddings[index],
+      )
+    return Document(
+        content = source_files.resolve(self._contents[index]),
+        id = self.ids[index],
+        meta = self.metas[index],
+        embeddings = None if self.embeddings is None else
+            self.embeddings[index],
+        distance = self.distances[index],
+    )
 
   def __len__(self) -> int:
-    return len(self.documents)
+    return len(self.ids)
+
+  def append(self, doc: Document) -> None:
+    """Add a document to the end of the list.
+
+    The embedding matrix is only kept while every document has embeddings.
+    Appended rows are only added to it when it is next read, so that building
+    a list one document at a time doesn't copy the matrix each time.
+    """
+    if doc.embeddings is not None and (self._embeddings is not None or
+        self._appended or not self.ids):
+      self._appended.append(np.asarray(doc.embeddings, dtype=np.float32))
+    else:
+      self.embeddings = None
+    self.ids.append(doc.id)
+    self._contents.append(doc.content)
+    self.metas.append(doc.meta)
+    self.distances.append(doc.distance)
+
+  def select(self, indices: list[int]) -> 'DocumentList':
+    """A new list of the documents at the given positions, in order."""
+    return DocumentList(
+        ids = [self.ids[i] for i in indices],
+        contents = [self._contents[i] for i in indices],
+        metas = [self.metas[i] for i in indices],
+        distances = [self.distances[i] for i in indices],
+        embeddings = None if self.embeddings is None else
+            self.embeddings[list(indices)],
+    )
+
+  def within(self, max_distance: float = None,
+      max_distance_ratio: float = None) -> 'DocumentList':
+    """The documents within a distance of the query, in order.
+
+    The distance is absolute, or a multiple of the distance of the nearest
+    document, or both. Since inner product distances can be zero or negative,
+    the multiple is of the magnitude of the nearest distance: a ratio of 1.2
+    keeps documents further than the nearest by at most 20% of its magnitude.
+    Documents without a distance, such as lexical matches of hybrid queries,
+    are kept.
+    """
+    if max_distance is None and max_distance_ratio is None:
+      return self
+    limit = float('inf') if max_distance is None else max_distance
+    known = [d for d in self.distances if d is not None]
+    if max_distance_ratio is not None and known:
+      best = min(known)
+      limit = min(limit, best + abs(best) * (max_distance_ratio - 1))
+    return self.select([i for i, d in enumerate(self.distances)
+                        if d is None or d <= limit])
+
+  def collapse(self, max_gap: int = 2) -> 'DocumentList':
+    """Merge documents which overlap or are next to each other in a source.
+
+    Documents chunked from the same `source` with `start` and `end` offsets in
+    their metadata are merged when they overlap or are separated by at most
+    `max_gap` characters. A merged document takes the place, ID and embeddings
+    of its best ranked part, and the span and content of all its parts.
+    """
+    spans = {}
+    for i, meta in enumerate(self.metas):
+      if meta and 'start' in meta and 'end' in meta and 'source' in meta:
+        spans.setdefault(meta['source'], []).append(i)
+    groups = {i: [i] for i in range(len(self))}
+    for members in spans.values():
+      members.sort(key=lambda i: self.metas[i]['start'])
+      head = members[0]
+      end = self.metas[head]['end']
+      for i in members[1:]:
+        if self.metas[i]['start'] <= end + max_gap:
+          groups[head].append(groups.pop(i)[0])
+          end = max(end, self.metas[i]['end'])
+        else:
+          head, end = i, self.metas[i]['end']
+    best = {min(g): g for g in groups.values()}
+    merged = self.select(sorted(best))
+    for n, first in enumerate(sorted(best)):
+      group = best[first]
+      if len(group) == 1:
+        continue
+      group.sort(key=lambda i: self.metas[i]['start'])
+      content = self.contents[group[0]]
+      end = self.metas[group[0]]['end']
+      for i in group[1:]:
+        meta = self.metas[i]
+        if meta['end'] <= end:
+          continue
+        if meta['start'] < end:
+          content += self.contents[i][end - meta['start']:]
+        else:
+          content += ' ' + self.contents[i]
+        end = meta['end']
+      merged.contents[n] = content
+      merged.metas[n] = dict(self.metas[first],
+          start=self.metas[group[0]]['start'], end=end)
+      merged.distances[n] = min((self.distances[i] for i in group
+          if self.distances[i] is not None), default=None)
+    return merged
+
+  @classmethod
+  def concat(cls, lists: list['DocumentList']) -> 'DocumentList':
+    """Join several lists into one.
+
+    The embedding matrix is only kept if every non-empty list has one.
+    """
+    lists = [l for l in lists if len(l)]
+    matrices = [l.embeddings for l in lists]
+    return cls(
+        ids = [id for l in lists for id in l.ids],
+        contents = [c for l in lists for c in l._contents],
+        metas = [m for l in lists for m in l.metas],
+        distances = [d for l in lists for d in l.distances],
+        embeddings = np.concatenate(matrices)
+            if matrices and all(m is not None for m in matrices) else None,
+    )
 
   @classmethod
   def from_query_response(cls,
-      response) -> abc.Sequence[Document]:
-    """Parse a chromadb response for a query."""
-    return cls.from_response(
-        ids = response['ids'][0],
-        contents = response['documents'][0],
-        embeddings = response['embeddings'][0],
-        metadatas = response['metadatas'][0],
+      response, index: int = 0) -> abc.Sequence[Document]:
+    """Parse the results for one of the texts of a chromadb query response."""
+    return cls(
+        ids = response['ids'][index],
+        contents = _nth(response.get('documents'), index),
+        metas = _nth(response.get('metadatas'), index),
+        distances = _nth(response.get('distances'), index),
+        embeddings = _nth(response.get('embeddings'), index),
     )
 
+  #: The former name of `from_query_response`.
+  from_response = from_query_response
+
+  @classmethod
+  def from_query_responses(cls,
+      response) -> list[abc.Sequence[Document]]:
+    """Parse the results for every text of a chromadb query response."""
+    return [cls.from_query_response(response, i)
+            for i in range(len(response['ids']))]
+
   @classmethod
   def from_get_response(cls,
       response) -> abc.Sequence[Document]:
     """Parse a chromadb response for a get."""
-    return cls.from_response(
+    return cls(
         ids = response['ids'],
-        contents = response['documents'],
-        embeddings = response['embeddings'],
-        metadatas = response['metadatas'],
+        contents = response.get('documents'),
+        metas = response.get('metadatas'),
+        embeddings = response.get('embeddings'),
     )
 
-  @classmethod
-  def from_response(cls,
-      ids: list[str],
-      contents: list[str],
-      embeddings: list[float],
-      metadatas: list[dict[str, any]]
-  ) -> abc.Sequence[Document]:
-    """Parse a chromadb response."""
-    ds = cls()
-    for i, id in enumerate(ids):
-      d = Document(content=contents[i], id=id)
-      if metadatas:
-        d.metadata = metadatas[i]
-      if embeddings:
-        d.embeddings = embeddings[i]
-      ds.documents.append(d)
-    return ds
+
+def _merge(doc: Document, duplicates: list[Document]) -> Document:
+  """A document with near duplicates merged into its metadata."""
+  meta = dict(doc.meta or {})
+  for d in duplicates:
+    for k, v in (d.meta or {}).items():
+      meta.setdefault(k, v)
+  meta['duplicates'] = meta.get('duplicates', 0) + len(duplicates)
+  return Document(content=doc.content, id=doc.id, meta=meta,
+      embeddings=doc.embeddings)
+
+
+def _column(values, n):
+  """A column of values, or of `None` when the values were not fetched."""
+  return [None] * n if values is None else list(values)
+
+
+def _nth(results, index):
+  """A result set of a query response field, if it was included."""
+  return None if results is None else results[index]
 
 
 @dataclass
@@ -120,7 +375,8 @@ class Query:
   text: str = None
 
   #: A list of text queries. If provided along with the `text` attribute, the
-  #: two are combined.
+  #: two are combined. Queries with several texts are searched with
+  #: `DocumentStore.query_many`.
   texts: list[str] = field(default_factory=list)
 
   # An embedding to query similarity for.
@@ -129,16 +385,51 @@ class Query:
   # The number of results to return.
   n_results: int = 10
 
-  def as_args(self) -> dict[str, any]:
-    """Converts the stored attributes into chroma query keyword arguments."""
+  #: The fields returned for each result, any of `documents`, `metadatas`,
+  #: `distances` and `embeddings`. Embeddings are large, so they are only
+  #: returned when asked for.
+  include: list[str] = field(
+      default_factory=lambda: ['documents', 'metadatas', 'distances'])
+
+  #: A metadata filter, as a `Filter` or in Chroma syntax.
+  where: Filter | dict[str, any] = None
+
+  #: A document content filter, as a `Filter` or in Chroma syntax.
+  where_document: Filter | dict[str, any] = None
+
+  #: Whether to fuse lexical (BM25) search with vector search. Lexical search
+  #: finds exact identifiers and rare terms which vector search can miss. A
+  #: query by embeddings alone has no text to search for, so it only uses
+  #: vector search.
+  hybrid: bool = False
+
+  #: The number of candidates each search fetches for a hybrid query. Defaults
+  #: to four times the number of results.
+  candidates: int = None
+
+  #: The reciprocal rank fusion constant for hybrid queries. Larger values give
+  #: more weight to lower ranked results.
+  rrf_k: int = 60
+
+  def query_texts(self) -> list[str]:
+    """All the text queries."""
     texts = list(self.texts)
     if self.text:
       texts.insert(0, self.text)
-    return {
-        'query_texts': texts,
-        'include': ['documents', 'metadatas', 'embeddings', 'distances'],
+    return texts
+
+  def as_args(self) -> dict[str, any]:
+    """Converts the stored attributes into chroma query keyword arguments."""
+    args = {
+        'include': list(self.include),
         'n_results': self.n_results,
     }
+    if texts := self.query_texts():
+      args['query_texts'] = texts
+    else:
+      args['query_embeddings'] = [self.embeddings]
+    args.update(compile_filters(self.where, self.where_document))
+    return args
 
 
 class DocumentStore(Configurable):
@@ -148,36 +439,535 @@ class DocumentStore(Configurable):
   """
 
   def configure(self):
-    self.embedding_function = OllamaEmbeddingFunction(
-        url=self.config.embeddings_url,
-        model_name=self.config.embeddings_model,
+    self.embedding_cache = EmbeddingCache(
+        path=self.config.embeddings_cache_path,
+        max_entries=self.config.embeddings_cache_size,
+        codec=codec_for(self.config.embeddings_cache_codec),
+    )
+    self.embedding_function = CachedEmbeddingFunction(
+        BatchingEmbeddingFunction(
+            OllamaEmbeddingFunction(
+                url=self.config.embeddings_url,
+                model_name=self.config.embeddings_model,
+            ),
+            max_batch_size=self.config.embeddings_batch_size,
+            window=self.config.embeddings_batch_window,
+        ),
+        model=self.config.embeddings_model,
+        cache=self.embedding_cache,
+    )
+    self.query_cache = EmbeddingCache(
+        path=self.config.query_cache_path,
+        max_entries=self.config.query_cache_size,
+    )
+    self.lexical_indexes: dict[str, LexicalIndex] = {}
+    self.dedup_indexes: dict[str, MinHashIndex] = {}
+    #: The near duplicates dropped by `deduplicate`, and what that saved.
+    self.dedup_stats = DedupStats()
+    #: The near duplicates dropped before their collection had embeddings, by
+    #: collection, whose embedding bytes are counted once it has.
+    self.unsized_duplicates: dict[str, int] = {}
+    self.backend = open_backend(self.config)
+    #: The index settings of collections, by name. Other collections are
+    #: created with the configured settings.
+    self.index_settings: dict[str, IndexSettings] = {}
+    self.shard_threads = None
+    self.shard_processes = None
+    self.buffer = None
+    if self.config.write_behind:
+      self.buffer = WriteBehindBuffer(self._extend,
+          batch_size=self.config.write_behind_batch_size,
+          interval=self.config.write_behind_interval,
+          max_pending=self.config.write_behind_queue_size,
+          on_error=lambda f: self.log.error('write behind',
+              collection=f.collection_name, documents=len(f.docs),
+              error=repr(f.error)))
+
+  @property
+  def query_embedding_function(self) -> CachedEmbeddingFunction:
+    """The embedding function of query texts.
+
+    Queries are only cached in the query cache, around the function which the
+    content cache wraps, so that queries and ingestion don't evict each other.
+    """
+    return CachedEmbeddingFunction(
+        self.embedding_function.function,
+        model=self.config.embeddings_model,
+        cache=self.query_cache,
     )
 
+  def embed_queries(self, texts: list[str]) -> list[np.ndarray]:
+    """Embed query texts through the query cache."""
+    return self.query_embedding_function(texts)
+
   def client(self):
-    """Create a chromadb client."""
-    if self.config.vector_store_path == ':memory:':
-      return EphemeralClient()
-    else:
-      return PersistentClient(self.config.vector_store_path)
+    """Create a chromadb client.
+
+    A `ValueError` is raised when the store is not kept in Chroma.
+    """
+    return self.backend.client()
+
+  def collection(self, collection_name: str = 'default',
+      metadata: dict[str, any] = None) -> Collection:
+    """Get or create an existing or the default collection.
 
-  def collection(self, collection_name: str = 'default') -> Collection:
-    """Get or create an existing or the default collection."""
-    return self.client().get_or_create_collection(
-        collection_name,
+    The collection is kept in the backend configured by
+    `Config.vector_store_path`, and has the interface of a Chroma collection
+    whichever the backend. When `Config.vector_store_shards` is more than one,
+    the collection is split into that many shards. New collections are created
+    with the given metadata, or else with their index settings, see
+    `set_index_settings`.
+    """
+    shards = self.config.vector_store_shards
+    metadata = metadata or self.settings(collection_name).metadata()
+    if shards <= 1:
+      return self.backend.collection(
+          collection_name,
+          embedding_function=self.embedding_function,
+          metadata=metadata,
+      )
+    if self.shard_threads is None:
+      self.shard_threads = ThreadPoolExecutor(max_workers=shards,
+          thread_name_prefix='badinka-shards')
+      if self.config.vector_store_processes:
+        self.shard_processes = ProcessPoolExecutor(
+            max_workers=self.config.vector_store_processes,
+            mp_context=multiprocessing.get_context('spawn'))
+    return ShardedCollection(collection_name,
+        [self.backend.collection(shard_name(collection_name, i),
+            embedding_function=self.embedding_function, metadata=metadata)
+         for i in range(shards)],
         embedding_function=self.embedding_function,
+        executor=self.shard_threads,
+        processes=self.shard_processes,
     )
 
+  def settings(self, collection_name='default') -> IndexSettings:
+    """The index settings new collections are created with."""
+    return self.index_settings.get(collection_name) or \
+        IndexSettings.from_config(self.config)
+
+  def set_index_settings(self, settings: IndexSettings,
+      collection_name='default') -> None:
+    """Set the index settings of a collection.
+
+    The space, `m` and `ef_construction` are fixed when a collection is
+    created, so only `ef_search` changes for a stored collection. Chroma applies
+    it when the collection is next loaded, such as in a new process.
+    """
+    self.index_settings[collection_name] = settings
+    names = {collection_name} | {shard_name(collection_name, i)
+        for i in range(self.config.vector_store_shards)}
+    for name in names & set(self.backend.names()):
+      self.backend.set_ef_search(name, settings.ef_search)
+
+  def evaluate_index(self, collection_name='default', settings=None,
+      sample: int = 10_000, queries: int = 100,
+      k: int = 10) -> list[IndexReport]:
+    """Measure the recall and latency of index settings on a collection.
+
+    A sample of the stored embeddings is indexed with each of the settings, by
+    default a grid around the configured ones, and searched for a sample of
+    them, see `evaluate_index_settings`.
+    """
+    vectors = []
+    for d in self.iter_documents(include=['embeddings'],
+        collection_name=collection_name):
+      vectors.append(d.embeddings)
+      if len(vectors) == sample:
+        break
+    if not vectors:
+      raise ValueError(f'collection {collection_name} has no embeddings')
+    vectors = np.array(vectors, dtype=np.float32)
+    rng = np.random.default_rng(0)
+    picked = rng.choice(len(vectors), min(queries, len(vectors)), replace=False)
+    return evaluate_index_settings(vectors, vectors[picked], settings=settings,
+        k=k, space=self.settings(collection_name).space)
+
+  def reshard(self, collection_name='default', batch_size=1000) -> int:
+    """Move the documents of a collection to their configured shards.
+
+    Documents are read from the unsharded collection and from every shard of
+    the collection in the backend, and those in the wrong place are moved with
+    their embeddings. This is needed after changing `Config.vector_store_shards`
+    of a stored collection. The number of documents moved is returned.
+    """
+    shards = self.config.vector_store_shards
+    names = set(self.backend.names())
+    sources = [collection_name] if collection_name in names else []
+    sources += sorted((n for n in names
+        if n.startswith(f'{collection_name}.')
+        and n[len(collection_name) + 1:].isdigit()),
+        key=lambda n: int(n[len(collection_name) + 1:]))
+
+    def target(id):
+      if shards <= 1:
+        return collection_name
+      return shard_name(collection_name, shard_of(id, shards))
+
+    moved = 0
+    for source in sources:
+      c = self.backend.collection(source,
+          embedding_function=self.embedding_function)
+      stale = []
+      offset = 0
+      while True:
+        page = DocumentList.from_get_response(c.get(limit=batch_size,
+            offset=offset, include=['documents', 'metadatas', 'embeddings']))
+        groups = {}
+        for d in page:
+          if (name := target(d.id)) != source:
+            groups.setdefault(name, []).append(d)
+        for name, docs in groups.items():
+          self.backend.collection(name,
+              embedding_function=self.embedding_function,
+              metadata=c.metadata).upsert(**self._columns(docs))
+          stale += [d.id for d in docs]
+        if len(page) < batch_size:
+          break
+        offset += batch_size
+      for start in range(0, len(stale), batch_size):
+        c.delete(ids=stale[start:start + batch_size])
+      moved += len(stale)
+    self.log.debug('reshard', collection=collection_name, shards=shards,
+        moved=moved)
+    return moved
+
   def append(self, doc, collection_name='default'):
     """Add a single document to the named collection or default."""
     self.extend([doc], collection_name=collection_name)
 
   def extend(self, docs, collection_name='default') -> None:
-    """Add multiple documents to the named collection or default."""
+    """Add multiple documents to the named collection or default.
+
+    Parent documents are stored with `add_parents`. When `Config.dedup` is set,
+    near duplicates are dropped first, see `deduplicate`.
+
+    When `Config.write_behind` is set, the documents are queued and written in
+    the background, and are not read or searched until they are. Call `flush`
+    to wait for them.
+    """
+    if self.buffer is not None:
+      self.buffer.put(docs, collection_name)
+      return
+    self._extend(docs, collection_name)
+
+  def _extend(self, docs, collection_name):
+    docs = self._store_parents(docs, collection_name)
+    docs = self.deduplicate(docs, collection_name=collection_name)
+    if not docs:
+      return
     c = self.collection(collection_name=collection_name)
-    c.add(
-      ids=[d.id for d in docs],
-      metadatas=[d.meta for d in docs],
-      documents=[d.content for d in docs])
+    c.add(**self._columns(docs))
+    self._index(docs, collection_name)
+    self._size_duplicates(docs, collection_name)
+
+  def flush(self) -> None:
+    """Wait until the queued documents are written, see `Config.write_behind`.
+
+    Writes by ID, deletes and gets flush first, so they apply after the queued
+    documents. The first error of the writes which failed since the last flush
+    is raised.
+    """
+    if self.buffer is not None:
+      self.buffer.flush()
+
+  def close(self) -> None:
+    """Write the queued documents and stop the store's worker threads."""
+    try:
+      if self.buffer is not None:
+        self.buffer.close()
+    finally:
+      for pool in (self.shard_threads, self.shard_processes):
+        if pool is not None:
+          pool.shutdown()
+      self.shard_threads = self.shard_processes = None
+
+  def upsert(self, docs, collection_name='default') -> None:
+    """Add or replace multiple documents by ID.
+
+    Parent documents are stored with `add_parents`.
+    """
+    self.flush()
+    docs = self._store_parents(docs, collection_name)
+    if not docs:
+      return
+    c = self.collection(collection_name=collection_name)
+    c.upsert(**self._columns(docs))
+    self._index(docs, collection_name)
+    self._size_duplicates(docs, collection_name)
+
+  def parent_collection(self, collection_name='default') -> Collection:
+    """The collection of the parent documents of a collection.
+
+    Parents are kept unsharded in the backend as `<name>.parents`. They are
+    stored with a placeholder embedding, so they are never embedded.
+    """
+    return self.backend.collection(f'{collection_name}.parents',
+        embedding_function=self.embedding_function)
+
+  def add_parents(self, docs: list[Document],
+      collection_name='default') -> None:
+    """Add or replace the parent documents of a collection by ID."""
+    docs = list({d.id: d for d in docs}.values())
+    if not docs:
+      return
+    self.parent_collection(collection_name).upsert(
+        ids=[d.id for d in docs],
+        documents=[d.content for d in docs],
+        metadatas=[d.meta or None for d in docs],
+        embeddings=[[0.0]] * len(docs),
+    )
+
+  def parents(self, ids: list[str], collection_name='default') -> DocumentList:
+    """Load parent documents by ID, in the order of the IDs."""
+    c = self.parent_collection(collection_name)
+    ids = list(dict.fromkeys(ids))
+    found = DocumentList.from_get_response(
+        c.get(ids=ids, include=['documents', 'metadatas']))
+    positions = {id: i for i, id in enumerate(found.ids)}
+    return found.select([positions[id] for id in ids if id in positions])
+
+  def expand(self, docs: DocumentList,
+      collection_name='default') -> DocumentList:
+    """Replace matched children by their parents, each parent only once.
+
+    A parent takes the place, distance and embeddings of its best ranked child.
+    Documents without a stored parent are kept as they are. The `parent_id` of
+    children is read from their metadata, so it must have been included.
+    """
+    parent_ids = [(m or {}).get('parent_id') for m in docs.metas]
+    wanted = [id for id in parent_ids if id is not None]
+    found = {d.id: d for d in self.parents(wanted, collection_name)} \
+        if wanted else {}
+    keep = []
+    seen = set()
+    for i, parent_id in enumerate(parent_ids):
+      key = parent_id if parent_id in found else docs.ids[i]
+      if key not in seen:
+        seen.add(key)
+        keep.append(i)
+    expanded = docs.select(keep)
+    for j, i in enumerate(keep):
+      if (parent := found.get(parent_ids[i])) is not None:
+        expanded.ids[j] = parent.id
+        expanded.contents[j] = parent.content
+        expanded.metas[j] = parent.meta
+    return expanded
+
+  def _prune_parents(self, parent_ids, collection_name) -> None:
+    """Delete the given parents which no stored child points to."""
+    parent_ids = list({id for id in parent_ids if id is not None})
+    if (not parent_ids or
+        f'{collection_name}.parents' not in self.backend.names()):
+      return
+    c = self.collection(collection_name=collection_name)
+    referenced = {m['parent_id'] for m in c.get(
+        where={'parent_id': {'$in': parent_ids}},
+        include=['metadatas'])['metadatas']}
+    orphans = [id for id in parent_ids if id not in referenced]
+    if orphans:
+      self.parent_collection(collection_name).delete(ids=orphans)
+
+  def _store_parents(self, docs, collection_name) -> list[Document]:
+    """Store the parents among documents, returning the other documents."""
+    parents = [d for d in docs if isinstance(d, ParentDocument)]
+    if not parents:
+      return docs
+    self.add_parents(parents, collection_name)
+    return [d for d in docs if not isinstance(d, ParentDocument)]
+
+  def lexical(self, collection_name='default') -> LexicalIndex:
+    """The lexical index of a collection.
+
+    The index is built from the stored documents the first time it is needed,
+    and then kept up to date as documents are written through this store.
+    """
+    index = self.lexical_indexes.get(collection_name)
+    if index is None:
+      index = LexicalIndex()
+      batch = []
+      for d in self.iter_documents(include=['documents'],
+          collection_name=collection_name):
+        batch.append(d)
+        if len(batch) == 1000:
+          index.add([d.id for d in batch], [d.content for d in batch])
+          batch = []
+      index.add([d.id for d in batch], [d.content for d in batch])
+      self.lexical_indexes[collection_name] = index
+    return index
+
+  def dedup_index(self, collection_name='default') -> MinHashIndex:
+    """The near-duplicate index of a collection.
+
+    Like the lexical index, it is built from the stored documents the first
+    time it is needed, and then kept up to date.
+    """
+    index = self.dedup_indexes.get(collection_name)
+    if index is None:
+      index = MinHashIndex(threshold=self.config.dedup_threshold)
+      for d in self.iter_documents(include=['documents'],
+          collection_name=collection_name):
+        index.add(d.id, index.signature(d.content))
+      self.dedup_indexes[collection_name] = index
+    return index
+
+  def deduplicate(self, docs, collection_name='default') -> list[Document]:
+    """Drop documents which are near duplicates of stored or earlier ones.
+
+    What happens to near duplicates depends on `Config.dedup`. With `skip`
+    they are dropped, and with `merge` they are also counted in the
+    `duplicates` metadata of the document they duplicate, which gains any
+    metadata keys it was missing. Without it, nothing is dropped. The savings
+    are added up in `dedup_stats`.
+    """
+    mode = self.config.dedup
+    if not mode:
+      return list(docs)
+    if mode not in ('skip', 'merge'):
+      raise ValueError(f'unknown dedup mode {mode}')
+    index = self.dedup_index(collection_name)
+    kept = {}
+    merges = {}
+    dims = None
+    for d in docs:
+      signature = index.signature(d.content)
+      match = index.match(signature)
+      if match is None or match[0] == d.id:
+        index.add(d.id, signature)
+        kept[d.id] = d
+        continue
+      if dims is None:
+        dims = self._dimensions(d, collection_name)
+      self.dedup_stats.embeddings_avoided += d.embeddings is None
+      self.dedup_stats.bytes_avoided += len(d.content.encode()) + 4 * dims
+      if not dims:
+        self.unsized_duplicates[collection_name] = \
+            self.unsized_duplicates.get(collection_name, 0) + 1
+      if mode == 'skip':
+        self.dedup_stats.skipped += 1
+      else:
+        self.dedup_stats.merged += 1
+        merges.setdefault(match[0], []).append(d)
+    stored = [id for id in merges if id not in kept]
+    if stored:
+      c = self.collection(collection_name=collection_name)
+      found = DocumentList.from_get_response(c.get(ids=stored,
+          include=['documents', 'metadatas', 'embeddings']))
+      merged = [_merge(d, merges[d.id]) for d in found]
+      c.upsert(**self._columns(merged))
+    for id in merges.keys() & kept.keys():
+      kept[id] = _merge(kept[id], merges[id])
+    self.log.debug('deduplicate', stats=self.dedup_stats)
+    return list(kept.values())
+
+  def _dimensions(self, doc, collection_name) -> int:
+    """The dimensions of embeddings, from a document or a stored one."""
+    if doc.embeddings is not None:
+      return len(doc.embeddings)
+    c = self.collection(collection_name=collection_name)
+    stored = c.get(limit=1, include=['embeddings'])['embeddings']
+    return 0 if stored is None or not len(stored) else len(stored[0])
+
+  def _size_duplicates(self, docs, collection_name):
+    """Count the embedding bytes of duplicates dropped before there were any."""
+    if count := self.unsized_duplicates.pop(collection_name, 0):
+      dims = self._dimensions(docs[0], collection_name)
+      self.dedup_stats.bytes_avoided += 4 * dims * count
+
+  def _index(self, docs, collection_name):
+    if (index := self.lexical_indexes.get(collection_name)) is not None:
+      index.add([d.id for d in docs], [d.content for d in docs])
+    if (index := self.dedup_indexes.get(collection_name)) is not None:
+      for d in docs:
+        if d.id not in index:
+          index.add(d.id, index.signature(d.content))
+
+  def _unindex(self, ids, collection_name):
+    if (index := self.lexical_indexes.get(collection_name)) is not None:
+      index.remove(ids)
+    if (index := self.dedup_indexes.get(collection_name)) is not None:
+      index.remove(ids)
+
+  def _columns(self, docs) -> dict[str, any]:
+    """Converts documents into chroma keyword arguments.
+
+    Embeddings are only passed when every document has them, otherwise they are
+    generated by the embedding function. Content stored as references is
+    embedded here, so that the references themselves are not.
+    """
+    args = {
+        'ids': [d.id for d in docs],
+        'metadatas': [d.meta or None for d in docs],
+        'documents': [self._stored_content(d) for d in docs],
+    }
+    if docs and all(d.embeddings is not None for d in docs):
+      args['embeddings'] = [d.embeddings for d in docs]
+    elif any(map(is_reference, args['documents'])):
+      args['embeddings'] = self.embedding_function([d.content for d in docs])
+    return args
+
+  def _stored_content(self, doc) -> str:
+    """The content stored for a document, which may be a reference.
+
+    Documents chunked from source files are stored as references when
+    `Config.content_references` is set, see `Chunker.chunk`, and their content
+    is still that of the referenced bytes.
+    """
+    meta = doc.meta
+    if (not self.config.content_references or not meta or
+        'byte_start' not in meta or 'source' not in meta):
+      return doc.content
+    ref = reference(meta['source'], meta['byte_start'], meta['byte_end'])
+    try:
+      if source_files.resolve(ref) == doc.content:
+        return ref
+    except (OSError, ValueError):
+      pass
+    return doc.content
+
+  def sync(self, docs, source: str,
+      collection_name='default') -> SyncReport:
+    """Make the stored documents for a source match the given documents.
+
+    Each document is given a stable ID from the source and its content, and the
+    source is recorded in its metadata. Only new or changed documents are
+    written, and stored documents from the source which are no longer present
+    are deleted, so syncing the same documents again does nothing.
+    """
+    self.flush()
+    c = self.collection(collection_name=collection_name)
+    stored = c.get(where={'source': source}, include=['metadatas'])
+    current = dict(zip(stored['ids'], stored['metadatas']))
+    report = SyncReport()
+    pending = {}
+    for d in docs:
+      pending.setdefault(stable_id(source, d.content), d)
+    changed = []
+    for id, d in pending.items():
+      meta = dict(d.meta or {}, source=source)
+      if id not in current:
+        report.added += 1
+      elif current[id] != meta:
+        report.updated += 1
+      else:
+        report.unchanged += 1
+        continue
+      changed.append(Document(content=d.content, id=id, meta=meta,
+          embeddings=d.embeddings))
+    stale = [id for id in current if id not in pending]
+    report.deleted = len(stale)
+    if changed:
+      c.upsert(**self._columns(changed))
+      self._index(changed, collection_name)
+    if stale:
+      c.delete(ids=stale)
+      self._unindex(stale, collection_name)
+    self._prune_parents([(current[id] or {}).get('parent_id')
+        for id in stale + [d.id for d in changed] if id in current],
+        collection_name)
+    self.log.debug('sync', source=source, report=report)
+    return report
 
   def query_text(self, text, n_results=10,
       collection_name='default') -> list[Document]:
@@ -188,16 +978,238 @@ class DocumentStore(Configurable):
     )
     return self.query(q, collection_name=collection_name)
 
-  def query(self, query: Query,
-      collection_name='default') -> list[Document]:
-    """Query the documents."""
+  def query(self, query: Query, collection_name='default') -> DocumentList:
+    """Query the documents.
+
+    A query has a single text or embeddings, see `query_many` for several.
+    """
+    if len(query.query_texts()) > 1:
+      raise ValueError('expected a single query text, see query_many')
+    return self._query(query, collection_name)[0]
+
+  def _query(self, query, collection_name) -> list[DocumentList]:
+    """The results of each text of a query, searched in a single batch."""
+    c = self.collection(collection_name=collection_name)
+    if query.hybrid and query.query_texts():
+      return self._hybrid_query(c, query, collection_name)
+    return DocumentList.from_query_responses(
+        c.query(**self._query_args(query)))
+
+  def _query_args(self, query: Query) -> dict[str, any]:
+    """The chroma query arguments, searching by cached query embeddings."""
+    args = query.as_args()
+    if texts := args.pop('query_texts', None):
+      args['query_embeddings'] = self.embed_queries(texts)
+    return args
+
+  def _hybrid_query(self, c, query, collection_name) -> list[DocumentList]:
+    """Fuse vector and lexical search results with reciprocal rank fusion."""
+    args = self._query_args(query)
+    args['n_results'] = query.candidates or 4 * query.n_results
+    vector = DocumentList.from_query_responses(c.query(**args))
+    index = self.lexical(collection_name)
+    filters = {k: args[k] for k in ('where', 'where_document') if k in args}
+    include = [i for i in args['include'] if i != 'distances']
+    results = []
+    for text, found in zip(query.query_texts(), vector):
+      lexical = [id for id, _ in index.search(text, args['n_results'])]
+      fused = reciprocal_rank_fusion([found.ids, lexical], k=query.rrf_k)
+      seen = set(found.ids)
+      if missing := [id for id in lexical if id not in seen]:
+        # Fetching through the filters drops lexical hits which don't match.
+        fetched = c.get(ids=missing, include=include, **filters)
+        found = DocumentList.concat(
+            [found, DocumentList.from_get_response(fetched)])
+      positions = {id: i for i, id in enumerate(found.ids)}
+      fused = [positions[id] for id in fused if id in positions]
+      results.append(found.select(fused[:query.n_results]))
+    return results
+
+  def query_many(self, texts: list[str], n_results=10,
+      collection_name='default', **query_params) -> list[DocumentList]:
+    """Query the documents for many texts in a single batch.
+
+    The texts are embedded in one call and searched in one round trip, and a
+    list of results is returned for each text, in order. Other parameters are
+    passed to the `Query`.
+    """
+    if not texts:
+      return []
+    q = Query(texts=list(texts), n_results=n_results, **query_params)
+    return self._query(q, collection_name)
+
+  def get(self, ids: list[str], include=('documents', 'metadatas'),
+      collection_name='default') -> DocumentList:
+    """Load documents by ID, in the order of the IDs.
+
+    IDs which are not stored are left out. Embeddings are only loaded if
+    included.
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+      return DocumentList()
+    self.flush()
+    c = self.collection(collection_name=collection_name)
+    found = DocumentList.from_get_response(
+        c.get(ids=ids, include=list(include)))
+    positions = {id: i for i, id in enumerate(found.ids)}
+    return found.select([positions[id] for id in ids if id in positions])
+
+  def get_where(self, where: Filter | dict[str, any] = None,
+      where_document: Filter | dict[str, any] = None,
+      include=('documents', 'metadatas'), limit: int = None, offset: int = None,
+      collection_name='default') -> DocumentList:
+    """Load the documents matching metadata and content filters."""
+    self.flush()
+    c = self.collection(collection_name=collection_name)
+    args = {}
+    args.update(compile_filters(where, where_document))
+    return DocumentList.from_get_response(c.get(include=list(include),
+        limit=limit, offset=offset, **args))
+
+  def delete(self, ids: list[str] = None,
+      where: Filter | dict[str, any] = None,
+      where_document: Filter | dict[str, any] = None,
+      collection_name='default') -> int:
+    """Delete documents by ID or by filters, returning the number deleted.
+
+    When both IDs and filters are given, only the documents with those IDs
+    which match the filters are deleted. Parents which no longer have children
+    are deleted with them.
+    """
+    if ids is None and where is None and where_document is None:
+      raise ValueError('expected IDs or filters of the documents to delete')
+    if ids is not None:
+      ids = list(ids)
+      if not ids:
+        return 0
+    self.flush()
+    c = self.collection(collection_name=collection_name)
+    args = {}
+    if ids is not None:
+      args['ids'] = ids
+    args.update(compile_filters(where, where_document))
+    response = c.get(include=['metadatas'], **args)
+    found = response['ids']
+    if found:
+      c.delete(ids=found)
+      self._unindex(found, collection_name)
+      self._prune_parents([(m or {}).get('parent_id')
+          for m in response['metadatas']], collection_name)
+    self.log.debug('delete', collection=collection_name, deleted=len(found))
+    return len(found)
+
+  def update(self, docs: list[Document], collection_name='default') -> int:
+    """Update the content and metadata of stored documents by ID.
+
+    The metadata of documents is merged into their stored metadata. Content can
+    only be changed along with embeddings for it, since nothing is embedded, and
+    documents keep their stored embeddings otherwise. Documents which are not
+    stored are left out, and the number updated is returned.
+    """
+    docs = list({d.id: d for d in docs}.values())
+    if not docs:
+      return 0
+    self.flush()
     c = self.collection(collection_name=collection_name)
-    results = c.query(**query.as_args())
-    return DocumentList.from_query_response(results)
+    stored = {d.id: d for d in DocumentList.from_get_response(c.get(
+        ids=[d.id for d in docs],
+        include=['documents', 'metadatas', 'embeddings']))}
+    updated = []
+    for d in docs:
+      if (current := stored.get(d.id)) is None:
+        continue
+      if d.content != current.content and d.embeddings is None:
+        raise ValueError(f'expected embeddings for the new content of {d.id}')
+      meta = current.meta if not d.meta else {**(current.meta or {}), **d.meta}
+      if d.content != current.content and meta:
+        # The content no longer comes from its span of the source.
+        meta = {k: v for k, v in meta.items()
+                if k not in ('byte_start', 'byte_end')} or None
+      updated.append(Document(
+          content=d.content,
+          id=d.id,
+          meta=meta,
+          embeddings=current.embeddings if d.embeddings is None
+              else d.embeddings,
+      ))
+    if updated:
+      c.upsert(**self._columns(updated))
+      self._unindex([d.id for d in updated], collection_name)
+      self._index(updated, collection_name)
+    return len(updated)
 
-  def all(self, collection_name='default'):
+  def all(self, collection_name='default',
+      include=('documents', 'metadatas')) -> DocumentList:
+    """Load all the documents. Embeddings are only loaded if included."""
     c = self.collection(collection_name=collection_name)
-    return DocumentList.from_get_response(c.peek(c.count()))
+    return DocumentList.from_get_response(c.get(include=list(include)))
+
+  def iter_documents(self, batch_size=1000,
+      include=('documents', 'metadatas'),
+      collection_name='default') -> abc.Iterator[Document]:
+    """Iterate over all the documents, fetching a page at a time.
+
+    Only one page of `batch_size` documents is in memory at once, so this is
+    suitable for collections too large to load with `all`.
+    """
+    c = self.collection(collection_name=collection_name)
+    offset = 0
+    while True:
+      page = DocumentList.from_get_response(
+          c.get(limit=batch_size, offset=offset, include=list(include)))
+      yield from page
+      if len(page) < batch_size:
+        return
+      offset += batch_size
+
+  def export_snapshot(self, path: str, collection_name='default',
+      batch_size=1000) -> int:
+    """Write a collection with its embeddings to a snapshot file.
+
+    The collection is read a page at a time, and the number of documents
+    written is returned. See `import_snapshot`.
+    """
+    c = self.collection(collection_name=collection_name)
+    docs = self.iter_documents(batch_size=batch_size,
+        include=('documents', 'metadatas', 'embeddings'),
+        collection_name=collection_name)
+    count = write_snapshot(path,
+        ((d.id, d.content, d.meta, d.embeddings) for d in docs),
+        info={
+          'collection': collection_name,
+          'metadata': c.metadata,
+          'model': self.config.embeddings_model,
+        })
+    self.log.debug('export snapshot', path=path, count=count)
+    return count
+
+  def import_snapshot(self, path: str, collection_name: str = None,
+      batch_size=1000) -> int:
+    """Load the documents of a snapshot file into a collection.
+
+    Documents are written with their snapshotted embeddings, so nothing is
+    embedded, and replace stored documents with the same IDs. When the snapshot
+    was embedded with the configured model, the embeddings also fill the
+    embedding cache. The collection defaults to the snapshotted one, and the
+    number of documents loaded is returned.
+    """
+    info, batches = read_snapshot(path, batch_size=batch_size)
+    collection_name = collection_name or info['collection']
+    self.collection(collection_name, metadata=info['metadata'])
+    model = self.config.embeddings_model
+    count = 0
+    for ids, contents, metas, embeddings in batches:
+      self.upsert([Document(content=content, id=id, meta=meta, embeddings=e)
+          for id, content, meta, e in zip(ids, contents, metas, embeddings)],
+          collection_name=collection_name)
+      if info['model'] == model:
+        self.embedding_cache.update(
+            [(self.embedding_cache.key(model, content), e)
+             for content, e in zip(contents, embeddings)])
+      count += len(ids)
+    self.log.debug('import snapshot', path=path, count=count)
+    return count
 
   def __len__(self):
     c = self.collection(collection_name='default')
@@ -0,0 +1,287 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Embedding functions and caching."""
+
+import os
+import time
+import queue
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+
+from ._quantization import Codec
+
+
+#: Magic bytes and version at the start of an embedding cache file. Files of
+#: version 2 are followed by the codec name, padded to 8 bytes.
+_CACHE_MAGIC = b'BDEC\x01'
+_CACHE_MAGIC_CODEC = b'BDEC\x02'
+
+#: Each record is a 16-byte content key followed by the payload length.
+_RECORD = struct.Struct('<16sI')
+
+
+class EmbeddingCache:
+  """Content-addressed cache of embeddings with LRU eviction.
+
+  Embeddings are keyed by a digest of the model name and the text, so the same
+  text embedded with the same model is only ever computed once. The cache is
+  bounded to `max_entries` and evicts the least recently used entries.
+
+  When a path is given, the cache is persisted to a compact append-only binary
+  file of `(key, length, vector)` records which is compacted once it grows past
+  twice the size bound. The path `:memory:` disables persistence.
+
+  Vectors are kept in the form of a `Codec`, float32 by default.
+  """
+
+  def __init__(self, path: str = ':memory:', max_entries: int = 100_000,
+      codec: Codec = None):
+    self.path = path
+    self.max_entries = max_entries
+    self.codec = codec or Codec()
+    self.entries: OrderedDict[bytes, bytes] = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    self._records = 0
+    self._lock = threading.Lock()
+    if self.persistent:
+      self.load()
+
+  @property
+  def persistent(self) -> bool:
+    return self.path != ':memory:'
+
+  @staticmethod
+  def key(model: str, text: str) -> bytes:
+    """The content key for a text embedded by a model."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(model.encode('utf-8'))
+    h.update(b'\0')
+    h.update(text.encode('utf-8'))
+    return h.digest()
+
+  def get(self, key: bytes) -> np.ndarray | None:
+    """Look up an embedding, marking it as recently used."""
+    with self._lock:
+      data = self.entries.get(key)
+      if data is None:
+        self.misses += 1
+        return None
+      self.entries.move_to_end(key)
+      self.hits += 1
+    return self.codec.decode(np.frombuffer(data, dtype=self.codec.dtype))
+
+  def update(self, items: list[tuple[bytes, any]]) -> None:
+    """Add a batch of `(key, embedding)` pairs to the cache."""
+    records = []
+    with self._lock:
+      for key, vector in items:
+        data = self.codec.encode(vector).tobytes()
+        self.entries[key] = data
+        self.entries.move_to_end(key)
+        records.append(_RECORD.pack(key, len(data)) + data)
+      self._evict()
+      if self.persistent and records:
+        self._append(records)
+
+  def _evict(self):
+    while len(self.entries) > self.max_entries:
+      self.entries.popitem(last=False)
+
+  def _append(self, records):
+    if self._records > 2 * self.max_entries:
+      self._compact()
+      return
+    new = not os.path.exists(self.path)
+    with open(self.path, 'ab') as f:
+      if new:
+        f.write(self._header())
+      f.write(b''.join(records))
+    self._records += len(records)
+
+  def _compact(self):
+    tmp = f'{self.path}.tmp'
+    with open(tmp, 'wb') as f:
+      f.write(self._header())
+      for key, data in self.entries.items():
+        f.write(_RECORD.pack(key, len(data)))
+        f.write(data)
+    os.replace(tmp, self.path)
+    self._records = len(self.entries)
+
+  def _header(self) -> bytes:
+    if self.codec.lossless():
+      return _CACHE_MAGIC
+    return _CACHE_MAGIC_CODEC + self.codec.name.encode().ljust(8, b'\0')
+
+  def load(self) -> None:
+    """Load the persisted cache file, if there is one.
+
+    A last record which was only partly written is cut from the file, so that
+    the records appended next are read back.
+    """
+    if not os.path.exists(self.path):
+      return
+    with open(self.path, 'rb') as f:
+      header = f.read(len(_CACHE_MAGIC))
+      if header == _CACHE_MAGIC_CODEC:
+        header += f.read(8)
+      if header != self._header():
+        raise ValueError(f'{self.path} is not an embedding cache file '
+            f'of {self.codec.name} vectors')
+      end = f.tell()
+      while header := f.read(_RECORD.size):
+        if len(header) < _RECORD.size:
+          break
+        key, size = _RECORD.unpack(header)
+        data = f.read(size)
+        if len(data) < size:
+          break
+        self.entries[key] = data
+        self.entries.move_to_end(key)
+        self._records += 1
+        end = f.tell()
+    if end < os.path.getsize(self.path):
+      with open(self.path, 'r+b') as f:
+        f.truncate(end)
+    self._evict()
+
+  def __len__(self) -> int:
+    return len(self.entries)
+
+  def __contains__(self, key: bytes) -> bool:
+    return key in self.entries
+
+
+class CachedEmbeddingFunction(EmbeddingFunction):
+  """Embedding function that only embeds texts missing from a cache."""
+
+  def __init__(self, function: EmbeddingFunction, model: str,
+      cache: EmbeddingCache):
+    self.function = function
+    self.model = model
+    self.cache = cache
+
+  def __call__(self, input: list[str]) -> list[np.ndarray]:
+    keys = [self.cache.key(self.model, t) for t in input]
+    vectors = [self.cache.get(k) for k in keys]
+    missing = {}
+    for i, v in enumerate(vectors):
+      if v is None:
+        missing.setdefault(input[i], []).append(i)
+    if missing:
+      texts = list(missing)
+      computed = self.function(texts)
+      items = []
+      for text, vector in zip(texts, computed):
+        vector = np.asarray(vector, dtype=np.float32)
+        for i in missing[text]:
+          vectors[i] = vector
+        items.append((keys[missing[text][0]], vector))
+      self.cache.update(items)
+    return vectors
+
+  def name(self) -> str:
+    return self.function.name()
+
+  def get_config(self) -> dict[str, any]:
+    return self.function.get_config()
+
+
+class BatchingEmbeddingFunction(EmbeddingFunction):
+  """Embedding function gathering the texts of concurrent callers into batches.
+
+  Callers queue their texts and wait for their vectors. A worker thread takes
+  queued requests until it has `max_batch_size` texts, waiting up to `window`
+  seconds for more, embeds them in a single call, and hands each caller its own
+  vectors. Requests queue up while a batch is being embedded, so batches grow
+  with the load, and a lone caller waits no more than the window. Callers with
+  more than `max_batch_size` texts have them split across several batches.
+  """
+
+  def __init__(self, function: EmbeddingFunction, max_batch_size: int = 64,
+      window: float = 0.0):
+    self.function = function
+    self.max_batch_size = max_batch_size
+    self.window = window
+    self.requests = queue.SimpleQueue()
+    self.batches = 0
+    self._worker = None
+    self._lock = threading.Lock()
+
+  def __call__(self, input: list[str]) -> list[np.ndarray]:
+    with self._lock:
+      if self._worker is None:
+        self._worker = threading.Thread(target=self._run, daemon=True,
+            name='badinka-embeddings')
+        self._worker.start()
+    input = list(input)
+    futures = []
+    for i in range(0, len(input), self.max_batch_size):
+      futures.append(Future())
+      self.requests.put((input[i:i + self.max_batch_size], futures[-1]))
+    return [v for future in futures for v in future.result()]
+
+  def _run(self):
+    carried = None
+    while True:
+      pending = [carried or self.requests.get()]
+      carried = None
+      size = len(pending[0][0])
+      deadline = time.monotonic() + self.window
+      while size < self.max_batch_size:
+        remaining = deadline - time.monotonic()
+        try:
+          if remaining > 0:
+            request = self.requests.get(timeout=remaining)
+          else:
+            request = self.requests.get_nowait()
+        except queue.Empty:
+          break
+        if size + len(request[0]) > self.max_batch_size:
+          carried = request
+          break
+        pending.append(request)
+        size += len(request[0])
+      self._embed(pending)
+
+  def _embed(self, pending):
+    texts = [t for request, _ in pending for t in request]
+    try:
+      vectors = self.function(texts)
+    except Exception as e:
+      for _, future in pending:
+        future.set_exception(e)
+      return
+    self.batches += 1
+    start = 0
+    for request, future in pending:
+      future.set_result(list(vectors[start:start + len(request)]))
+      start += len(request)
+
+  def name(self) -> str:
+    return self.function.name()
+
+  def get_config(self) -> dict[str, any]:
+    return self.function.get_config()
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
@@ -0,0 +1,328 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Filter expressions for narrowing document searches.
+
+Filters are compiled to Chroma's filter syntax, so that the store narrows the
+candidates itself. Metadata filters are used as a query's `where`, and content
+filters (`Contains` and `NotContains`) as its `where_document`. Filters combine
+with `&` and `|`, e.g.
+
+```python
+Eq('source', 'a.txt') & Range('year', 2000, 2010)
+```
+
+Metadata and content filters joined with `&` are split between the two, while
+joining them with `|` can't be expressed and raises a `ValueError`.
+
+Backends which are not Chroma evaluate the compiled filters themselves with
+`match_where` and `match_document`.
+"""
+
+import re
+import abc
+import operator
+from dataclasses import dataclass
+
+
+class Filter(abc.ABC):
+  """A filter expression."""
+
+  @abc.abstractmethod
+  def compile(self) -> dict[str, any]:
+    """Compile to Chroma filter syntax."""
+
+  def __and__(self, other: 'Filter') -> 'Filter':
+    return And([self, other])
+
+  def __or__(self, other: 'Filter') -> 'Filter':
+    return Or([self, other])
+
+
+@dataclass
+class _Comparison(Filter):
+
+  #: The metadata key.
+  key: str
+
+  #: The value compared against.
+  value: str | int | float | bool
+
+  #: The Chroma operator.
+  operator = None
+
+  def compile(self):
+    return {self.key: {self.operator: self.value}}
+
+
+class Eq(_Comparison):
+  """Metadata value is equal to a value."""
+  operator = '$eq'
+
+
+class Ne(_Comparison):
+  """Metadata value is not equal to a value."""
+  operator = '$ne'
+
+
+class Gt(_Comparison):
+  """Metadata value is greater than a value."""
+  operator = '$gt'
+
+
+class Gte(_Comparison):
+  """Metadata value is greater than or equal to a value."""
+  operator = '$gte'
+
+
+class Lt(_Comparison):
+  """Metadata value is less than a value."""
+  operator = '$lt'
+
+
+class Lte(_Comparison):
+  """Metadata value is less than or equal to a value."""
+  operator = '$lte'
+
+
+@dataclass
+class In(Filter):
+  """Metadata value is one of some values."""
+
+  #: The metadata key.
+  key: str
+
+  #: The accepted values.
+  values: list[str | int | float | bool]
+
+  def compile(self):
+    return {self.key: {'$in': list(self.values)}}
+
+
+class NotIn(In):
+  """Metadata value is none of some values."""
+
+  def compile(self):
+    return {self.key: {'$nin': list(self.values)}}
+
+
+@dataclass
+class Range(Filter):
+  """Metadata value is within an inclusive range.
+
+  Either end may be left out for an open range.
+  """
+
+  #: The metadata key.
+  key: str
+
+  #: The lowest accepted value.
+  low: int | float = None
+
+  #: The highest accepted value.
+  high: int | float = None
+
+  def compile(self):
+    bounds = []
+    if self.low is not None:
+      bounds.append(Gte(self.key, self.low))
+    if self.high is not None:
+      bounds.append(Lte(self.key, self.high))
+    return And(bounds).compile()
+
+
+@dataclass
+class Contains(Filter):
+  """Document content contains some text."""
+
+  #: The text to look for.
+  text: str
+
+  def compile(self):
+    return {'$contains': self.text}
+
+
+class NotContains(Contains):
+  """Document content does not contain some text."""
+
+  def compile(self):
+    return {'$not_contains': self.text}
+
+
+@dataclass
+class And(Filter):
+  """All filters match."""
+
+  #: The combined filters.
+  filters: list[Filter]
+
+  #: The Chroma operator.
+  operator = '$and'
+
+  def compile(self):
+    if not self.filters:
+      raise ValueError('cannot compile an empty filter')
+    if len(self.filters) == 1:
+      return compile_filter(self.filters[0])
+    return {self.operator: [compile_filter(f) for f in self.filters]}
+
+  def __and__(self, other):
+    return And(self.filters + [other])
+
+
+class Or(And):
+  """Any filter matches."""
+
+  operator = '$or'
+
+  def __and__(self, other):
+    return And([self, other])
+
+  def __or__(self, other):
+    return Or(self.filters + [other])
+
+
+def compile_filter(f: Filter | dict[str, any]) -> dict[str, any]:
+  """Compile a filter, passing through filters already in Chroma syntax."""
+  return f if isinstance(f, dict) else f.compile()
+
+
+def compile_filters(where: Filter | dict[str, any] = None,
+    where_document: Filter | dict[str, any] = None) -> dict[str, any]:
+  """Compile metadata and content filters to Chroma `where` arguments.
+
+  Content filters combined into the metadata filter with `&` are moved to the
+  content filter, and the other way around.
+  """
+  wheres, documents = [], []
+  for f in (where, where_document):
+    if f:
+      w, d = _split(f)
+      wheres += w
+      documents += d
+  args = {}
+  if wheres:
+    args['where'] = wheres[0] if len(wheres) == 1 else {'$and': wheres}
+  if documents:
+    args['where_document'] = documents[0] if len(documents) == 1 else \
+        {'$and': documents}
+  return args
+
+
+def _split(f):
+  """The compiled metadata and content filters all of which a filter needs."""
+  compiled = compile_filter(f)
+  kind = _kind(compiled)
+  if kind == 'where':
+    return [compiled], []
+  if kind == 'where_document':
+    return [], [compiled]
+  if list(compiled) != ['$and']:
+    raise ValueError('cannot combine metadata and content filters with "|"')
+  wheres, documents = [], []
+  for c in compiled['$and']:
+    w, d = _split(c)
+    wheres += w
+    documents += d
+  return wheres, documents
+
+
+def _kind(compiled):
+  """Whether a compiled filter is on `where`, `where_document` or both."""
+  kinds = set()
+  for key, value in compiled.items():
+    if key in ('$and', '$or'):
+      kinds.update(_kind(c) for c in value)
+    elif key in _document_operators:
+      kinds.add('where_document')
+    else:
+      kinds.add('where')
+  if len(kinds) > 1:
+    return 'both'
+  return kinds.pop() if kinds else 'where'
+
+
+#: The operators of content filters.
+_document_operators = ('$contains', '$not_contains', '$regex', '$not_regex')
+
+
+def match_where(where: dict[str, any], meta: dict[str, any]) -> bool:
+  """Whether metadata matches a compiled metadata filter.
+
+  A key missing from the metadata matches no comparison.
+  """
+  meta = meta or {}
+  for key, condition in where.items():
+    if key == '$and':
+      matched = all(match_where(w, meta) for w in condition)
+    elif key == '$or':
+      matched = any(match_where(w, meta) for w in condition)
+    elif key not in meta:
+      matched = False
+    else:
+      if not isinstance(condition, dict):
+        condition = {'$eq': condition}
+      matched = all(_compare(op, meta[key], value)
+                    for op, value in condition.items())
+    if not matched:
+      return False
+  return True
+
+
+def match_document(where_document: dict[str, any], content: str) -> bool:
+  """Whether content matches a compiled document content filter."""
+  content = content or ''
+  for key, value in where_document.items():
+    match key:
+      case '$and':
+        matched = all(match_document(w, content) for w in value)
+      case '$or':
+        matched = any(match_document(w, content) for w in value)
+      case '$contains':
+        matched = value in content
+      case '$not_contains':
+        matched = value not in content
+      case '$regex':
+        matched = re.search(value, content) is not None
+      case '$not_regex':
+        matched = re.search(value, content) is None
+      case _:
+        raise ValueError(f'unknown document filter operator {key}')
+    if not matched:
+      return False
+  return True
+
+
+def _compare(op: str, value, target) -> bool:
+  try:
+    return _operators[op](value, target)
+  except KeyError:
+    raise ValueError(f'unknown filter operator {op}') from None
+  except TypeError:
+    return False
+
+
+_operators = {
+    '$eq': operator.eq,
+    '$ne': operator.ne,
+    '$gt': operator.gt,
+    '$gte': operator.ge,
+    '$lt': operator.lt,
+    '$lte': operator.le,
+    '$in': lambda value, values: value in values,
+    '$nin': lambda value, values: value not in values,
+}
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
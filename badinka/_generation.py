@@ -14,13 +14,17 @@
 
 from dataclasses import dataclass, field
 import datetime
+import functools
 
 import jinja2
 import ollama
 
 from ._config import Config
+from ._documents import Query, DocumentList
+from ._filters import Filter
 from ._tools import Tool, ToolParser
 from ._parsing import Parser
+from ._ranking import maximal_marginal_relevance
 
 
 @dataclass
@@ -65,19 +69,103 @@ class Prompt:
   #: The template content as a string.
   template: str
 
+  def compile(self) -> jinja2.Template:
+    """The compiled template, which is shared by prompts with equal templates."""
+    return _compile(self.template)
+
   def render(self, **prompt_params: dict[str, any]) -> str:
     """Render the template with the given prompt parameters."""
-    t = jinja2.Template(self.template)
-    return t.render(**prompt_params)
+    return self.compile().render(**prompt_params)
+
+
+@functools.lru_cache(maxsize=256)
+def _compile(template: str) -> jinja2.Template:
+  return jinja2.Template(template)
 
 
 @dataclass
 class Injection:
   """Context injection parameters to populate the prompt context."""
 
-  #: The number of results to populate the context.
+  #: The largest number of results to populate the context. Fewer are injected
+  #: when results are cut off by their distance, and none when no results
+  #: are close enough, in which case the prompt has no context.
   n_results: int = 10
 
+  #: The fields fetched for each result. Only the text is needed to populate
+  #: the context.
+  include: list[str] = field(default_factory=lambda: ['documents'])
+
+  #: A metadata filter narrowing the documents searched.
+  where: Filter | dict[str, any] = None
+
+  #: A document content filter narrowing the documents searched.
+  where_document: Filter | dict[str, any] = None
+
+  #: Whether to fuse lexical and vector search, see `Query.hybrid`.
+  hybrid: bool = False
+
+  #: The weight of diversity against relevance, from 0 to 1, when picking
+  #: results by maximal marginal relevance. When set, extra candidates are
+  #: fetched and a diverse `n_results` of them are injected, so near-duplicate
+  #: results don't waste the prompt.
+  diversity: float = None
+
+  #: The number of candidates fetched when diversifying or collapsing results.
+  #: Defaults to four times the number of results.
+  candidates: int = None
+
+  #: Whether to merge results which overlap or are next to each other in their
+  #: source into a single result. This needs chunks with source offsets, such
+  #: as those from a `Chunker`.
+  collapse: bool = False
+
+  #: Whether to replace matched children by their parents, see
+  #: `ParentChunker`. Parents matched by several children are injected once.
+  expand: bool = False
+
+  #: The largest distance from the query of injected results, in the space of
+  #: the collection. Results which are further are not relevant enough.
+  max_distance: float = None
+
+  #: The largest distance from the query of injected results, as a multiple of
+  #: the distance of the nearest result, so that results much weaker than the
+  #: best are dropped. Zero and negative nearest distances are scaled by their
+  #: magnitude, see `DocumentList.within`.
+  max_distance_ratio: float = None
+
+  def as_query(self, text: str) -> Query:
+    """The document store query for the rendered query text."""
+    n_results = self.n_results
+    include = list(self.include)
+    if self.diversity is not None or self.collapse or self.expand:
+      n_results = self.candidates or 4 * self.n_results
+      include.append('distances')
+    if self.max_distance is not None or self.max_distance_ratio is not None:
+      include.append('distances')
+    if self.diversity is not None:
+      include.append('embeddings')
+    if self.collapse or self.expand:
+      include.append('metadatas')
+    return Query(
+        text=text,
+        n_results=n_results,
+        include=sorted(set(include)),
+        where=self.where,
+        where_document=self.where_document,
+        hybrid=self.hybrid,
+    )
+
+  def select(self, docs: DocumentList) -> DocumentList:
+    """Pick the documents to inject from the query results."""
+    docs = docs.within(self.max_distance, self.max_distance_ratio)
+    if self.collapse:
+      docs = docs.collapse()
+    if self.diversity is not None:
+      docs = docs.select(maximal_marginal_relevance(
+          docs.distances, docs.embeddings, self.n_results, self.diversity))
+    return docs[:self.n_results]
+
 
 @dataclass
 class Instruction:
@@ -141,6 +229,10 @@ class Instruction:
         template=default_instruction_template)
   )
 
+  #: The instruction rendered by `prepare` with a placeholder for the context,
+  #: and what it was rendered from.
+  _prepared: tuple = field(default=None, init=False, repr=False, compare=False)
+
   def rationalize(self):
     tool_parsers = [ToolParser(t) for t in self.tools]
     self.parsers = tool_parsers + self.parsers
@@ -155,18 +247,41 @@ class Instruction:
       return self.prompt.render(**kw)
     return self.query
 
+  def prepare(self, **kw):
+    """Renders everything but the context ahead of time.
+
+    The instruction is rendered with a placeholder for the context, so this can
+    be done while the context is being retrieved. `render` then only inserts the
+    context, as long as nothing else has changed.
+    """
+    prepared = self._render(self.render_query(**kw), _CONTEXT)
+    self._prepared = (self._parts(kw), prepared)
+
   def render(self, **kw) -> str:
     """Renders the complete prompt."""
-    q = self.render_query(**kw)
-    p = self.template.render(
+    if (self._prepared is not None and self.context is not None and
+        self._prepared[0] == self._parts(kw)):
+      return self._prepared[1].replace(_CONTEXT, self.context, 1)
+    return self._render(self.render_query(**kw), self.context)
+
+  def _render(self, q, context):
+    return self.template.render(
         role = self.role,
         tone = self.tone,
         detail = self.detail,
-        context = self.context,
+        context = context,
         tools = self.tools,
         query = q,
     )
-    return p
+
+  def _parts(self, kw):
+    """Everything rendered besides the context."""
+    return (dict(kw), self.prompt, self.query, self.role, self.tone, self.detail,
+            list(self.tools), self.template)
+
+
+#: The placeholder for the context of prepared instructions.
+_CONTEXT = '\0context\0'
 
 
 @dataclass
@@ -248,6 +363,16 @@ class Generator:
     self.config.log.debug('generate response', reply=reply)
     return reply
 
+  def load(self, options: Options = None):
+    """Load the generation model, so that it is ready for the next request.
+
+    Ollama loads a model when it is sent an empty prompt, and returns once the
+    model is loaded.
+    """
+    model = (options and options.model) or self.config.generation_model
+    self.config.log.debug('load request', model=model)
+    ollama.generate(model=model)
+
   def generate_from_prompt(self, prompt: Prompt,
       options: Options=None,
       **prompt_params) -> Reply:
@@ -0,0 +1,382 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streaming ingestion of files into the document store.
+
+Ingestion is a chain of generator stages:
+
+1. source: walks the given paths for files
+2. loader: reads each file as a stream of bounded segments
+3. chunker: parses and splits segments into documents in a process pool
+4. embedder: embeds documents in batches
+5. writer: upserts the batches into the document store
+
+Each stage runs ahead of the next into a bounded queue, so a slow stage applies
+backpressure to the stages before it and memory stays flat however large the
+corpus is.
+"""
+
+import os
+import abc
+import json
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from ._documents import Document, DocumentStore, ParentDocument
+from ._chunking import Chunker, SentenceChunker
+
+
+@dataclass
+class Segment:
+  """A bounded piece of a source file."""
+
+  #: The path of the source file.
+  source: str
+
+  #: The text of the segment.
+  text: str
+
+  #: The character offset of the segment in the source file.
+  offset: int = 0
+
+  #: Metadata for documents created from this segment.
+  meta: dict[str, any] = field(default_factory=dict)
+
+  #: The byte offset of the segment in the source file, when the text is the
+  #: UTF-8 content of the file from there.
+  byte_offset: int = None
+
+
+class Loader(abc.ABC):
+  """Reads source files as a stream of bounded segments."""
+
+  #: The file extensions handled by this loader.
+  extensions: tuple[str, ...] = ()
+
+  def __init__(self, segment_size: int = 1 << 20):
+    #: The approximate size of each segment in characters.
+    self.segment_size = segment_size
+
+  @abc.abstractmethod
+  def read(self, path: str) -> Iterator[Segment]:
+    """Read the raw segments of a file. This runs in the loader stage."""
+
+  def parse(self, segment: Segment) -> list[Segment]:
+    """Parse a raw segment. This runs in the process pool."""
+    return [segment]
+
+
+class TextLoader(Loader):
+  """Loads plain text files.
+
+  Segments are cut at the last paragraph, line or sentence break so that no
+  sentence is split between two segments.
+  """
+
+  extensions = ('.txt',)
+
+  #: The preferred places to cut segments, in order.
+  boundaries: tuple[str, ...] = ('\n\n', '\n', '. ', ' ')
+
+  def read(self, path):
+    offset = 0
+    byte_offset = 0
+    carry = ''
+    # Newlines are not translated, so offsets are positions in the file.
+    with open(path, encoding='utf-8', newline='') as f:
+      while block := f.read(self.segment_size):
+        text = carry + block
+        cut = self._cut(text)
+        yield Segment(source=path, text=text[:cut], offset=offset,
+            byte_offset=byte_offset)
+        offset += cut
+        byte_offset += len(text[:cut].encode('utf-8'))
+        carry = text[cut:]
+    if carry:
+      yield Segment(source=path, text=carry, offset=offset,
+          byte_offset=byte_offset)
+
+  def _cut(self, text: str) -> int:
+    for b in self.boundaries:
+      i = text.rfind(b, len(text) // 2)
+      if i >= 0:
+        return i + len(b)
+    return len(text)
+
+
+class MarkdownLoader(TextLoader):
+  """Loads Markdown files, preferring to cut segments before headings."""
+
+  extensions = ('.md', '.markdown')
+
+  boundaries = ('\n#', '\n\n', '\n', '. ', ' ')
+
+  def _cut(self, text):
+    cut = super()._cut(text)
+    return cut - 1 if text[cut - 2:cut] == '\n#' else cut
+
+
+class JsonlLoader(Loader):
+  """Loads JSON lines files where each line is a document.
+
+  The content is read from the `content_key` field of each record, and the
+  other scalar fields are kept as metadata, along with the `line` number of
+  the record. Since the content is escaped in the file, the offsets of its
+  documents are those of their line plus their position in the content, and
+  their content is never stored as a reference.
+  """
+
+  extensions = ('.jsonl',)
+
+  def __init__(self, segment_size: int = 1 << 20,
+      content_key: str = 'content'):
+    super().__init__(segment_size)
+    self.content_key = content_key
+
+  def read(self, path):
+    lines = []
+    size = 0
+    line = 0
+    offset = 0
+    # Newlines are not translated, so offsets are positions in the file.
+    with open(path, encoding='utf-8', newline='') as f:
+      for i, raw in enumerate(f):
+        lines.append(raw)
+        size += len(raw)
+        if size >= self.segment_size:
+          yield Segment(source=path, text=''.join(lines), offset=offset,
+              meta={'line': line})
+          offset += size
+          lines, size, line = [], 0, i + 1
+    if lines:
+      yield Segment(source=path, text=''.join(lines), offset=offset,
+          meta={'line': line})
+
+  def parse(self, segment):
+    segments = []
+    offset = segment.offset
+    for i, raw in enumerate(segment.text.splitlines(keepends=True)):
+      start, offset = offset, offset + len(raw)
+      if not raw.strip():
+        continue
+      record = json.loads(raw)
+      content = record.pop(self.content_key, '')
+      meta = {k: v for k, v in record.items()
+              if isinstance(v, (str, int, float, bool))}
+      meta['line'] = segment.meta.get('line', 0) + i
+      segments.append(Segment(source=segment.source, text=content,
+          offset=start, meta=meta))
+    return segments
+
+
+#: The loaders used when none are given.
+default_loaders = (TextLoader(), MarkdownLoader(), JsonlLoader())
+
+
+@dataclass
+class IngestReport:
+  """The work done by an ingestion run."""
+
+  #: The number of files read.
+  files: int = 0
+
+  #: The number of documents written.
+  documents: int = 0
+
+  #: The number of batches embedded and written.
+  batches: int = 0
+
+
+class Pipeline:
+  """Streams files from disk into a document store."""
+
+  def __init__(self, store: DocumentStore,
+      loaders: Iterable[Loader] = default_loaders,
+      chunker: Chunker = SentenceChunker(),
+      collection_name: str = 'default',
+      batch_size: int = 64,
+      queue_size: int = 8,
+      workers: int = None):
+    self.store = store
+    self.loaders = {e: l for l in loaders for e in l.extensions}
+    #: The chunker splitting segments into documents.
+    self.chunker = chunker
+    self.collection_name = collection_name
+    #: The number of documents embedded and written at once.
+    self.batch_size = batch_size
+    #: The number of items buffered between each stage.
+    self.queue_size = queue_size
+    #: The number of chunking processes. When 0, chunking runs in a thread.
+    #: Processes are spawned rather than forked, since forking copies the
+    #: store's threads and locks in whatever state they are in.
+    self.workers = workers
+
+  def run(self, paths: Iterable[str]) -> IngestReport:
+    """Ingest the files, or files in the directories, at the given paths."""
+    report = IngestReport()
+    pool = _InlineExecutor() if self.workers == 0 else ProcessPoolExecutor(
+        self.workers, mp_context=multiprocessing.get_context('spawn'))
+    with pool:
+      files = _buffered(self.source(paths, report), self.queue_size)
+      segments = _buffered(self.load(files), self.queue_size)
+      docs = _buffered(self.chunk(segments, pool), self.queue_size)
+      batches = _buffered(self.embed(docs), self.queue_size)
+      self.write(batches, report)
+    self.store.log.debug('ingested', report=report)
+    return report
+
+  def source(self, paths, report) -> Iterator[str]:
+    """Walk the paths for files that have a loader."""
+    for path in paths:
+      walk = os.walk(path) if os.path.isdir(path) else \
+          [(os.path.dirname(path), [], [os.path.basename(path)])]
+      for root, dirs, names in walk:
+        dirs.sort()
+        for name in sorted(names):
+          if os.path.splitext(name)[1] in self.loaders:
+            report.files += 1
+            yield os.path.join(root, name)
+
+  def load(self, files) -> Iterator[tuple[Loader, Segment]]:
+    """Read the files as raw segments."""
+    for path in files:
+      loader = self.loaders[os.path.splitext(path)[1]]
+      for segment in loader.read(path):
+        yield loader, segment
+
+  def chunk(self, segments, pool) -> Iterator[Document]:
+    """Parse and chunk the segments in the pool, keeping their order."""
+    work = ((_parse_and_chunk, loader, self.chunker, segment)
+            for loader, segment in segments)
+    pending = deque()
+    for task in work:
+      pending.append(pool.submit(*task))
+      if len(pending) > self.queue_size:
+        yield from pending.popleft().result()
+    while pending:
+      yield from pending.popleft().result()
+
+  def embed(self, docs) -> Iterator[list[Document]]:
+    """Embed the documents in batches."""
+    batch = []
+    for d in docs:
+      batch.append(d)
+      if len(batch) == self.batch_size:
+        yield self._embed_batch(batch)
+        batch = []
+    if batch:
+      yield self._embed_batch(batch)
+
+  def _embed_batch(self, batch):
+    # Parents are not embedded, and near duplicates are dropped before they are.
+    parents = [d for d in batch if isinstance(d, ParentDocument)]
+    batch = self.store.deduplicate(
+        [d for d in batch if not isinstance(d, ParentDocument)],
+        collection_name=self.collection_name)
+    if batch:
+      embeddings = self.store.embedding_function([d.content for d in batch])
+      for d, e in zip(batch, embeddings):
+        d.embeddings = e
+    return parents + batch
+
+  def write(self, batches, report) -> None:
+    """Write the batches to the document store."""
+    for batch in batches:
+      if not batch:
+        continue
+      batch = list({(type(d), d.id): d for d in batch}.values())
+      self.store.upsert(batch, collection_name=self.collection_name)
+      report.documents += sum(not isinstance(d, ParentDocument) for d in batch)
+      report.batches += 1
+
+
+def _parse_and_chunk(loader, chunker, segment):
+  return [d for s in loader.parse(segment) for d in chunker(s)]
+
+
+class _InlineExecutor:
+  """Runs submitted work in the calling thread."""
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    pass
+
+  def submit(self, fn, *args):
+    return _Done(fn(*args))
+
+
+@dataclass
+class _Done:
+  value: any
+
+  def result(self):
+    return self.value
+
+
+@dataclass
+class _Failed:
+  error: BaseException
+
+
+_end = object()
+
+
+def _buffered(items: Iterable, maxsize: int) -> Iterator:
+  """Run a generator stage in a thread, ahead of its consumer.
+
+  The stage blocks when `maxsize` items are waiting to be consumed. Errors are
+  raised in the consumer, and the stage stops when the consumer does.
+  """
+  q = queue.Queue(maxsize)
+  stop = threading.Event()
+
+  def put(item):
+    while not stop.is_set():
+      try:
+        q.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def produce():
+    try:
+      for item in items:
+        if not put(item):
+          return
+      put(_end)
+    except BaseException as e:
+      put(_Failed(e))
+    finally:
+      if close := getattr(items, 'close', None):
+        close()
+
+  threading.Thread(target=produce, daemon=True).start()
+  try:
+    while (item := q.get()) is not _end:
+      if isinstance(item, _Failed):
+        raise item.error
+      yield item
+  finally:
+    stop.set()
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
@@ -0,0 +1,101 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Lexical search with an in-process inverted index."""
+
+import re
+import math
+import heapq
+import threading
+from collections import Counter
+
+
+_word = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> list[str]:
+  """Split text into lower case word terms."""
+  return _word.findall(text.lower())
+
+
+class LexicalIndex:
+  """Inverted index of documents scored with BM25.
+
+  Vector search can miss exact identifiers and rare terms, which lexical search
+  finds reliably, so the two are fused for hybrid queries.
+
+  The index can be searched while another thread updates it.
+  """
+
+  def __init__(self, k1: float = 1.5, b: float = 0.75):
+    #: Term frequency saturation.
+    self.k1 = k1
+    #: Document length normalization.
+    self.b = b
+    self.postings: dict[str, dict[str, int]] = {}
+    self.lengths: dict[str, int] = {}
+    self.terms: dict[str, tuple[str, ...]] = {}
+    self.total_length = 0
+    self.lock = threading.RLock()
+
+  def add(self, ids: list[str], texts: list[str]) -> None:
+    """Index documents, replacing any already indexed with the same IDs."""
+    with self.lock:
+      self.remove(ids)
+      for id, text in zip(ids, texts):
+        counts = Counter(tokenize(text or ''))
+        for term, tf in counts.items():
+          self.postings.setdefault(term, {})[id] = tf
+        self.terms[id] = tuple(counts)
+        length = sum(counts.values())
+        self.lengths[id] = length
+        self.total_length += length
+
+  def remove(self, ids: list[str]) -> None:
+    """Remove documents from the index."""
+    with self.lock:
+      for id in ids:
+        if id not in self.terms:
+          continue
+        for term in self.terms.pop(id):
+          posting = self.postings[term]
+          del posting[id]
+          if not posting:
+            del self.postings[term]
+        self.total_length -= self.lengths.pop(id)
+
+  def search(self, text: str, n_results: int = 10) -> list[tuple[str, float]]:
+    """The best matching `(id, score)` pairs for a text, best first."""
+    with self.lock:
+      n = len(self.lengths)
+      if not n:
+        return []
+      average = self.total_length / n
+      scores = Counter()
+      for term in set(tokenize(text)):
+        posting = self.postings.get(term)
+        if not posting:
+          continue
+        df = len(posting)
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for id, tf in posting.items():
+          norm = self.k1 * (1 - self.b + self.b * self.lengths[id] / average)
+          scores[id] += idf * tf * (self.k1 + 1) / (tf + norm)
+    return heapq.nlargest(n_results, scores.items(), key=lambda s: s[1])
+
+  def __len__(self) -> int:
+    return len(self.lengths)
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
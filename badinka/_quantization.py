@@ -0,0 +1,167 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact representations of embedding vectors.
+
+Codecs encode float32 vectors as rows of a smaller type: float16 halves their
+size, and int8 with a scale for each vector quarters it. A codec may also keep
+only the leading dimensions of each vector, which suits models trained so that
+their leading dimensions carry the most information.
+
+Searching compact vectors loses some recall, which is mostly won back by
+reranking the best candidates with the full vectors. `evaluate_codecs` measures
+the trade-off on a sample of vectors.
+"""
+
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class Codec:
+  """Keeps vectors as float32, optionally truncated."""
+
+  #: The number of leading dimensions kept, or all of them when `None`.
+  dims: int = None
+
+  #: The codec name.
+  name = 'float32'
+
+  #: The type of the encoded rows.
+  dtype = np.float32
+
+  def truncate(self, vectors: np.ndarray) -> np.ndarray:
+    """Keep the leading dimensions of the vectors."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors if self.dims is None else vectors[..., :self.dims]
+
+  def encode(self, vectors: np.ndarray) -> np.ndarray:
+    """Encode a matrix of vectors as a matrix of rows."""
+    return np.ascontiguousarray(self.truncate(vectors), dtype=self.dtype)
+
+  def decode(self, rows: np.ndarray) -> np.ndarray:
+    """Decode a matrix of rows as float32 vectors."""
+    return np.asarray(rows, dtype=np.float32)
+
+  def lossless(self) -> bool:
+    """Whether decoding gives back the vectors exactly."""
+    return self.dims is None and self.dtype == np.float32
+
+
+class Float16Codec(Codec):
+  """Keeps vectors as float16."""
+
+  name = 'float16'
+  dtype = np.float16
+
+
+class Int8Codec(Codec):
+  """Keeps vectors as int8, scaled by each vector's largest magnitude.
+
+  The float32 scale is kept in the last four bytes of each row.
+  """
+
+  name = 'int8'
+  dtype = np.int8
+
+  def encode(self, vectors):
+    vectors = self.truncate(vectors)
+    scale = np.abs(vectors).max(axis=-1, keepdims=True) / 127
+    scale[scale == 0] = 1
+    codes = np.rint(vectors / scale).astype(np.int8)
+    return np.concatenate(
+        [codes, scale.astype(np.float32).view(np.int8)], axis=-1)
+
+  def decode(self, rows):
+    rows = np.asarray(rows)
+    scale = np.ascontiguousarray(rows[..., -4:]).view(np.float32)
+    return rows[..., :-4].astype(np.float32) * scale
+
+
+#: The codecs by name.
+codecs = {c.name: c for c in (Codec, Float16Codec, Int8Codec)}
+
+
+def codec_for(name: str, dims: int = None) -> Codec:
+  """The codec with a name."""
+  try:
+    return codecs[name](dims)
+  except KeyError:
+    raise ValueError(f'unknown vector codec {name}') from None
+
+
+@dataclass
+class CodecReport:
+  """The trade-off of searching vectors with a codec."""
+
+  #: The codec name.
+  codec: str
+
+  #: The number of leading dimensions kept, or `None` for all of them.
+  dims: int
+
+  #: The number of candidates reranked for each result, or 0.
+  rerank: int
+
+  #: The fraction of the exact nearest neighbours found.
+  recall: float
+
+  #: The mean search time for a query, in seconds.
+  latency: float
+
+  #: The size of each encoded vector.
+  bytes_per_vector: int
+
+
+def evaluate_codecs(vectors: np.ndarray, queries: np.ndarray,
+    codecs: list[Codec] = None, reranks: tuple[int] = (0, 4), k: int = 10,
+    space: str = 'l2') -> list[CodecReport]:
+  """Measure the recall and latency of searching vectors with each codec.
+
+  Each codec is searched with and without reranking, and compared with an exact
+  search of the float32 vectors. By default the codecs are float16 and int8.
+  """
+  from ._backends import NumpyCollection
+  vectors = np.asarray(vectors, dtype=np.float32)
+  queries = np.asarray(queries, dtype=np.float32)
+  codecs = codecs or [Float16Codec(), Int8Codec()]
+  ids = [str(i) for i in range(len(vectors))]
+  metadata = {'hnsw:space': space}
+
+  def search(codec, rerank):
+    c = NumpyCollection('evaluate', metadata=metadata, codec=codec,
+        rerank=rerank, index_threshold=len(vectors) + 1)
+    c.add(ids=ids, embeddings=vectors)
+    start = time.perf_counter()
+    found = [c.query(query_embeddings=q[None], n_results=k,
+        include=[])['ids'][0] for q in queries]
+    latency = (time.perf_counter() - start) / len(queries)
+    return found, latency, c.vectors.row_bytes
+
+  expected, _, _ = search(Codec(), 0)
+  reports = []
+  for codec in codecs:
+    for rerank in reranks:
+      found, latency, size = search(codec, rerank)
+      recall = np.mean([len(set(e) & set(f)) / max(len(e), 1)
+          for e, f in zip(expected, found)])
+      reports.append(CodecReport(codec=codec.name, dims=codec.dims,
+          rerank=rerank, recall=float(recall), latency=latency,
+          bytes_per_vector=size))
+  return reports
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
@@ -0,0 +1,73 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Ranking of retrieved documents."""
+
+from collections import Counter
+
+import numpy as np
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]],
+    k: int = 60) -> list[str]:
+  """Fuse several rankings of IDs into one, best first.
+
+  Each ID scores `1 / (k + rank)` in every ranking it appears in, so IDs ranked
+  well by several retrievers rise to the top, without needing their scores to be
+  comparable.
+  """
+  scores = Counter()
+  for ranking in rankings:
+    for rank, id in enumerate(ranking, start=1):
+      scores[id] += 1 / (k + rank)
+  return [id for id, _ in scores.most_common()]
+
+
+def maximal_marginal_relevance(distances: list[float], embeddings: np.ndarray,
+    k: int, diversity: float = 0.3) -> list[int]:
+  """Pick `k` relevant but diverse results, returning their positions.
+
+  Results are picked greedily by their relevance, penalized by their cosine
+  similarity to the most similar result already picked. Relevance is the
+  distance from the query rescaled to between 0 (furthest) and 1 (closest), and
+  `diversity` is the weight of the penalty, from 0 (relevance only) to 1. When
+  some distances are unknown, as for lexical hits, the results are assumed to
+  be in rank order and relevance falls linearly with rank instead.
+  """
+  n = len(distances)
+  if n <= 1:
+    return list(range(min(n, k)))
+  if any(d is None for d in distances):
+    d = np.arange(n, dtype=np.float32)
+  else:
+    d = np.asarray(distances, dtype=np.float32)
+  spread = d.max() - d.min()
+  relevance = (d.max() - d) / spread if spread else np.ones(n, np.float32)
+  v = np.asarray(embeddings, dtype=np.float32)
+  v = v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-12)
+  similarity = v @ v.T
+  closest = np.full(n, -np.inf, dtype=np.float32)
+  available = np.ones(n, dtype=bool)
+  picked = []
+  for _ in range(min(k, n)):
+    penalty = np.where(np.isinf(closest), 0, closest)
+    score = (1 - diversity) * relevance - diversity * penalty
+    i = int(np.argmax(np.where(available, score, -np.inf)))
+    picked.append(i)
+    available[i] = False
+    closest = np.maximum(closest, similarity[i])
+  return picked
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
@@ -0,0 +1,98 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""References to document content in memory-mapped source files.
+
+When `Config.content_references` is set, documents chunked from read-only UTF-8
+source files are stored with a short reference to the bytes of their content in
+the file, instead of the content itself. References are resolved by slicing the
+memory-mapped file when the content of a read document is accessed, so neither
+the store nor the process keeps a copy of the corpus text.
+"""
+
+import os
+import mmap
+import threading
+from collections import OrderedDict
+
+
+#: The prefix of references, which never starts the content of a text file.
+_PREFIX = '\0ref:'
+
+
+def reference(path: str, start: int, end: int) -> str:
+  """A reference to the UTF-8 content between two byte offsets of a file.
+
+  The path is made absolute, so the reference resolves from any directory.
+  """
+  return f'{_PREFIX}{start}:{end}:{os.path.abspath(path)}'
+
+
+def is_reference(content: str) -> bool:
+  """Whether stored content is a reference."""
+  return isinstance(content, str) and content.startswith(_PREFIX)
+
+
+class SourceFiles:
+  """Memory maps of source files, resolving references into them.
+
+  The most recently used files are kept mapped, and the others are unmapped.
+  """
+
+  def __init__(self, max_open: int = 64):
+    #: The number of files kept mapped.
+    self.max_open = max_open
+    self.maps: OrderedDict[str, mmap.mmap] = OrderedDict()
+    self.lock = threading.RLock()
+
+  def resolve(self, content: str) -> str:
+    """The content of a reference, or the content when it is not one."""
+    if not is_reference(content):
+      return content
+    start, end, path = content[len(_PREFIX):].split(':', 2)
+    # Other threads may unmap the file once the lock is released.
+    with self.lock:
+      data = self.map(path)[int(start):int(end)]
+    return data.decode('utf-8')
+
+  def map(self, path: str) -> mmap.mmap:
+    """The memory map of a file.
+
+    The map is only valid while `lock` is held, since other files being mapped
+    can unmap it.
+    """
+    with self.lock:
+      m = self.maps.get(path)
+      if m is None:
+        with open(path, 'rb') as f:
+          m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps[path] = m
+        while len(self.maps) > self.max_open:
+          self.maps.popitem(last=False)[1].close()
+      self.maps.move_to_end(path)
+      return m
+
+  def close(self) -> None:
+    """Unmap every file."""
+    with self.lock:
+      for m in self.maps.values():
+        m.close()
+      self.maps.clear()
+
+
+#: The source files of every document store.
+source_files = SourceFiles()
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
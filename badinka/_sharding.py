@@ -0,0 +1,223 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Collections split into shards.
+
+The documents of a sharded collection are routed by a hash of their ID to one
+of its shards, which are collections named `<name>.<shard>` in the backend.
+Writes only touch the shards of their documents, and queries search every shard
+in parallel and merge their nearest results.
+"""
+
+import os
+import hashlib
+from concurrent.futures import Executor
+
+import numpy as np
+
+from ._backends import NumpyCollection
+
+
+def shard_of(id: str, shards: int) -> int:
+  """The shard of a document ID, which is the same in every process."""
+  digest = hashlib.blake2b(id.encode('utf-8'), digest_size=8).digest()
+  return int.from_bytes(digest, 'little') % shards
+
+
+def shard_name(name: str, shard: int) -> str:
+  """The collection name of a shard."""
+  return f'{name}.{shard}'
+
+
+class ShardedCollection:
+  """A collection split into shards, with the interface of a Chroma collection.
+
+  Queries are sent to the shards on an executor. A process pool may be given
+  for shards which are persistent NumPy collections, which each process loads
+  from disk and reloads when they change.
+  """
+
+  def __init__(self, name: str, shards: list, embedding_function,
+      executor: Executor, processes: Executor = None):
+    #: The collection name.
+    self.name = name
+    #: The shard collections, in order.
+    self.shards = shards
+    self.embedding_function = embedding_function
+    self.executor = executor
+    self.processes = None
+    if processes and all(isinstance(s, NumpyCollection) and s.path
+        for s in shards):
+      self.processes = processes
+
+  @property
+  def metadata(self) -> dict[str, any]:
+    return self.shards[0].metadata
+
+  def count(self) -> int:
+    return sum(self._map(lambda s: s.count()))
+
+  def add(self, ids, documents=None, metadatas=None, embeddings=None):
+    self._route('add', ids, documents, metadatas, embeddings)
+
+  def upsert(self, ids, documents=None, metadatas=None, embeddings=None):
+    self._route('upsert', ids, documents, metadatas, embeddings)
+
+  def delete(self, ids=None, where=None, where_document=None):
+    if ids is not None and not where and not where_document:
+      for shard, positions in self._group(ids).items():
+        self.shards[shard].delete(ids=[ids[i] for i in positions])
+      return
+    self._map(lambda s: s.delete(ids=ids, where=where,
+        where_document=where_document))
+
+  def get(self, ids=None, where=None, where_document=None, limit=None,
+      offset=None, include=('documents', 'metadatas')):
+    offset = offset or 0
+    if ids is not None:
+      responses = self._map(lambda group: self.shards[group[0]].get(
+          ids=[ids[i] for i in group[1]], where=where,
+          where_document=where_document, include=include),
+          self._group(ids).items())
+    elif where or where_document:
+      responses = self._map(lambda s: s.get(where=where,
+          where_document=where_document, include=include))
+    else:
+      # Without filters, only the shards covering the page are read.
+      responses = []
+      for shard, count in zip(self.shards, self._map(lambda s: s.count())):
+        if limit is not None and limit <= 0:
+          break
+        if offset >= count:
+          offset -= count
+          continue
+        responses.append(shard.get(limit=limit, offset=offset,
+            include=include))
+        if limit is not None:
+          limit -= len(responses[-1]['ids'])
+        offset = 0
+      return _concat(responses, include)
+    response = _concat(responses, include)
+    end = None if limit is None else offset + limit
+    return {k: v[offset:end] if isinstance(v, (list, np.ndarray)) and
+        k != 'included' else v for k, v in response.items()}
+
+  def peek(self, limit: int = 10):
+    return self.get(limit=limit, include=['documents', 'metadatas',
+        'embeddings'])
+
+  def query(self, query_embeddings=None, query_texts=None, n_results=10,
+      where=None, where_document=None,
+      include=('documents', 'metadatas', 'distances')):
+    if query_embeddings is None:
+      query_embeddings = self.embedding_function(query_texts)
+    args = {
+        'query_embeddings': np.asarray(query_embeddings, dtype=np.float32),
+        'n_results': n_results,
+        'where': where,
+        'where_document': where_document,
+        'include': sorted(set(include) | {'distances'}),
+    }
+    if self.processes:
+      responses = [f.result() for f in [
+          self.processes.submit(_query_shard, _spec(s), args)
+          for s in self.shards]]
+    else:
+      responses = self._map(lambda s: s.query(**args))
+    return _merge(responses, n_results, include)
+
+  def _route(self, method, ids, documents, metadatas, embeddings):
+    for shard, positions in self._group(ids).items():
+      getattr(self.shards[shard], method)(
+          **{k: [column[i] for i in positions] for k, column in (
+              ('ids', ids), ('documents', documents),
+              ('metadatas', metadatas), ('embeddings', embeddings))
+              if column is not None})
+
+  def _group(self, ids) -> dict[int, list[int]]:
+    groups = {}
+    for i, id in enumerate(ids):
+      groups.setdefault(shard_of(id, len(self.shards)), []).append(i)
+    return groups
+
+  def _map(self, function, items=None) -> list:
+    """Call a function on each shard, or each item, in parallel."""
+    return list(self.executor.map(function,
+        self.shards if items is None else items))
+
+
+def _concat(responses, include):
+  """Concatenate get responses."""
+  response = {'ids': [id for r in responses for id in r['ids']]}
+  for k in ('documents', 'metadatas'):
+    response[k] = ([v for r in responses for v in r[k]]
+        if k in include else None)
+  response['embeddings'] = None
+  if 'embeddings' in include:
+    response['embeddings'] = np.concatenate(
+        [np.asarray(r['embeddings'], dtype=np.float32).reshape(
+            len(r['ids']), -1) for r in responses if r['ids']]
+        or [np.zeros((0, 0), np.float32)])
+  response['included'] = list(include)
+  return response
+
+
+def _merge(responses, n_results, include):
+  """Merge the query responses of the shards, nearest first."""
+  merged = {k: [] for k in ('ids', 'documents', 'metadatas', 'embeddings',
+      'distances')}
+  for q in range(len(responses[0]['ids'])):
+    found = [(d, r, i) for r, response in enumerate(responses)
+             for i, d in enumerate(response['distances'][q])]
+    found.sort(key=lambda f: f[0])
+    found = found[:n_results]
+    merged['ids'].append([responses[r]['ids'][q][i] for _, r, i in found])
+    merged['distances'].append([d for d, _, _ in found])
+    for k in ('documents', 'metadatas'):
+      if k in include:
+        merged[k].append([responses[r][k][q][i] for _, r, i in found])
+    if 'embeddings' in include:
+      merged['embeddings'].append(np.array(
+          [responses[r]['embeddings'][q][i] for _, r, i in found]))
+  response = {k: v if k in include or k == 'ids' else None
+      for k, v in merged.items()}
+  response['included'] = list(include)
+  return response
+
+
+def _spec(shard: NumpyCollection) -> tuple:
+  return (shard.name, shard.path, shard.index_threshold, shard.rerank)
+
+
+#: The shards loaded in a query process, with the state of their files.
+_loaded: dict[str, tuple[tuple, NumpyCollection]] = {}
+
+
+def _query_shard(spec, args):
+  """Query a persistent NumPy shard in a query process."""
+  name, path, index_threshold, rerank = spec
+  records = os.path.join(path, 'records.jsonl')
+  stamp = None
+  if os.path.exists(records):
+    stat = os.stat(records)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+  loaded = _loaded.get(path)
+  if loaded is None or loaded[0] != stamp:
+    loaded = (stamp, NumpyCollection(name, path=path,
+        index_threshold=index_threshold, rerank=rerank))
+    _loaded[path] = loaded
+  return loaded[1].query(**args)
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
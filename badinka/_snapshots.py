@@ -0,0 +1,119 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Snapshots of collections in a single file.
+
+A snapshot is a zip file, which `numpy.load` reads like an `.npz` file, holding:
+
+* `records.jsonl`, the ID, content and metadata of each document, in order.
+* `embeddings.npy`, the float32 embedding matrix, with a row for each record.
+* `snapshot.json`, the collection name and metadata, the embedding model, and
+  the number and dimensions of the embeddings.
+
+Snapshots are written and read a batch at a time, so collections larger than
+memory can be snapshotted. While the records are written, the embeddings are
+spooled to a temporary file and then copied behind their `.npy` header.
+"""
+
+import io
+import json
+import shutil
+import zipfile
+import tempfile
+from collections import abc
+
+import numpy as np
+
+
+#: The snapshot format version.
+SNAPSHOT_VERSION = 1
+
+
+def write_snapshot(path: str, records: abc.Iterable[tuple], info: dict) -> int:
+  """Write `(id, content, meta, embedding)` records, returning their number."""
+  count = 0
+  dims = None
+  with (zipfile.ZipFile(path, 'w', allowZip64=True) as z,
+      tempfile.TemporaryFile() as spool):
+    member = zipfile.ZipInfo('records.jsonl')
+    member.compress_type = zipfile.ZIP_DEFLATED
+    with z.open(member, 'w', force_zip64=True) as f:
+      for id, content, meta, embedding in records:
+        vector = np.asarray(embedding, dtype='<f4')
+        if dims is None:
+          dims = len(vector)
+        elif len(vector) != dims:
+          raise ValueError(f'expected embeddings with {dims} dimensions, '
+              f'got {len(vector)} for {id}')
+        f.write(json.dumps({'id': id, 'content': content, 'meta': meta})
+            .encode('utf-8') + b'\n')
+        spool.write(vector.tobytes())
+        count += 1
+    with z.open('embeddings.npy', 'w', force_zip64=True) as f:
+      np.lib.format.write_array_header_1_0(f, {
+          'descr': '<f4',
+          'fortran_order': False,
+          'shape': (count, dims or 0),
+      })
+      spool.seek(0)
+      shutil.copyfileobj(spool, f, 1 << 20)
+    z.writestr('snapshot.json', json.dumps(dict(info,
+        version=SNAPSHOT_VERSION, count=count, dimensions=dims)))
+  return count
+
+
+def read_snapshot(path: str, batch_size: int = 1000
+    ) -> tuple[dict, abc.Iterator[tuple[list, list, list, np.ndarray]]]:
+  """Read the info of a snapshot, and its `(ids, contents, metas, embeddings)`.
+
+  The columns are read in batches, as they are iterated.
+  """
+  z = zipfile.ZipFile(path)
+  info = json.loads(z.read('snapshot.json'))
+  if info['version'] > SNAPSHOT_VERSION:
+    z.close()
+    raise ValueError(f'unsupported snapshot version {info["version"]}')
+
+  def batches():
+    with (z, z.open('records.jsonl') as records,
+        z.open('embeddings.npy') as embeddings):
+      np.lib.format.read_magic(embeddings)
+      shape, _, dtype = np.lib.format.read_array_header_1_0(embeddings)
+      row_bytes = dtype.itemsize * shape[1]
+      batch = []
+      for line in io.TextIOWrapper(records, encoding='utf-8'):
+        batch.append(json.loads(line))
+        if len(batch) == batch_size:
+          yield _columns(batch, embeddings, row_bytes, dtype, shape[1])
+          batch = []
+      if batch:
+        yield _columns(batch, embeddings, row_bytes, dtype, shape[1])
+
+  return info, batches()
+
+
+def _columns(batch, embeddings, row_bytes, dtype, dims):
+  data = embeddings.read(row_bytes * len(batch))
+  if len(data) < row_bytes * len(batch):
+    raise ValueError('snapshot has fewer embeddings than records')
+  return (
+      [r['id'] for r in batch],
+      [r['content'] for r in batch],
+      [r['meta'] for r in batch],
+      np.frombuffer(data, dtype=dtype).reshape(len(batch), dims)
+          .astype(np.float32),
+  )
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
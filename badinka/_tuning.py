@@ -0,0 +1,136 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tuning the HNSW index settings of Chroma collections.
+
+Chroma searches a graph of the vectors, which finds most but not all of the
+nearest neighbours. Each vector is linked to `m` neighbours, the graph is built
+considering `ef_construction` candidates for each vector, and searches consider
+`ef_search` candidates. Larger values find more of the nearest neighbours, at
+the cost of memory, build time and search latency.
+
+`evaluate_index_settings` indexes a sample of vectors with each of a grid of
+settings, and measures the recall and latency of searching them against an
+exact search. `recommend_index_settings` picks the fastest settings reaching a
+target recall.
+"""
+
+import time
+from dataclasses import dataclass, replace
+from uuid import uuid4
+
+import numpy as np
+from chromadb import EphemeralClient
+
+from ._backends import IndexSettings, NumpyCollection
+
+
+@dataclass
+class IndexReport:
+  """The trade-off of searching vectors with index settings."""
+
+  #: The index settings.
+  settings: IndexSettings
+
+  #: The fraction of the exact `k` nearest neighbours found.
+  recall: float
+
+  #: The median search time for a query, in seconds.
+  p50: float
+
+  #: The 99th percentile search time for a query, in seconds.
+  p99: float
+
+  #: The time taken to index the vectors, in seconds.
+  build_time: float
+
+
+def index_settings_grid(space: str = 'l2', m=(8, 16, 32),
+    ef_construction=(100, 200),
+    ef_search=(16, 32, 64, 128, 256)) -> list[IndexSettings]:
+  """Every combination of the given index parameters."""
+  return [IndexSettings(space=space, m=i, ef_construction=j, ef_search=k)
+          for i in m for j in ef_construction for k in ef_search]
+
+
+def evaluate_index_settings(vectors: np.ndarray, queries: np.ndarray,
+    settings: list[IndexSettings] = None, k: int = 10,
+    space: str = 'l2') -> list[IndexReport]:
+  """Measure the recall@k and latency of searching vectors with each setting.
+
+  The vectors are indexed in a new in-memory collection for each setting, since
+  Chroma only applies a changed `ef_search` to an index when it is loaded. By
+  default the settings are `index_settings_grid` in the given space.
+  """
+  vectors = np.asarray(vectors, dtype=np.float32)
+  queries = np.asarray(queries, dtype=np.float32)
+  settings = settings or index_settings_grid(space)
+  ids = [str(i) for i in range(len(vectors))]
+  k = min(k, len(vectors))
+  client = EphemeralClient()
+  batch = client.get_max_batch_size()
+  expected = {}
+  reports = []
+  for s in settings:
+    if s.space not in expected:
+      exact = NumpyCollection('evaluate', metadata={'hnsw:space': s.space},
+          index_threshold=len(vectors) + 1)
+      exact.add(ids=ids, embeddings=vectors)
+      expected[s.space] = exact.query(query_embeddings=queries, n_results=k,
+          include=[])['ids']
+    name = f'evaluate-{uuid4().hex}'
+    start = time.perf_counter()
+    c = client.create_collection(name, metadata=s.metadata())
+    try:
+      for i in range(0, len(ids), batch):
+        c.add(ids=ids[i:i + batch], embeddings=vectors[i:i + batch])
+      build_time = time.perf_counter() - start
+      found, latencies = _search(c, queries, k)
+    finally:
+      client.delete_collection(name)
+    recall = np.mean([len(set(e) & set(f)) / max(len(e), 1)
+        for e, f in zip(expected[s.space], found)])
+    reports.append(IndexReport(settings=replace(s), recall=float(recall),
+        p50=float(np.percentile(latencies, 50)),
+        p99=float(np.percentile(latencies, 99)), build_time=build_time))
+  return reports
+
+
+def recommend_index_settings(reports: list[IndexReport],
+    target_recall: float = 0.95) -> IndexReport:
+  """The report of the settings with the lowest p99 latency at a recall.
+
+  When no settings reach the target recall, those with the best recall are
+  recommended.
+  """
+  good = [r for r in reports if r.recall >= target_recall]
+  if not good:
+    return max(reports, key=lambda r: (r.recall, -r.p99))
+  return min(good, key=lambda r: (r.p99, r.p50, r.settings.m))
+
+
+def _search(c, queries, k):
+  """Search for each query on its own, returning the IDs and latencies."""
+  c.query(query_embeddings=queries[:1], n_results=k, include=[])
+  found = []
+  latencies = []
+  for q in queries:
+    start = time.perf_counter()
+    ids = c.query(query_embeddings=q[None], n_results=k, include=[])['ids'][0]
+    latencies.append(time.perf_counter() - start)
+    found.append(ids)
+  return found, latencies
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
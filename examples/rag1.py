@@ -113,19 +113,16 @@ def extract():
 
 def embed():
   conductor = bd.Conductor(config)
-  f = open('examples/data/geography.txt')
-  raw = f.read()
-  sentences = raw.split('. ')
-  for i, s in enumerate(sentences):
-    chunk = [s]
-    for j in range(3):
-      try:
-        chunk.append(sentences[i+j])
-      except IndexError:
-        pass
-    print(f'{i+1} of {len(sentences)}')
-    if t := ''.join(chunk).strip():
-      conductor.docs.append(bd.Document(content=t))
+  pipeline = bd.Pipeline(
+      conductor.docs,
+      # Single sentences are embedded, and point to windows of 4 sentences
+      # which are stored once for their context.
+      chunker = bd.ParentChunker(
+          parent = bd.SentenceChunker(size=4, overlap=0),
+      ),
+  )
+  report = pipeline.run(['examples/data/geography.txt'])
+  print(f'{report.documents} documents from {report.files} files')
 
 
 def query(q):
@@ -135,7 +132,9 @@ def query(q):
         role = 'a teacher',
         detail = 'in as much detail as you can',
         prompt = bd.Prompt(q),
-        inject = bd.Injection(),
+        # Matched sentences are expanded into their windows, neighbouring
+        # windows are merged, and near-duplicates are skipped.
+        inject = bd.Injection(expand=True, collapse=True, diversity=0.3),
     ),
     options = bd.Options(
         tokens = 1024,
@@ -13,9 +13,51 @@
 # limitations under the License.
 
 
+import re
+import zlib
+
+import pytest
+import badinka
+
 
 def pytest_addoption(parser):
   parser.addoption('--integration', action='store_true', dest="integration",
                    default=False, help="enable longrundecorated tests")
 
+
+class WordEmbeddings:
+  """Bag of words embeddings, so that tests don't need an embedding model."""
+
+  def __init__(self, dims=64):
+    self.dims = dims
+    self.calls = 0
+
+  def __call__(self, texts):
+    self.calls += 1
+    vectors = []
+    for t in texts:
+      v = [0.0] * self.dims
+      for w in re.findall(r'\w+', t.lower()):
+        v[zlib.crc32(w.encode()) % self.dims] += 1.0
+      vectors.append(v)
+    return vectors
+
+  def name(self):
+    return 'words'
+
+  def get_config(self):
+    return {'dims': self.dims}
+
+
+@pytest.fixture(params=['chroma', 'numpy', 'numpy-sharded'])
+def store(request, tmp_path):
+  """A document store with its own persistent path and word embeddings, for each backend."""
+  backend, _, sharded = request.param.partition('-')
+  ds = badinka.DocumentStore(badinka.Config(
+      vector_store_path=f'{backend}://{tmp_path / "store"}',
+      vector_store_shards=3 if sharded else 1,
+  ))
+  ds.embedding_function.function = WordEmbeddings()
+  return ds
+
 # vim: ft=python sw=2 ts=2 sts=2 tw=120
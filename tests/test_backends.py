@@ -0,0 +1,99 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+import pytest
+import badinka as bd
+from badinka._backends import Backend, NumpyCollection, ChromaBackend, NumpyBackend, open_backend
+
+
+def _collection(path=None, **kw):
+  c = NumpyCollection('test', path=path, **kw)
+  c.embedding_function = lambda texts: [[float(len(t)), 1.0] for t in texts]
+  return c
+
+
+def test_open_backend():
+  assert isinstance(open_backend(bd.Config()), ChromaBackend)
+  assert isinstance(open_backend(bd.Config(vector_store_path='numpy://:memory:')), NumpyBackend)
+  with pytest.raises(ValueError):
+    open_backend(bd.Config(vector_store_path='nope://x'))
+
+
+def test_backend_abstract():
+  class Incomplete(Backend):
+    def names(self):
+      return []
+
+  with pytest.raises(TypeError):
+    Incomplete()
+
+
+def test_client():
+  assert bd.DocumentStore().client() is not None
+  with pytest.raises(ValueError):
+    bd.DocumentStore(bd.Config(vector_store_path='numpy://:memory:')).client()
+
+
+def test_numpy_distances():
+  c = _collection()
+  c.add(ids=['a', 'b', 'c'], embeddings=[[0.0, 0.0], [1.0, 0.0], [3.0, 4.0]], documents=['a', 'b', 'c'])
+  r = c.query(query_embeddings=[[0.0, 0.0], [3.0, 3.0]], n_results=2)
+  assert [['a', 'b'], ['c', 'b']] == r['ids']
+  assert [[0.0, 1.0], [1.0, 13.0]] == r['distances']
+  assert [None, None] == c.get(ids=['b', 'a'])['metadatas']
+
+
+def test_numpy_persistence(tmp_path):
+  c = _collection(str(tmp_path / 'c'))
+  c.add(ids=['a', 'b', 'c'], documents=['x', 'yy', 'zzz'], metadatas=[{'n': 1}, None, {'n': 3}])
+  c.upsert(ids=['a'], documents=['xxxx'], metadatas=[{'n': 4}])
+  c.delete(ids=['b'])
+  reopened = _collection(str(tmp_path / 'c'))
+  assert 2 == reopened.count()
+  r = reopened.get(include=['documents', 'metadatas', 'embeddings'])
+  assert ['c', 'a'] == r['ids']
+  assert [{'n': 3}, {'n': 4}] == r['metadatas']
+  assert [[3.0, 1.0], [4.0, 1.0]] == r['embeddings'].tolist()
+  reopened.add(ids=['d'], documents=['y'])
+  assert ['a'] == reopened.query(query_embeddings=[[4.0, 1.0]], n_results=1)['ids'][0]
+
+
+def test_numpy_compaction():
+  c = _collection()
+  for i in range(3):
+    c.upsert(ids=[str(j) for j in range(1000)], documents=['x'] * 1000)
+  assert 1000 == c.count()
+  assert len(c.ids) < 3000
+  assert ['5'] == c.get(ids=['5'])['ids']
+
+
+def test_numpy_index_recall():
+  rng = np.random.default_rng(1)
+  centers = rng.normal(size=(20, 16))
+  vectors = (centers[rng.integers(20, size=2000)] + 0.1 * rng.normal(size=(2000, 16))).astype(np.float32)
+  queries = vectors[:50] + 0.05
+  exact = _collection(index_threshold=10_000)
+  approximate = _collection(index_threshold=1000)
+  for c in exact, approximate:
+    c.add(ids=[str(i) for i in range(len(vectors))], embeddings=vectors)
+  expected = exact.query(query_embeddings=queries, n_results=10)['ids']
+  found = approximate.query(query_embeddings=queries, n_results=10)['ids']
+  assert approximate.index is not None
+  recall = np.mean([len(set(e) & set(f)) / 10 for e, f in zip(expected, found)])
+  assert recall > 0.9
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=120
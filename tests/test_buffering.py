@@ -0,0 +1,143 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import threading
+
+import pytest
+import badinka as bd
+
+from conftest import WordEmbeddings
+
+
+def test_write_behind_batches():
+  written = []
+  b = bd.WriteBehindBuffer(lambda docs, name: written.append((name, list(docs))), batch_size=3, interval=60)
+  b.put(range(7), 'a')
+  b.flush()
+  assert [('a', [0, 1, 2]), ('a', [3, 4, 5]), ('a', [6])] == written
+  b.put([7], 'a')
+  b.put([8], 'b')
+  b.close()
+  assert [('a', [7]), ('b', [8])] == written[3:]
+  with pytest.raises(ValueError):
+    b.put([9])
+
+
+def test_write_behind_interval():
+  written = threading.Event()
+  b = bd.WriteBehindBuffer(lambda docs, name: written.set(), batch_size=100, interval=0.05)
+  b.put([1])
+  assert written.wait(5)
+  b.close()
+
+
+def test_write_behind_backpressure():
+  release = threading.Event()
+  b = bd.WriteBehindBuffer(lambda docs, name: release.wait(), batch_size=1, interval=0, max_pending=2)
+  b.put([1])
+  blocked = threading.Thread(target=b.put, args=(range(2, 6),))
+  blocked.start()
+  time.sleep(0.1)
+  assert blocked.is_alive()
+  release.set()
+  blocked.join(5)
+  assert not blocked.is_alive()
+  b.close()
+
+
+def test_write_behind_errors():
+  failures = []
+
+  def write(docs, name):
+    if 'bad' in docs:
+      raise ValueError('bad document')
+
+  b = bd.WriteBehindBuffer(write, batch_size=1, on_error=failures.append)
+  b.put(['good', 'bad', 'good'])
+  with pytest.raises(ValueError, match='bad document'):
+    b.flush()
+  assert [['bad']] == [f.docs for f in failures]
+  b.flush()
+  b.close()
+
+
+def test_write_behind_worker_stopped(monkeypatch):
+  from badinka import _buffering
+  monkeypatch.setattr(_buffering, '_poll', 0.01)
+
+  def write(docs, name):
+    raise SystemExit()
+
+  b = bd.WriteBehindBuffer(write, batch_size=1)
+  b.put([1])
+  with pytest.raises(RuntimeError):
+    b.flush()
+  with pytest.raises(RuntimeError):
+    b.close()
+  assert b.closed
+
+
+def test_indexes_concurrent_updates():
+  lexical = bd.LexicalIndex()
+  dedup = bd.MinHashIndex()
+  stop = threading.Event()
+
+  def update():
+    i = 0
+    while not stop.is_set():
+      lexical.add([str(i)], [f'word{i} common'])
+      dedup.add(str(i), dedup.signature(f'word{i} common text here now'))
+      lexical.remove([str(i - 50)])
+      dedup.remove([str(i - 50)])
+      i += 1
+
+  writer = threading.Thread(target=update)
+  writer.start()
+  try:
+    for _ in range(2000):
+      lexical.search('common word1')
+      dedup.match(dedup.signature('word1 common text here now'))
+  finally:
+    stop.set()
+    writer.join()
+
+
+def test_store_write_behind():
+  ds = bd.DocumentStore(bd.Config(vector_store_path='numpy://:memory:', write_behind=True, write_behind_interval=60))
+  ds.embedding_function.function = WordEmbeddings()
+  ds.extend([bd.Document(content=f'doc {i}') for i in range(5)])
+  ds.append(bd.Document(content='last'))
+  ds.flush()
+  assert 6 == len(ds)
+  ds.append(bd.Document(content='closing'))
+  ds.close()
+  assert 7 == len(ds)
+
+
+def test_store_write_behind_order():
+  ds = bd.DocumentStore(bd.Config(vector_store_path='numpy://:memory:', write_behind=True, write_behind_interval=60))
+  ds.embedding_function.function = WordEmbeddings()
+  ds.append(bd.Document(content='one', id='a'))
+  assert 1 == ds.update([bd.Document(content='one', id='a', meta={'n': 1})])
+  assert {'n': 1} == ds.get(['a'])[0].meta
+  ds.append(bd.Document(content='two', id='b'))
+  assert 1 == ds.delete(ids=['b'])
+  ds.flush()
+  assert 1 == len(ds)
+  ds.close()
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=120
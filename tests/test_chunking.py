@@ -0,0 +1,89 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pytest
+import badinka as bd
+
+
+text = 'One. Two! Three? Four. Five.'
+
+
+def test_sentence_windows():
+  docs = bd.SentenceChunker(size=2, overlap=1).chunk(text)
+  assert ['One. Two!', 'Two! Three?', 'Three? Four.', 'Four. Five.'] == \
+      [d.content for d in docs]
+
+
+def test_sentence_windows_no_overlap():
+  docs = bd.SentenceChunker(size=2, overlap=0).chunk(text)
+  assert ['One. Two!', 'Three? Four.', 'Five.'] == [d.content for d in docs]
+
+
+def test_offsets_and_source():
+  docs = bd.SentenceChunker(size=2, overlap=1).chunk(text, source='a.txt', offset=100)
+  for d in docs:
+    assert d.content == text[d.meta['start'] - 100:d.meta['end'] - 100]
+    assert 'a.txt' == d.meta['source']
+  again = bd.SentenceChunker(size=2, overlap=1).chunk(text, source='a.txt', offset=100)
+  assert [d.id for d in docs] == [d.id for d in again]
+
+
+def test_byte_offsets():
+  text = 'Él dijo. ¿Qué? Sí — 🙂 vale.'
+  docs = bd.SentenceChunker(size=1, overlap=0).chunk(text, byte_offset=10)
+  data = text.encode('utf-8')
+  assert [d.content for d in docs] == [data[d.meta['byte_start'] - 10:d.meta['byte_end'] - 10].decode() for d in docs]
+
+
+def test_repeated_text_ids(store):
+  docs = bd.SentenceChunker(size=1, overlap=0).chunk('Yes. No. Yes.', source='a.txt')
+  assert 3 == len({d.id for d in docs})
+  store.extend(docs)
+  assert 3 == len(store)
+  docs = bd.ParentChunker().chunk('Yes. No.\n\nYes. Maybe.', source='b.txt')
+  children = [d for d in docs if d.content == 'Yes.']
+  assert 2 == len({d.id for d in children})
+  assert 2 == len({d.meta['parent_id'] for d in children})
+
+
+def test_paragraphs():
+  docs = bd.ParagraphChunker().chunk('First para.\nStill first.\n\n\nSecond para.\n')
+  assert ['First para.\nStill first.', 'Second para.'] == [d.content for d in docs]
+
+
+def test_tokens():
+  docs = bd.TokenChunker(size=3, overlap=1).chunk('a b, c d e')
+  assert ['a b,', ', c d', 'd e'] == [d.content for d in docs]
+
+
+def test_empty():
+  assert [] == bd.SentenceChunker().chunk('')
+  assert [] == bd.TokenChunker().chunk('  ')
+
+
+def test_bad_overlap():
+  with pytest.raises(ValueError):
+    bd.SentenceChunker(size=2, overlap=2)
+
+
+def test_parents():
+  docs = bd.ParentChunker().chunk('One. Two.\n\nThree.', source='a.txt')
+  assert [bd.ParentDocument, bd.Document, bd.Document, bd.ParentDocument, bd.Document] == [type(d) for d in docs]
+  assert ['One. Two.', 'One.', 'Two.', 'Three.', 'Three.'] == [d.content for d in docs]
+  assert [docs[0].id, docs[0].id, docs[3].id] == [docs[i].meta['parent_id'] for i in (1, 2, 4)]
+  assert (5, 9) == (docs[2].meta['start'], docs[2].meta['end'])
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=120
@@ -13,6 +13,8 @@
 # limitations under the License.
 
 
+import threading
+
 import pytest
 import badinka
 
@@ -28,4 +30,59 @@ def test_generate_from_prompt():
   p = badinka.Prompt(template='why is the sky {{q}}?')
   badinka.Conductor().generate(p, options=_options, q='blue')
 
+def test_inject_pipelined(store):
+  p = badinka.Conductor(badinka.Config(generation_pipelined=True))
+  p.docs = store
+  store.extend([badinka.Document(content=c) for c in ['the sky is blue', 'grass is green']])
+  # Retrieval and loading each wait for the other, so they must overlap, and retrieval waits for the instruction to be
+  # rendered, so that must happen while it is in flight.
+  overlap = threading.Barrier(2, timeout=5)
+  rendered = threading.Event()
+  query = store.query
+
+  def waiting_query(q):
+    overlap.wait()
+    assert rendered.wait(5)
+    return query(q)
+
+  store.query = waiting_query
+  p.generator.load = lambda options: overlap.wait()
+  i = badinka.Instruction(prompt='why is the sky {{q}}?', role='a teacher', inject=badinka.Injection(n_results=1))
+  prepare = i.prepare
+
+  def signalling_prepare(**kw):
+    prepare(**kw)
+    rendered.set()
+
+  i.prepare = signalling_prepare
+  with p:
+    p.inject(i, q='blue')
+  assert 'the sky is blue' == i.context
+  assert 'why is the sky blue?' in i._prepared[1]
+  assert 'the sky is blue' not in i._prepared[1]
+  plain = badinka.Instruction(prompt='why is the sky {{q}}?', role='a teacher', context='the sky is blue')
+  assert plain.render(q='blue') == i.render(q='blue')
+  i.role = 'a poet'
+  assert 'a poet' in i.render(q='blue')
+  assert p.executor is None
+
+
+def test_inject_expand(store):
+  p = badinka.Conductor()
+  p.docs = store
+  store.extend(badinka.ParentChunker().chunk('The sky is blue. It is clear.\n\nGrass is green.'))
+  i = badinka.Instruction(prompt='why is the sky {{q}}?', inject=badinka.Injection(n_results=2, expand=True))
+  p.inject(i, q='blue')
+  assert 'The sky is blue. It is clear.\nGrass is green.' == i.context
+
+
+def test_inject_nothing_relevant(store):
+  p = badinka.Conductor()
+  p.docs = store
+  store.extend([badinka.Document(content='grass is green')])
+  i = badinka.Instruction(prompt='why is the sky {{q}}?', inject=badinka.Injection(max_distance=0.01))
+  p.inject(i, q='blue')
+  assert i.context is None
+  assert 'context' not in i.render(q='blue').lower()
+
 # vim: ft=python sw=2 ts=2 sts=2 tw=120
@@ -0,0 +1,75 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import badinka as bd
+
+
+page = ' '.join(f'word{i}' for i in range(200))
+near = page.replace('word100', 'changed')
+other = ' '.join(f'other{i}' for i in range(200))
+
+
+def test_minhash_index():
+  index = bd.MinHashIndex(threshold=0.8)
+  index.add('page', index.signature(page))
+  index.add('other', index.signature(other))
+  id, similarity = index.match(index.signature(near))
+  assert 'page' == id
+  assert 0.8 <= similarity < 1
+  assert index.match(index.signature('something else entirely')) is None
+  index.remove(['page'])
+  assert index.match(index.signature(near)) is None
+  assert 1 == len(index)
+
+
+def test_extend_skip(store):
+  store.config.dedup = 'skip'
+  store.extend([bd.Document(content=page, id='page'), bd.Document(content=other, id='other')])
+  calls = store.embedding_function.function.calls
+  store.extend([bd.Document(content=near, id='near')])
+  assert calls == store.embedding_function.function.calls
+  assert 2 == len(store)
+  assert 1 == store.dedup_stats.skipped
+  assert 1 == store.dedup_stats.embeddings_avoided
+  assert len(near) + 4 * 64 == store.dedup_stats.bytes_avoided
+
+
+def test_bytes_avoided_first_batch(store):
+  store.config.dedup = 'skip'
+  store.extend([bd.Document(content=page, id='page'), bd.Document(content=near, id='near')])
+  assert 1 == len(store)
+  assert len(near) + 4 * 64 == store.dedup_stats.bytes_avoided
+
+
+def test_extend_merge(store):
+  store.config.dedup = 'merge'
+  store.extend([bd.Document(content=page, id='page', meta={'source': 'a'})])
+  store.extend([bd.Document(content=near, id='near', meta={'source': 'b', 'year': 2024}),
+                bd.Document(content=other, id='other'),
+                bd.Document(content=other + ' again', id='again')])
+  docs = {d.id: d for d in store.all()}
+  assert {'page', 'other'} == set(docs)
+  assert {'source': 'a', 'year': 2024, 'duplicates': 1} == docs['page'].meta
+  assert {'duplicates': 1} == docs['other'].meta
+  assert 2 == store.dedup_stats.merged
+
+
+def test_dedup_index_built_from_store(store):
+  store.extend([bd.Document(content=page, id='page')])
+  store.config.dedup = 'skip'
+  assert [] == store.deduplicate([bd.Document(content=near)])
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=120
@@ -13,6 +13,8 @@
 # limitations under the License.
 
 
+import numpy as np
+import pytest
 import badinka as bd
 
 
@@ -48,10 +50,176 @@ def test_collections():
 def test_documentlist():
   ds = bd.DocumentList()
   doc = bd.Document(content='hello')
-  ds.documents.append(doc)
+  ds.append(doc)
   assert len(ds) == 1
   assert list(ds) == [doc]
   assert doc in ds
 
 
+def test_documentlist_columns():
+  ds = bd.DocumentList(ids=['a', 'b', 'c'], contents=['x', 'y', 'z'],
+                       metas=[{'n': 1}, None, {'n': 3}],
+                       embeddings=[[1.0, 0.0], [0.0, 1.0], [1.0, 1.0]])
+  assert not hasattr(ds, '__dict__')
+  assert bd.Document(content='z', id='c', meta={'n': 3}) == ds[2]
+  assert [0.0, 1.0] == list(ds[1].embeddings)
+  assert [None] * 3 == ds.distances
+  tail = ds[1:]
+  assert ['b', 'c'] == tail.ids
+  assert (2, 2) == tail.embeddings.shape
+  ds.append(bd.Document(content='w', id='d', embeddings=[2.0, 2.0]))
+  ds.append(bd.Document(content='v', id='e', embeddings=[3.0, 3.0]))
+  assert (5, 2) == ds.embeddings.shape
+  assert [3.0, 3.0] == list(ds[4].embeddings)
+  ds.append(bd.Document(content='u', id='f'))
+  assert ds.embeddings is None
+  r = bd.DocumentList.from_response({'ids': [['a']], 'documents': [['x']]})
+  assert ['x'] == r.contents
+
+
+def _doc(content, x=1.0, **meta):
+  return bd.Document(content=content, meta=meta or None, embeddings=[x, 1.0])
+
+
+def test_sync():
+  ds = bd.DocumentStore(bd.Config())
+  docs = [_doc('one'), _doc('two', 2.0), _doc('three', 3.0)]
+  r = ds.sync(docs, source='sync.txt', collection_name='sync0')
+  assert (3, 0, 0, 0) == (r.added, r.updated, r.deleted, r.unchanged)
+  r = ds.sync(docs, source='sync.txt', collection_name='sync0')
+  assert (0, 0, 0, 3) == (r.added, r.updated, r.deleted, r.unchanged)
+  docs = [_doc('one', page=2), _doc('two', 2.0), _doc('four', 4.0)]
+  r = ds.sync(docs, source='sync.txt', collection_name='sync0')
+  assert (1, 1, 1, 1) == (r.added, r.updated, r.deleted, r.unchanged)
+  assert 3 == ds.collection('sync0').count()
+
+
+def test_query_include(store):
+  store.extend([bd.Document(content=c) for c in ['red apples', 'green pears', 'red cars']])
+  r = store.query(bd.Query(text='red', n_results=2))
+  assert r.embeddings is None
+  assert r[0].embeddings is None
+  assert {'red apples', 'red cars'} == {d.content for d in r}
+  r = store.query(bd.Query(text='red', n_results=2, include=['embeddings']))
+  assert (2, 64) == r.embeddings.shape
+  assert r[1].embeddings.base is r.embeddings
+  assert r[0].content is None
+
+
+def test_query_many(store):
+  store.extend([bd.Document(content=c) for c in ['red apples', 'green pears', 'blue sky']])
+  calls = store.embedding_function.function.calls
+  r = store.query_many(['red', 'green', 'blue'], n_results=1)
+  assert ['red apples', 'green pears', 'blue sky'] == [l[0].content for l in r]
+  assert calls + 1 == store.embedding_function.function.calls
+  r = store.query_many(['blue'], n_results=1, hybrid=True)
+  assert ['blue sky'] == [l[0].content for l in r]
+  with pytest.raises(ValueError):
+    store.query(bd.Query(texts=['blue', 'green'], n_results=1))
+
+
+def test_iter_documents(store):
+  store.extend([_doc(f'doc {i}', float(i)) for i in range(25)])
+  docs = list(store.iter_documents(batch_size=10))
+  assert 25 == len(docs)
+  assert 25 == len({d.id for d in docs})
+  assert docs[0].embeddings is None
+  docs = list(store.iter_documents(batch_size=5, include=['embeddings']))
+  assert {float(i) for i in range(25)} == {d.embeddings[0] for d in docs}
+
+
+def test_all_without_embeddings(store):
+  store.extend([_doc(f'doc {i}', float(i)) for i in range(3)])
+  docs = store.all()
+  assert docs.embeddings is None
+  assert {'doc 0', 'doc 1', 'doc 2'} == set(docs.contents)
+
+
+def test_query_embedding_cache(store):
+  store.extend([bd.Document(content=c) for c in ['red apples', 'green pears']])
+  store.query_text('red')
+  calls = store.embedding_function.function.calls
+  hits = store.embedding_cache.hits
+  assert 'red apples' == store.query_text('red')[0].content
+  assert calls == store.embedding_function.function.calls
+  assert hits == store.embedding_cache.hits
+  assert 1 == store.query_cache.hits
+
+
+def test_query_embedding_cache_separate(store):
+  store.extend([bd.Document(content=c) for c in ['the sky is blue', 'the sea is green']])
+  cached = len(store.embedding_cache)
+  store.query_many(['sky', 'sea'])
+  assert cached == len(store.embedding_cache)
+  assert 2 == len(store.query_cache)
+
+
+def test_query_by_embeddings(store):
+  store.extend([_doc('left', 1.0), _doc('right', -1.0)])
+  assert 'right' == store.query(bd.Query(embeddings=[-1.0, 1.0], n_results=1))[0].content
+
+
+def test_snapshot(store, tmp_path):
+  store.extend([bd.Document(content=f'doc {i}', id=str(i), meta={'n': i} if i % 2 else None) for i in range(25)])
+  path = str(tmp_path / 'snapshot.npz')
+  assert 25 == store.export_snapshot(path, batch_size=10)
+  assert (25, 64) == np.load(path)['embeddings'].shape
+  seeded = bd.DocumentStore(bd.Config(vector_store_path='numpy://:memory:'))
+  seeded.embedding_function.function = store.embedding_function.function
+  calls = seeded.embedding_function.function.calls
+  assert 25 == seeded.import_snapshot(path, collection_name='seeded', batch_size=10)
+  assert calls == seeded.embedding_function.function.calls
+  docs = {d.id: d for d in seeded.all(collection_name='seeded')}
+  assert 'doc 7' == docs['7'].content
+  assert {'n': 7} == docs['7'].meta
+  assert docs['8'].meta is None
+  assert 25 == len(seeded.embedding_cache)
+  assert '3' == seeded.query(bd.Query(text='doc 3', n_results=1), collection_name='seeded')[0].id
+
+
+def test_snapshot_roundtrip(store, tmp_path):
+  from badinka._sharding import shard_name
+  store.extend([bd.Document(content=f'doc {i}', id=str(i)) for i in range(10)])
+  path = str(tmp_path / 'snapshot.npz')
+  store.export_snapshot(path)
+  assert 10 == store.import_snapshot(path, collection_name='copy')
+  shards = store.config.vector_store_shards
+  names = {shard_name('copy', i) for i in range(shards)} if shards > 1 else {'copy'}
+  assert names == {n for n in store.backend.names() if n.startswith('copy')}
+  assert sorted(store.all().ids) == sorted(store.all(collection_name='copy').ids)
+
+
+def test_get_delete_update(store):
+  store.extend([bd.Document(content=f'doc {i}', id=str(i), meta={'n': i, 'odd': i % 2}) for i in range(10)])
+  calls = store.embedding_function.function.calls
+  assert ['7', '2'] == store.get(['7', 'missing', '2', '7']).ids
+  assert (0, 0, 0) == (len(store.get([])), store.delete([]), store.update([]))
+  assert 0 == store.delete([], where={'odd': 1})
+  assert {'1', '3', '5', '7', '9'} == set(store.get_where({'odd': 1}).ids)
+  assert 2 == store.delete(where={'odd': 1}, ids=['1', '2', '3'])
+  assert 1 == store.delete(where_document={'$contains': 'doc 5'})
+  assert 7 == len(store)
+  assert 1 == store.update([bd.Document(content='doc 4', id='4', meta={'n': 40}), bd.Document(content='x', id='missing')])
+  assert {'n': 40, 'odd': 0} == store.get(['4'])[0].meta
+  with pytest.raises(ValueError):
+    store.update([bd.Document(content='new', id='4')])
+  store.update([bd.Document(content='new', id='4', embeddings=[1.0] * 64)])
+  d = store.get(['4'], include=['documents', 'metadatas', 'embeddings'])[0]
+  assert ('new', {'n': 40, 'odd': 0}, 1.0) == (d.content, d.meta, d.embeddings[0])
+  assert calls == store.embedding_function.function.calls
+  with pytest.raises(ValueError):
+    store.delete()
+
+
+def test_delete_prunes_parents(store):
+  store.extend(bd.ParentChunker().chunk('One. Two.\n\nThree.', source='s'))
+  assert 2 == store.parent_collection().count()
+  store.delete(where_document={'$contains': 'One.'})
+  assert 2 == store.parent_collection().count()
+  store.delete(where_document={'$contains': 'Two.'})
+  assert 1 == store.parent_collection().count()
+  store.delete(where={'source': 's'})
+  assert 0 == store.parent_collection().count()
+
+
 # vim: ft=python sw=2 ts=2 sts=2 tw=120
@@ -0,0 +1,151 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import badinka as bd
+from badinka._embeddings import CachedEmbeddingFunction, BatchingEmbeddingFunction
+
+
+class Counting:
+
+  def __init__(self):
+    self.texts = []
+
+  def __call__(self, texts):
+    self.texts.extend(texts)
+    return [[float(len(t)), 1.0] for t in texts]
+
+
+def test_cache_skips_embedded_texts():
+  f = Counting()
+  ef = CachedEmbeddingFunction(f, model='m', cache=bd.EmbeddingCache())
+  ef(['a', 'bb', 'a'])
+  ef(['bb', 'ccc'])
+  assert ['a', 'bb', 'ccc'] == f.texts
+  assert [3.0, 1.0] == list(ef(['ccc'])[0])
+
+
+def test_cache_keyed_by_model():
+  k = bd.EmbeddingCache.key
+  assert k('m1', 'hello') != k('m2', 'hello')
+  assert k('m1', 'hello') == k('m1', 'hello')
+
+
+def test_cache_eviction():
+  c = bd.EmbeddingCache(max_entries=2)
+  c.update([(b'a' * 16, [1.0]), (b'b' * 16, [2.0])])
+  c.get(b'a' * 16)
+  c.update([(b'c' * 16, [3.0])])
+  assert b'a' * 16 in c
+  assert b'b' * 16 not in c
+  assert 2 == len(c)
+
+
+def test_cache_persistence(tmp_path):
+  path = str(tmp_path / 'embeddings.cache')
+  c = bd.EmbeddingCache(path)
+  c.update([(b'a' * 16, [1.0, 2.0]), (b'b' * 16, [3.0, 4.0])])
+  c2 = bd.EmbeddingCache(path)
+  assert 2 == len(c2)
+  assert [3.0, 4.0] == list(c2.get(b'b' * 16))
+
+
+def test_cache_truncated(tmp_path):
+  path = str(tmp_path / 'cache.bin')
+  c = bd.EmbeddingCache(path)
+  c.update([(b'a' * 16, [1.0, 2.0]), (b'b' * 16, [3.0, 4.0])])
+  with open(path, 'r+b') as f:
+    f.truncate(f.seek(0, 2) - 3)
+  c = bd.EmbeddingCache(path)
+  assert 1 == len(c)
+  c.update([(b'c' * 16, [5.0, 6.0])])
+  c = bd.EmbeddingCache(path)
+  assert 2 == len(c)
+  assert [5.0, 6.0] == list(c.get(b'c' * 16))
+
+
+def test_cache_compaction(tmp_path):
+  path = str(tmp_path / 'embeddings.cache')
+  c = bd.EmbeddingCache(path, max_entries=2)
+  for i in range(10):
+    c.update([(bytes([i]) * 16, [float(i)])])
+  c2 = bd.EmbeddingCache(path, max_entries=2)
+  assert [9.0] == list(c2.get(bytes([9]) * 16))
+  assert 2 == len(c2)
+
+
+class Slow(Counting):
+
+  def __init__(self):
+    super().__init__()
+    self.batches = []
+
+  def __call__(self, texts):
+    self.batches.append(len(texts))
+    time.sleep(0.02)
+    return super().__call__(texts)
+
+
+def test_batching_gathers_concurrent_callers():
+  f = Slow()
+  ef = BatchingEmbeddingFunction(f, max_batch_size=8)
+  texts = ['x' * i for i in range(1, 33)]
+  with ThreadPoolExecutor(16) as pool:
+    vectors = list(pool.map(lambda t: ef([t]), texts))
+  assert [[[float(len(t)), 1.0]] for t in texts] == [[list(v) for v in vs] for vs in vectors]
+  assert sorted(texts) == sorted(f.texts)
+  assert len(f.batches) < len(texts)
+  assert max(f.batches) <= 8
+
+
+def test_batching_splits_large_requests():
+  f = Slow()
+  ef = BatchingEmbeddingFunction(f, max_batch_size=8)
+  texts = ['x' * i for i in range(1, 21)]
+  assert [[float(len(t)), 1.0] for t in texts] == [list(v) for v in ef(texts)]
+  assert [8, 8, 4] == f.batches
+
+
+def test_batching_window():
+  f = Slow()
+  ef = BatchingEmbeddingFunction(f, window=0.2)
+  threads = [threading.Thread(target=ef, args=([t],)) for t in 'abc']
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  assert [3] == f.batches
+
+
+def test_batching_errors():
+  f = Counting()
+  failures = [ConnectionError('down')]
+
+  def flaky(texts):
+    if failures:
+      raise failures.pop()
+    return f(texts)
+
+  ef = BatchingEmbeddingFunction(flaky)
+  with pytest.raises(ConnectionError):
+    ef(['a'])
+  assert [1.0, 1.0] == list(ef(['a'])[0])
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=120
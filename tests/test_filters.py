@@ -0,0 +1,91 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pytest
+import badinka as bd
+
+
+def test_compile_comparisons():
+  assert {'year': {'$gte': 2000}} == bd.Gte('year', 2000).compile()
+  assert {'tag': {'$in': ['a', 'b']}} == bd.In('tag', ('a', 'b')).compile()
+  assert {'$contains': 'sky'} == bd.Contains('sky').compile()
+
+
+def test_compile_combined():
+  f = bd.Eq('source', 'a.txt') & bd.Range('year', 2000, 2010)
+  assert {'$and': [
+      {'source': {'$eq': 'a.txt'}},
+      {'$and': [{'year': {'$gte': 2000}}, {'year': {'$lte': 2010}}]},
+  ]} == f.compile()
+  f = bd.Eq('a', 1) | bd.Eq('b', 2) | bd.Eq('c', 3)
+  assert 3 == len(f.compile()['$or'])
+  assert {'year': {'$lte': 2010}} == bd.Range('year', high=2010).compile()
+
+
+def test_filter_abstract():
+  class Incomplete(bd.Filter):
+    pass
+
+  with pytest.raises(TypeError):
+    Incomplete()
+
+
+def test_compile_empty():
+  with pytest.raises(ValueError):
+    bd.Range('year').compile()
+
+
+def test_query_args():
+  q = bd.Query(text='sky', where=bd.Ne('tag', 'x'), where_document={'$contains': 'blue'})
+  args = q.as_args()
+  assert {'tag': {'$ne': 'x'}} == args['where']
+  assert {'$contains': 'blue'} == args['where_document']
+  assert 'where' not in bd.Query(text='sky').as_args()
+
+
+def test_query_args_mixed():
+  args = bd.Query(text='sky', where=bd.Eq('a', 1) & bd.Contains('x') & bd.Eq('b', 2),
+      where_document=bd.NotContains('y')).as_args()
+  assert {'$and': [{'a': {'$eq': 1}}, {'b': {'$eq': 2}}]} == args['where']
+  assert {'$and': [{'$contains': 'x'}, {'$not_contains': 'y'}]} == args['where_document']
+  args = bd.Query(text='sky', where_document=bd.Contains('x') & bd.Eq('a', 1)).as_args()
+  assert ({'a': {'$eq': 1}}, {'$contains': 'x'}) == (args['where'], args['where_document'])
+  with pytest.raises(ValueError):
+    bd.Query(text='sky', where=bd.Eq('a', 1) | bd.Contains('x')).as_args()
+
+
+def test_match_where():
+  from badinka._filters import match_where, match_document
+  meta = {'source': 'a.txt', 'year': 2005}
+  assert match_where((bd.Eq('source', 'a.txt') & bd.Range('year', 2000, 2010)).compile(), meta)
+  assert match_where({'source': 'a.txt'}, meta)
+  assert not match_where((bd.Gt('year', 2005) | bd.In('source', ['b.txt'])).compile(), meta)
+  assert not match_where(bd.Ne('tag', 'x').compile(), meta)
+  assert not match_where(bd.Gt('source', 1).compile(), meta)
+  assert match_document((bd.Contains('sky') & bd.NotContains('red')).compile(), 'the sky is blue')
+
+
+def test_filtered_query(store):
+  store.extend([bd.Document(content=f'red thing {i}', meta={'n': i}) for i in range(10)])
+  r = store.query(bd.Query(text='red thing', where=bd.Range('n', 3, 5)))
+  assert [3, 4, 5] == sorted(d.meta['n'] for d in r)
+  r = store.query(bd.Query(text='red thing', where_document=bd.Contains('thing 7')))
+  assert ['red thing 7'] == [d.content for d in r]
+  r = store.query(bd.Query(text='red thing', where=bd.Range('n', 3, 5) & bd.NotContains('thing 4')))
+  assert [3, 5] == sorted(d.meta['n'] for d in r)
+  assert 1 == len(store.get_where(bd.Contains('thing 2') & bd.Gte('n', 0)))
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=120
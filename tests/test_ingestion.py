@@ -0,0 +1,151 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+
+import pytest
+import badinka as bd
+
+from conftest import WordEmbeddings
+
+
+text = ''.join(f'The sky is blue {i} times. Grass is green. ' for i in range(50))
+
+
+def test_text_loader_segments(tmp_path):
+  p = tmp_path / 'a.txt'
+  p.write_text(text)
+  segments = list(bd.TextLoader(segment_size=100).read(str(p)))
+  assert text == ''.join(s.text for s in segments)
+  for s in segments:
+    assert text[s.offset:s.offset + len(s.text)] == s.text
+    assert s.text.endswith('. ')
+
+
+def test_loader_abstract():
+  with pytest.raises(TypeError):
+    bd.Loader()
+
+
+def test_jsonl_loader(tmp_path):
+  p = tmp_path / 'a.jsonl'
+  p.write_text('\n'.join(json.dumps({'content': f'doc {i}', 'n': i})
+                         for i in range(5)))
+  loader = bd.JsonlLoader(segment_size=20)
+  segments = [s for raw in loader.read(str(p)) for s in loader.parse(raw)]
+  assert ['doc 0', 'doc 1', 'doc 2', 'doc 3', 'doc 4'] == [s.text for s in segments]
+  assert [0, 1, 2, 3, 4] == [s.meta['line'] for s in segments]
+  text = p.read_text()
+  assert [text.index(json.dumps({'content': f'doc {i}', 'n': i})) for i in range(5)] == [s.offset for s in segments]
+  assert all(s.byte_offset is None for s in segments)
+  assert 3 == segments[3].meta['n']
+
+
+def test_pipeline(tmp_path, store):
+  src = tmp_path / 'src'
+  src.mkdir()
+  (src / 'a.txt').write_text(text)
+  (src / 'b.md').write_text('# Title\n\nSome text. More text.\n')
+  (src / 'c.bin').write_text('ignored')
+  p = bd.Pipeline(store, batch_size=4, workers=0)
+  report = p.run([str(src)])
+  assert 2 == report.files
+  stored = store.collection().get(include=['metadatas'])
+  assert report.documents == len(stored['ids'])
+  assert {str(src / 'a.txt'), str(src / 'b.md')} == {m['source'] for m in stored['metadatas']}
+  p.run([str(src)])
+  assert report.documents == len(store)
+
+
+def test_pipeline_workers(tmp_path, store):
+  src = tmp_path / 'src'
+  src.mkdir()
+  (src / 'a.txt').write_text('One. Two.\n\nThree. Four.\n')
+  (src / 'b.md').write_text('# Title\n\nSome text. More text.\n')
+  bd.Pipeline(store, collection_name='inline', workers=0).run([str(src)])
+  report = bd.Pipeline(store, workers=1).run([str(src)])
+  assert 2 == report.files
+  assert report.documents == len(store)
+  assert sorted(store.all(collection_name='inline').contents) == sorted(store.all().contents)
+
+
+def test_pipeline_parents(tmp_path, store):
+  (tmp_path / 'a.txt').write_text('One. Two.\n\nThree. Four.\n')
+  p = bd.Pipeline(store, chunker=bd.ParentChunker(), batch_size=3, workers=0)
+  calls = store.embedding_function.function.calls
+  assert 4 == p.run([str(tmp_path)]).documents
+  assert 4 == len(store)
+  assert 2 == store.parent_collection().count()
+  assert calls + 2 == store.embedding_function.function.calls
+  found = store.expand(store.query(bd.Query(text='Four.', n_results=4)))
+  assert ['Three. Four.', 'One. Two.'] == found.contents
+
+
+def test_pipeline_content_references(tmp_path, store):
+  text = 'Première phrase.\r\nDeuxième phrase. Troisième phrase.\r\n\r\nQuatrième phrase.'
+  (tmp_path / 'a.txt').write_bytes(text.encode('utf-8'))
+  bd.Pipeline(store, collection_name='plain', workers=0).run([str(tmp_path)])
+  store.config.content_references = True
+  bd.Pipeline(store, workers=0).run([str(tmp_path)])
+  stored = store.collection().get(include=['documents'])['documents']
+  assert all(d.startswith('\0ref:') for d in stored)
+  docs = store.all()
+  assert sorted(store.all(collection_name='plain').contents) == sorted(docs.contents)
+  assert any('\r\n' in c for c in docs.contents)
+  found = store.query(bd.Query(text=docs.contents[0], n_results=1))
+  assert docs.contents[0] == found[0].content
+  assert 1 == store.update([bd.Document(content='Corrected text', id=found[0].id, embeddings=[1.0] * 64)])
+  assert 'Corrected text' == store.get([found[0].id])[0].content
+  assert 1 == store.update([bd.Document(content='Corrected text', id=found[0].id, meta={'checked': True})])
+  assert 'Corrected text' == store.get([found[0].id])[0].content
+
+
+def test_content_references_relative_path(tmp_path, monkeypatch):
+  (tmp_path / 'sub').mkdir()
+  (tmp_path / 'sub' / 'a.txt').write_text('The sky is blue. Grass is green.')
+  (tmp_path / 'elsewhere').mkdir()
+  config = bd.Config(vector_store_path=f'numpy://{tmp_path / "store"}', content_references=True)
+  ds = bd.DocumentStore(config)
+  ds.embedding_function.function = WordEmbeddings()
+  monkeypatch.chdir(tmp_path)
+  bd.Pipeline(ds, workers=0).run(['sub/a.txt'])
+  monkeypatch.chdir(tmp_path / 'elsewhere')
+  contents = bd.DocumentStore(config).all().contents
+  assert contents
+  assert all(c in 'The sky is blue. Grass is green.' for c in contents)
+
+
+def test_source_files_concurrent(tmp_path):
+  from concurrent.futures import ThreadPoolExecutor
+  from badinka._references import SourceFiles, reference
+  refs = []
+  for i in range(4):
+    (tmp_path / f'{i}.txt').write_text(f'file {i} ' * 100)
+    refs.append(reference(str(tmp_path / f'{i}.txt'), 0, 6))
+  files = SourceFiles(max_open=1)
+  with ThreadPoolExecutor(4) as pool:
+    contents = list(pool.map(files.resolve, refs * 500))
+  assert [f'file {i}' for i in range(4)] * 500 == contents
+  files.close()
+
+
+def test_pipeline_errors(tmp_path, store):
+  (tmp_path / 'a.jsonl').write_text('not json\n')
+  p = bd.Pipeline(store, workers=0)
+  with pytest.raises(json.JSONDecodeError):
+    p.run([str(tmp_path)])
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=120
@@ -0,0 +1,71 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import badinka as bd
+from badinka._ranking import reciprocal_rank_fusion
+
+
+def test_bm25_ranking():
+  index = bd.LexicalIndex()
+  index.add(['a', 'b', 'c'], [
+      'the error code E1234 was raised',
+      'the error was raised again and again',
+      'nothing to see here',
+  ])
+  hits = index.search('error E1234')
+  assert ['a', 'b'] == [id for id, _ in hits]
+  assert hits[0][1] > hits[1][1]
+
+
+def test_bm25_replace_and_remove():
+  index = bd.LexicalIndex()
+  index.add(['a', 'b'], ['apples', 'pears'])
+  index.add(['a'], ['oranges'])
+  assert [] == index.search('apples')
+  index.remove(['a', 'missing'])
+  assert 1 == len(index)
+  assert [] == index.search('oranges')
+  assert index.total_length == 1
+
+
+def test_reciprocal_rank_fusion():
+  assert ['b', 'a', 'd', 'c'] == reciprocal_rank_fusion([['a', 'b', 'c'], ['b', 'd']])
+
+
+def test_hybrid_query(store):
+  store.extend([bd.Document(content=f'ordinary document number {i}') for i in range(20)])
+  store.append(bd.Document(content='part XJ-42 failed', id='rare'))
+  r = store.query(bd.Query(text='ordinary XJ-42', n_results=3, hybrid=True))
+  assert 3 == len(r)
+  assert 'rare' in r.ids
+  store.append(bd.Document(content='another XJ-42 report', id='later'))
+  assert 'later' in [id for id, _ in store.lexical().search('XJ')]
+
+
+def test_hybrid_query_filters(store):
+  store.extend([bd.Document(content=f'ordinary document number {i}', meta={'n': i}) for i in range(5)])
+  store.append(bd.Document(content='part XJ-42 failed', id='rare', meta={'n': 100}))
+  r = store.query(bd.Query(text='XJ-42', hybrid=True, where=bd.Lt('n', 10)))
+  assert 'rare' not in r.ids
+
+
+def test_hybrid_query_embeddings(store):
+  store.extend([bd.Document(content=f'ordinary document number {i}') for i in range(5)])
+  embeddings = store.embed_queries(['number 3'])[0]
+  r = store.query(bd.Query(embeddings=embeddings, n_results=2, hybrid=True))
+  assert store.query(bd.Query(embeddings=embeddings, n_results=2)).ids == r.ids
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=120
@@ -0,0 +1,65 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+import pytest
+import badinka as bd
+from badinka._backends import NumpyCollection
+
+
+rng = np.random.default_rng(0)
+vectors = rng.normal(size=(500, 32)).astype(np.float32)
+
+
+@pytest.mark.parametrize('codec, size', [(bd.Codec(), 128), (bd.Float16Codec(), 64), (bd.Int8Codec(), 36),
+                                         (bd.Int8Codec(dims=16), 20)])
+def test_codec_roundtrip(codec, size):
+  codes = codec.encode(vectors)
+  assert size == codes[0].nbytes
+  decoded = codec.decode(codes)
+  expected = vectors[:, :codec.dims]
+  assert expected.shape == decoded.shape
+  assert np.abs(decoded - expected).max() < 0.05
+
+
+def test_compact_collection(tmp_path):
+  c = NumpyCollection('test', path=str(tmp_path), codec=bd.Int8Codec(dims=24), rerank=4)
+  c.add(ids=[str(i) for i in range(len(vectors))], embeddings=vectors)
+  r = c.query(query_embeddings=vectors[:5], n_results=3, include=['distances', 'embeddings'])
+  assert ['0', '1', '2', '3', '4'] == [ids[0] for ids in r['ids']]
+  assert 0 == r['distances'][0][0]
+  assert vectors[0].tolist() == r['embeddings'][0][0].tolist()
+  reopened = NumpyCollection('test', path=str(tmp_path))
+  assert 'int8' == reopened.codec.name
+  assert ['3'] == reopened.query(query_embeddings=vectors[3:4], n_results=1)['ids'][0]
+
+
+def test_cache_codec(tmp_path):
+  path = str(tmp_path / 'cache')
+  cache = bd.EmbeddingCache(path, codec=bd.Float16Codec())
+  cache.update([(b'k' * 16, [0.5, 0.25])])
+  assert [0.5, 0.25] == bd.EmbeddingCache(path, codec=bd.Float16Codec()).get(b'k' * 16).tolist()
+  with pytest.raises(ValueError):
+    bd.EmbeddingCache(path)
+
+
+def test_evaluate_codecs():
+  reports = bd.evaluate_codecs(vectors, vectors[:20] + 0.1, k=5)
+  assert [('float16', 0), ('float16', 4), ('int8', 0), ('int8', 4)] == [(r.codec, r.rerank) for r in reports]
+  assert all(r.recall > 0.8 for r in reports)
+  assert [64, 64, 36, 36] == [r.bytes_per_vector for r in reports]
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=120
@@ -0,0 +1,81 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import badinka as bd
+from badinka._ranking import maximal_marginal_relevance
+
+
+embeddings = [[1.0, 0.0], [0.99, 0.01], [0.0, 1.0]]
+
+
+def test_mmr_prefers_diverse():
+  assert [0, 2] == maximal_marginal_relevance([0.1, 0.2, 0.3], embeddings, 2, diversity=0.5)
+
+
+def test_mmr_relevance_only():
+  assert [0, 1] == maximal_marginal_relevance([0.1, 0.2, 0.3], embeddings, 2, diversity=0.0)
+
+
+def test_mmr_unknown_distances():
+  assert [0, 2] == maximal_marginal_relevance([0.1, None, 0.3], embeddings, 2, diversity=0.5)
+
+
+def _chunk(id, start, end, text, source='a.txt'):
+  return id, text, {'source': source, 'start': start, 'end': end}
+
+
+def test_collapse():
+  rows = [
+      _chunk('b', 10, 20, 'klmnopqrst'),
+      _chunk('x', 0, 5, 'other', source='b.txt'),
+      _chunk('a', 0, 15, 'abcdefghijklmno'),
+      _chunk('c', 21, 25, 'vwxy'),
+      _chunk('d', 40, 45, 'far'),
+  ]
+  ds = bd.DocumentList(ids=[r[0] for r in rows], contents=[r[1] for r in rows],
+                       metas=[r[2] for r in rows], distances=[0.2, 0.3, 0.1, 0.4, 0.5])
+  c = ds.collapse()
+  assert ['b', 'x', 'd'] == c.ids
+  assert 'abcdefghijklmnopqrst vwxy' == c.contents[0]
+  assert (0, 25) == (c.metas[0]['start'], c.metas[0]['end'])
+  assert 0.1 == c.distances[0]
+
+
+def test_injection_select():
+  i = bd.Injection(n_results=2, diversity=0.5)
+  q = i.as_query('sky')
+  assert 8 == q.n_results
+  assert 'embeddings' in q.include
+  ds = bd.DocumentList(ids=['a', 'b', 'c'], contents=['x', 'y', 'z'],
+                       distances=[0.1, 0.2, 0.3], embeddings=embeddings)
+  assert ['a', 'c'] == i.select(ds).ids
+  assert ['a', 'b'] == bd.Injection(n_results=2).select(ds).ids
+
+
+def test_injection_thresholds():
+  ds = bd.DocumentList(ids=['a', 'b', 'c', 'd'], contents=['w', 'x', 'y', 'z'], distances=[0.2, 0.3, None, 0.9])
+  assert 0.3 == ds[1].distance
+  i = bd.Injection(n_results=3, max_distance=0.5)
+  assert 'distances' in i.as_query('sky').include
+  assert ['a', 'b', 'c'] == i.select(ds).ids
+  assert ['a', 'c'] == bd.Injection(max_distance_ratio=1.2).select(ds).ids
+  assert ['c'] == bd.Injection(max_distance=0.1).select(ds).ids
+  assert [] == bd.Injection(max_distance=0.1).select(ds[:2]).ids
+  ip = bd.DocumentList(ids=['a', 'b', 'c', 'd'], contents=['w', 'x', 'y', 'z'], distances=[-10.0, -8.5, -7.5, 0.0])
+  assert ['a', 'b'] == ip.within(max_distance_ratio=1.2).ids
+  assert ['d'] == ip[3:].within(max_distance_ratio=1.2).ids
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=120
@@ -0,0 +1,72 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import badinka as bd
+from badinka._sharding import shard_of
+
+from conftest import WordEmbeddings
+
+
+def _store(path, shards, processes=0):
+  ds = bd.DocumentStore(bd.Config(vector_store_path=f'numpy://{path}', vector_store_shards=shards,
+                                  vector_store_processes=processes))
+  ds.embedding_function.function = WordEmbeddings()
+  return ds
+
+
+def _docs(n):
+  return [bd.Document(content=f'document number {i}', id=str(i), embeddings=[float(i), 1.0]) for i in range(n)]
+
+
+def test_shard_of():
+  assert [shard_of(str(i), 4) for i in range(20)] == [shard_of(str(i), 4) for i in range(20)]
+  assert {0, 1, 2, 3} == {shard_of(str(i), 4) for i in range(100)}
+
+
+def test_sharded_query(tmp_path):
+  ds = _store(tmp_path, 3)
+  ds.extend(_docs(30))
+  assert 30 == len(ds)
+  assert 3 == len([c for c in ds.backend.names() if c.startswith('default.')])
+  r = ds.query(bd.Query(embeddings=[7.2, 1.0], n_results=3))
+  assert ['7', '8', '6'] == r.ids
+  assert r.distances == sorted(r.distances)
+  assert 30 == len({d.id for d in ds.iter_documents(batch_size=7)})
+
+
+def test_reshard(tmp_path):
+  ds = _store(tmp_path, 1)
+  ds.extend(_docs(30))
+  ds = _store(tmp_path, 3)
+  assert 30 == ds.reshard()
+  assert 30 == len(ds)
+  assert 0 == ds.backend.collection('default', None).count()
+  ds = _store(tmp_path, 2)
+  moved = ds.reshard()
+  assert 0 < moved < 30
+  assert 30 == len(ds)
+  assert 0 == ds.reshard()
+  assert ['4'] == ds.query(bd.Query(embeddings=[4.0, 1.0], n_results=1)).ids
+
+
+def test_sharded_processes(tmp_path):
+  ds = _store(tmp_path, 2, processes=1)
+  ds.extend(_docs(10))
+  assert ['3'] == ds.query(bd.Query(embeddings=[3.0, 1.0], n_results=1)).ids
+  ds.upsert([bd.Document(content='new', id='new', embeddings=[3.1, 1.0])])
+  assert ['new'] == ds.query(bd.Query(embeddings=[3.1, 1.0], n_results=1)).ids
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=120
@@ -0,0 +1,52 @@
+# Copyright 2024 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+import badinka as bd
+
+
+def test_evaluate_index_settings():
+  rng = np.random.default_rng(0)
+  vectors = rng.normal(size=(2000, 32)).astype(np.float32)
+  settings = [bd.IndexSettings(m=4, ef_construction=16, ef_search=4),
+              bd.IndexSettings(m=16, ef_construction=100, ef_search=200)]
+  reports = bd.evaluate_index_settings(vectors, vectors[:20], settings=settings)
+  assert [r.settings for r in reports] == settings
+  assert reports[0].recall < reports[1].recall
+  assert reports[1].recall > 0.9
+  assert all(0 < r.p50 <= r.p99 for r in reports)
+  assert reports[1] == bd.recommend_index_settings(reports, target_recall=0.9)
+  assert reports[1] == bd.recommend_index_settings(reports, target_recall=1.1)
+
+
+def test_index_settings(store):
+  store.set_index_settings(bd.IndexSettings(space='cosine', m=8), collection_name='cosine')
+  store.extend([bd.Document(content='a', embeddings=[1.0, 0.0]), bd.Document(content='b', embeddings=[10.0, 1.0])],
+      collection_name='cosine')
+  r = store.query(bd.Query(embeddings=[0.1, 0.0], n_results=1), collection_name='cosine')
+  assert 'a' == r[0].content
+  assert r.distances[0] < 1e-6
+  assert 'l2' == store.settings().space
+
+
+def test_evaluate_index(store):
+  vectors = np.random.default_rng(0).normal(size=(50, 8))
+  store.extend([bd.Document(content=f'doc {i}', embeddings=v.tolist()) for i, v in enumerate(vectors)])
+  reports = store.evaluate_index(settings=[bd.IndexSettings(ef_search=50)], queries=10, k=5)
+  assert 1 == len(reports)
+  assert reports[0].recall > 0.9
+
+
+# vim: ft=python sw=2 ts=2 sts=2 tw=120